@@ -0,0 +1,218 @@
+"""
+Work out who a list of system numbers belong to.
+
+Imports, searches and session uploads start with a list of system numbers and need to know
+for each one whether it is a User, an UnregisteredUser or someone we only know about from
+the Masterpoints Centre (MPC). resolve_system_numbers does this for the whole list at once:
+
+- Users and UnregisteredUsers are one query each, however long the list is.
+- Answers from the MPC are kept in memory (per process) for MPC_CACHE_TIMEOUT seconds. Names
+  don't change often and the same people turn up in import after import.
+- Numbers the MPC doesn't know about are saved in UnknownSystemNumber (so all processes can
+  see them) for UNKNOWN_SYSTEM_NUMBER_DAYS, so a typo in a file isn't looked up every time.
+- Whatever is left is looked up in the MPC. The MPC has no batch lookup so we do these in
+  parallel.
+
+If the MPC can't be reached we say nothing about those numbers (they are left out of the
+results) and we don't remember them as unknown.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.utils import timezone
+
+from accounts.models import User, UnregisteredUser, UnknownSystemNumber
+from cobalt.settings import ALL_SYSTEM_ACCOUNTS
+from masterpoints.factories import masterpoint_factory_creator
+
+logger = logging.getLogger("cobalt")
+
+MPC_CACHE_SIZE = 5000
+""" most MPC answers to keep in memory, least recently used are dropped first """
+
+MPC_CACHE_TIMEOUT = 60 * 60 * 24
+""" seconds to keep an MPC answer in memory """
+
+UNKNOWN_SYSTEM_NUMBER_DAYS = 7
+""" days before we ask the MPC again about a number it didn't know """
+
+MPC_LOOKUP_THREADS = 8
+""" most MPC lookups to have running at once """
+
+_mpc_cache = OrderedDict()
+""" system_number -> (time cached, details) """
+_mpc_cache_lock = threading.Lock()
+
+
+def _mpc_cache_get(system_numbers):
+    """Return the cached MPC details we have for these system numbers"""
+
+    found = {}
+    expired_before = time.monotonic() - MPC_CACHE_TIMEOUT
+
+    with _mpc_cache_lock:
+        for system_number in system_numbers:
+            entry = _mpc_cache.get(system_number)
+            if not entry:
+                continue
+
+            cached_at, details = entry
+            if cached_at < expired_before:
+                del _mpc_cache[system_number]
+                continue
+
+            _mpc_cache.move_to_end(system_number)
+            found[system_number] = details
+
+    return found
+
+
+def _mpc_cache_set(details_by_system_number):
+    """Add MPC details to the cache, dropping the oldest if it is full"""
+
+    cached_at = time.monotonic()
+
+    with _mpc_cache_lock:
+        for system_number, details in details_by_system_number.items():
+            _mpc_cache[system_number] = (cached_at, details)
+            _mpc_cache.move_to_end(system_number)
+
+        while len(_mpc_cache) > MPC_CACHE_SIZE:
+            _mpc_cache.popitem(last=False)
+
+
+def clear_mpc_cache():
+    """Forget the MPC details held in memory by this process"""
+
+    with _mpc_cache_lock:
+        _mpc_cache.clear()
+
+
+def _lookup_mpc(system_numbers, mp_source):
+    """Look up system numbers in the MPC in parallel
+
+    Returns:
+        dict: system_number -> details for numbers the MPC knows
+        list: system numbers the MPC says it doesn't know
+    """
+
+    def _lookup(system_number):
+        try:
+            return system_number, mp_source.system_number_details(system_number), True
+        except Exception as exc:  # noqa - anything from requests or the file
+            logger.warning(f"Unable to look up {system_number} in the MPC: {exc}")
+            return system_number, None, False
+
+    found = {}
+    unknown = []
+
+    with ThreadPoolExecutor(
+        max_workers=min(MPC_LOOKUP_THREADS, len(system_numbers))
+    ) as executor:
+        for system_number, details, answered in executor.map(_lookup, system_numbers):
+            if details:
+                found[system_number] = details
+            elif answered:
+                unknown.append(system_number)
+
+    return found, unknown
+
+
+def _save_unknown_system_numbers(looked_up, unknown):
+    """Update UnknownSystemNumber after asking the MPC about looked_up"""
+
+    UnknownSystemNumber.objects.filter(system_number__in=looked_up).delete()
+    UnknownSystemNumber.objects.bulk_create(
+        [UnknownSystemNumber(system_number=system_number) for system_number in unknown],
+        ignore_conflicts=True,
+    )
+
+
+def resolve_system_numbers(
+    system_numbers,
+    use_mpc=True,
+    include_system_accounts=False,
+    include_internal=False,
+    mp_source=None,
+):
+    """Find the User, UnregisteredUser or MPC details for a list of system numbers
+
+    A User takes precedence over an UnregisteredUser if somehow both exist. User and
+    UnregisteredUser objects have is_user or is_un_reg set on them.
+
+    Args:
+        system_numbers (iterable): system numbers (int) to look up, duplicates are fine
+        use_mpc (bool): look up numbers we don't have in the MPC. If False, only the database is used
+        include_system_accounts (bool): include system accounts such as TBA and EVERYONE
+        include_internal (bool): include UnregisteredUsers with club internal system numbers
+        mp_source (MasterpointFactory): where to get MPC data, defaults to masterpoint_factory_creator()
+
+    Returns:
+        dict: keyed by system number, of {"type": "User" | "UnregisteredUser" | "MPC", "value": object}.
+        For MPC the value is a dict with GivenNames, Surname and IsActive (bool). Numbers we
+        can't find are not included.
+    """
+
+    system_numbers = set(system_numbers)
+    results = {}
+
+    if not system_numbers:
+        return results
+
+    users = User.objects.filter(system_number__in=system_numbers)
+    if not include_system_accounts:
+        users = users.exclude(pk__in=ALL_SYSTEM_ACCOUNTS)
+
+    for user in users:
+        user.is_user = True
+        results[user.system_number] = {"type": "User", "value": user}
+
+    remaining = system_numbers - set(results)
+    if remaining:
+        un_reg_manager = (
+            UnregisteredUser.all_objects
+            if include_internal
+            else UnregisteredUser.objects
+        )
+        for un_reg in un_reg_manager.filter(system_number__in=remaining):
+            un_reg.is_un_reg = True
+            results[un_reg.system_number] = {
+                "type": "UnregisteredUser",
+                "value": un_reg,
+            }
+
+    remaining -= set(results)
+    if not use_mpc or not remaining:
+        return results
+
+    # MPC answers we already have
+    mpc_details = _mpc_cache_get(remaining)
+    remaining -= set(mpc_details)
+
+    # Numbers the MPC recently told us it doesn't know
+    if remaining:
+        remaining -= set(
+            UnknownSystemNumber.objects.filter(
+                system_number__in=remaining,
+                checked_date__gte=timezone.now()
+                - timedelta(days=UNKNOWN_SYSTEM_NUMBER_DAYS),
+            ).values_list("system_number", flat=True)
+        )
+
+    # Ask the MPC about the rest
+    if remaining:
+        found, unknown = _lookup_mpc(
+            sorted(remaining), mp_source or masterpoint_factory_creator()
+        )
+        _mpc_cache_set(found)
+        _save_unknown_system_numbers(remaining, unknown)
+        mpc_details.update(found)
+
+    for system_number, details in mpc_details.items():
+        results[system_number] = {"type": "MPC", "value": dict(details)}
+
+    return results
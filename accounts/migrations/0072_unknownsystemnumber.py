@@ -0,0 +1,38 @@
+# Generated by Django 3.2.19 on 2026-10-19 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0071_remove_user_share_with_clubs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnknownSystemNumber",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "system_number",
+                    models.IntegerField(unique=True, verbose_name="ABF Number"),
+                ),
+                (
+                    "checked_date",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Last Checked"
+                    ),
+                ),
+            ],
+        ),
+    ]
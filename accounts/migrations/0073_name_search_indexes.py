@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# Indexes for the member search (see accounts/search.py). Django generates
+# UPPER("first_name"::text) LIKE UPPER(...) for istartswith and icontains, so the
+# trigram indexes have to be on the same UPPER() expression to be used. The global
+# search (support migration 0014) uses the User ones too.
+#
+# The user tables are big and busy, so the indexes are built CONCURRENTLY, which
+# can't be done inside a transaction.
+
+NAME_INDEXES = [
+    ("accounts_user_first_name_upper_trgm", "accounts_user", "first_name"),
+    ("accounts_user_last_name_upper_trgm", "accounts_user", "last_name"),
+    (
+        "accounts_unregistereduser_first_name_upper_trgm",
+        "accounts_unregistereduser",
+        "first_name",
+    ),
+    (
+        "accounts_unregistereduser_last_name_upper_trgm",
+        "accounts_unregistereduser",
+        "last_name",
+    ),
+]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0072_unknownsystemnumber"),
+        # enables pg_trgm
+        ("notifications", "0053_add_email_to_index"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin (UPPER("{column}"::text) gin_trgm_ops);',
+            reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {name};",
+        )
+        for name, table, column in NAME_INDEXES
+    ]
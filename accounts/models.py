@@ -401,6 +401,19 @@ class NextInternalSystemNumber(models.Model):
         return number >= cls._first_number
 
 
+class UnknownSystemNumber(models.Model):
+    """System numbers that the Masterpoints Centre didn't know about when we last asked.
+    Used by accounts.identity so we don't keep asking about the same bad numbers
+    (e.g. typos in an import file). Entries are ignored after UNKNOWN_SYSTEM_NUMBER_DAYS
+    in case the number has been issued since."""
+
+    system_number = models.IntegerField(f"{GLOBAL_ORG} Number", unique=True)
+    checked_date = models.DateTimeField("Last Checked", default=timezone.now)
+
+    def __str__(self):
+        return f"{self.system_number} - {self.checked_date}"
+
+
 class SystemCard(models.Model):
     """System cards for users"""
 
@@ -0,0 +1,54 @@
+""" Name search for Users and UnregisteredUsers
+
+    The member search widgets search on every keystroke, matching the start of the first
+    and/or last name. Django turns istartswith into UPPER("last_name"::text) LIKE UPPER('smi%'),
+    so accounts migration 0073 adds trigram (pg_trgm) GIN indexes on UPPER(first_name) and
+    UPPER(last_name) for both tables, which Postgres uses for these instead of scanning
+    the whole table. The same indexes serve icontains, used by the global search.
+
+    search_by_name is one query. Results are ranked by trigram similarity so the closest
+    names come first, and we fetch one more row than we need to tell if there are more
+    rather than counting.
+"""
+from django.contrib.postgres.search import TrigramSimilarity
+
+NAME_SEARCH_LIMIT = 10
+""" default number of matches to return """
+
+
+def search_by_name(queryset, first_name=None, last_name=None, limit=NAME_SEARCH_LIMIT):
+    """Search a queryset of User or UnregisteredUser by the start of the first and/or last name
+
+    Args:
+        queryset (QuerySet): Users or UnregisteredUsers to search, with any exclusions already applied
+        first_name (str): start of the first name, optional
+        last_name (str): start of the last name, optional
+        limit (int): most matches to return
+
+    Returns:
+        list: up to limit matches, best first
+        bool: True if there were more matches than limit
+    """
+
+    ranks = []
+
+    if first_name:
+        queryset = queryset.filter(first_name__istartswith=first_name)
+        ranks.append(TrigramSimilarity("first_name", first_name))
+
+    if last_name:
+        queryset = queryset.filter(last_name__istartswith=last_name)
+        ranks.append(TrigramSimilarity("last_name", last_name))
+
+    if not ranks:
+        return [], False
+
+    rank = ranks[0] if len(ranks) == 1 else ranks[0] + ranks[1]
+
+    matches = list(
+        queryset.annotate(rank=rank).order_by("-rank", "last_name", "first_name", "pk")[
+            : limit + 1
+        ]
+    )
+
+    return matches[:limit], len(matches) > limit
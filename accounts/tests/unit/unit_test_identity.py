@@ -0,0 +1,98 @@
+from accounts.identity import resolve_system_numbers, clear_mpc_cache
+from accounts.models import UnregisteredUser, UnknownSystemNumber
+from tests.test_manager import CobaltTestManagerUnit
+
+UN_REG_NUMBER = 987654301
+KNOWN_UNKNOWN_NUMBER = 987654302
+MPC_NUMBER = 987654303
+UNKNOWN_NUMBER = 987654304
+
+
+class _FakeMasterpoints:
+    """Masterpoints source that only knows MPC_NUMBER and records what it is asked"""
+
+    def __init__(self):
+        self.asked = []
+
+    def system_number_details(self, system_number):
+        self.asked.append(system_number)
+        if system_number == MPC_NUMBER:
+            return {"GivenNames": "Mary Jane", "Surname": "Mpc", "IsActive": True}
+        return None
+
+
+class IdentityTests:
+    """Unit tests for resolving system numbers to users"""
+
+    def __init__(self, manager: CobaltTestManagerUnit):
+        self.manager = manager
+
+    def resolve_system_numbers(self):
+        """Users, unregistered users and MPC users found in bulk, MPC only asked when it needs to be"""
+
+        clear_mpc_cache()
+
+        UnregisteredUser(
+            system_number=UN_REG_NUMBER,
+            first_name="Una",
+            last_name="Registered",
+            origin="Manual",
+            last_updated_by=self.manager.alan,
+        ).save()
+        UnknownSystemNumber(system_number=KNOWN_UNKNOWN_NUMBER).save()
+
+        mp_source = _FakeMasterpoints()
+        system_numbers = [
+            self.manager.alan.system_number,
+            UN_REG_NUMBER,
+            KNOWN_UNKNOWN_NUMBER,
+            MPC_NUMBER,
+            UNKNOWN_NUMBER,
+        ]
+
+        results = resolve_system_numbers(system_numbers, mp_source=mp_source)
+        types = {
+            system_number: results[system_number]["type"] for system_number in results
+        }
+
+        self.manager.save_results(
+            status=types
+            == {
+                self.manager.alan.system_number: "User",
+                UN_REG_NUMBER: "UnregisteredUser",
+                MPC_NUMBER: "MPC",
+            },
+            test_name="Resolve system numbers - types",
+            test_description="Resolve a user, an unregistered user, an MPC user and two unknown numbers",
+            output=f"Got {types}",
+        )
+
+        self.manager.save_results(
+            status=sorted(mp_source.asked) == [MPC_NUMBER, UNKNOWN_NUMBER],
+            test_name="Resolve system numbers - MPC lookups",
+            test_description="Only numbers we don't have and that aren't known to be unknown go to the MPC",
+            output=f"MPC was asked about {mp_source.asked}",
+        )
+
+        self.manager.save_results(
+            status=UnknownSystemNumber.objects.filter(
+                system_number=UNKNOWN_NUMBER
+            ).exists(),
+            test_name="Resolve system numbers - unknown saved",
+            test_description="A number the MPC doesn't know is remembered",
+            output=f"UnknownSystemNumber for {UNKNOWN_NUMBER} not found",
+        )
+
+        # Second time around the MPC shouldn't be asked anything
+        mp_source.asked = []
+        results = resolve_system_numbers(system_numbers, mp_source=mp_source)
+
+        self.manager.save_results(
+            status=not mp_source.asked
+            and results[MPC_NUMBER]["value"]["GivenNames"] == "Mary Jane",
+            test_name="Resolve system numbers - cached",
+            test_description="Resolve the same numbers again, everything should come from the caches",
+            output=f"MPC was asked about {mp_source.asked}. MPC result {results.get(MPC_NUMBER)}",
+        )
+
+        clear_mpc_cache()
@@ -5,6 +5,7 @@ from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from fcm_django.models import FCMDevice
 
+from accounts.identity import resolve_system_numbers
 from accounts.models import User, UnregisteredUser
 from cobalt.settings import ALL_SYSTEM_ACCOUNTS
 from masterpoints.views import search_mpc_users_by_name
@@ -136,40 +137,33 @@ def search_for_user_in_cobalt_and_mpc(
     # A user might not be in the top 11 of registered or unregistered users, but could still be in the top
     # 11 of MPC users, in which case they will be reported incorrectly
     # There can be no overlap between registered and unregistered, so just double check the MPC ones
-    check_user_list = [mpc_user["ABFNumber"] for mpc_user in mpc_users[:10]]
-
-    # Check real users
-    really_registered = User.objects.filter(system_number__in=check_user_list)
-    for registered_user in really_registered:
-        if registered_user.system_number not in already_present:
-            user_list.append(
-                {
-                    "system_number": registered_user.system_number,
-                    "first_name": registered_user.first_name,
-                    "last_name": registered_user.last_name,
-                    "home_club": None,
-                    "source": "registered",
-                }
-            )
-            already_present.append(registered_user.system_number)
-
-    # Check real un_registered
-    really_un_registered = UnregisteredUser.objects.filter(
-        system_number__in=check_user_list
+    check_user_list = [int(mpc_user["ABFNumber"]) for mpc_user in mpc_users[:10]]
+    identities = resolve_system_numbers(
+        check_user_list, use_mpc=False, include_system_accounts=True
     )
-    for un_registered_user in really_un_registered[:10]:
-        if un_registered_user.system_number not in already_present:
-            user_list.append(
-                {
-                    "system_number": un_registered_user.system_number,
-                    "first_name": un_registered_user.first_name,
-                    "last_name": un_registered_user.last_name,
-                    # "mpc_email": un_registered_user.email,
-                    "home_club": None,
-                    "source": "unregistered",
-                }
-            )
-            already_present.append(un_registered_user.system_number)
+
+    # Check real users, then real un_registered
+    for source, identity_type in [
+        ("registered", "User"),
+        ("unregistered", "UnregisteredUser"),
+    ]:
+        for system_number in check_user_list:
+            identity = identities.get(system_number)
+            if (
+                identity
+                and identity["type"] == identity_type
+                and system_number not in already_present
+            ):
+                user_list.append(
+                    {
+                        "system_number": system_number,
+                        "first_name": identity["value"].first_name,
+                        "last_name": identity["value"].last_name,
+                        "home_club": None,
+                        "source": source,
+                    }
+                )
+                already_present.append(system_number)
 
     for mpc_user in mpc_users[:10]:
         if int(mpc_user["ABFNumber"]) not in already_present:
@@ -12,17 +12,18 @@ from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 
 from accounts.forms import UserRegisterForm
+from accounts.identity import resolve_system_numbers
 from accounts.models import User, UnregisteredUser
 from accounts.tokens import account_activation_token
 from cobalt.settings import GLOBAL_TITLE, ALL_SYSTEM_ACCOUNTS
 from logs.views import log_event
 from masterpoints.factories import masterpoint_factory_creator
-from masterpoints.views import user_summary
 from notifications.views.core import send_cobalt_email_with_template
 from organisations.models import Organisation
 from organisations.views.general import replace_unregistered_user_with_real_user
 from organisations.club_admin_core import (
     club_email_for_member,
+    club_emails_for_members,
     get_club_member_list_for_emails,
 )
 
@@ -379,17 +380,21 @@ def add_un_registered_user_with_mpc_data(
     """Add an unregistered user to the system. Called from the player import if the user isn't already
     in the system"""
 
+    identity = resolve_system_numbers(
+        [system_number], include_system_accounts=True
+    ).get(system_number)
+
+    if not identity:
+        return None, None
+
     # do nothing if user already exists
-    if User.objects.filter(system_number=system_number).exists():
+    if identity["type"] == "User":
         return "user", None
-    if UnregisteredUser.objects.filter(system_number=system_number).exists():
+    if identity["type"] == "UnregisteredUser":
         return "un_reg", None
 
-    # Get data from the MPC
-    details = user_summary(system_number)
-
-    if not details:
-        return None, None
+    # Data from the MPC
+    details = identity["value"]
 
     # Create user
     UnregisteredUser(
@@ -466,34 +471,57 @@ def get_email_address_and_name_from_system_number(
     return club_email, un_reg.first_name
 
 
-def get_users_or_unregistered_users_from_system_number_list(system_number_list):
-    """takes a list of system numbers and returns a dictionary of User or UnregisteredUser objects
-    indexed by system_number
+def get_email_addresses_and_names_from_system_numbers(
+    system_numbers, club=None, requestor=None
+):
+    """Set based version of get_email_address_and_name_from_system_number for many
+    system numbers, using a fixed number of queries
+
+    Returns:
+        dict: system number to (email address, first name). System numbers with no
+        email address that we can use are not included
     """
 
-    # Get Users and UnregisteredUsers
-    users = User.objects.filter(system_number__in=system_number_list)
-    un_regs = UnregisteredUser.objects.filter(system_number__in=system_number_list)
+    results = {}
+    found_users = set()
 
-    # Convert to a dictionary
-    mixed_dict = {}
+    users = User.objects.filter(system_number__in=system_numbers).exclude(
+        id__in=ALL_SYSTEM_ACCOUNTS
+    )
 
     for user in users:
-        user.is_user = True
-        mixed_dict[user.system_number] = {
-            "type": "User",
-            "value": user,
-        }
+        found_users.add(user.system_number)
+        # Check if this is allowed
+        if requestor == "results" and user.receive_email_results is False:
+            continue
+        results[user.system_number] = (user.email, user.first_name)
 
-    # Add unregistered to dictionary
-    for un_reg in un_regs:
-        un_reg.is_un_reg = True
-        mixed_dict[un_reg.system_number] = {
-            "type": "UnregisteredUser",
-            "value": un_reg,
-        }
+    # No good finding name but not email address
+    if not club:
+        return results
 
-    return mixed_dict
+    un_regs = UnregisteredUser.objects.filter(system_number__in=system_numbers).exclude(
+        system_number__in=found_users
+    )
+    un_reg_names = {un_reg.system_number: un_reg.first_name for un_reg in un_regs}
+
+    club_emails = club_emails_for_members(club, list(un_reg_names))
+
+    for system_number, first_name in un_reg_names.items():
+        if club_emails.get(system_number):
+            results[system_number] = (club_emails[system_number], first_name)
+
+    return results
+
+
+def get_users_or_unregistered_users_from_system_number_list(system_number_list):
+    """takes a list of system numbers and returns a dictionary of User or UnregisteredUser objects
+    indexed by system_number
+    """
+
+    return resolve_system_numbers(
+        system_number_list, use_mpc=False, include_system_accounts=True
+    )
 
 
 def get_users_or_unregistered_users_from_email_list(email_list):
@@ -6,6 +6,7 @@ from django.template.loader import render_to_string
 from django.views.decorators.http import require_POST
 
 from accounts.models import User, UnregisteredUser
+from accounts.search import search_by_name
 from cobalt.settings import (
     RBAC_EVERYONE,
     TBA_PLAYER,
@@ -15,6 +16,9 @@ from cobalt.settings import (
 )
 from masterpoints.views import search_mpc_users_by_name
 
+AJAX_SEARCH_LIMIT = 30
+""" most matches shown by the older ajax searches """
+
 
 @login_required()
 def member_search_ajax(request):
@@ -59,30 +63,26 @@ def member_search_ajax(request):
         else:
             exclude_list = [request.user.id, RBAC_EVERYONE, TBA_PLAYER]
 
-        if search_first_name and search_last_name:
-            members = User.objects.filter(
-                first_name__istartswith=search_first_name,
-                last_name__istartswith=search_last_name,
-            ).exclude(pk__in=exclude_list)
-            mpc_members = search_mpc_users_by_name(search_first_name, search_last_name)
-        elif search_last_name:
-            members = User.objects.filter(
-                last_name__istartswith=search_last_name
-            ).exclude(pk__in=exclude_list)
-            mpc_members = search_mpc_users_by_name("", search_last_name)
-        else:
-            members = User.objects.filter(
-                first_name__istartswith=search_first_name
-            ).exclude(pk__in=exclude_list)
-            mpc_members = search_mpc_users_by_name(search_first_name, "")
+        members, more_data = search_by_name(
+            User.objects.exclude(pk__in=exclude_list),
+            search_first_name,
+            search_last_name,
+            limit=AJAX_SEARCH_LIMIT,
+        )
 
-        homes = {int(mpc["ABFNumber"]): mpc["ClubName"] for mpc in mpc_members}
+        # Only worth asking the MPC for home clubs if we have someone to show
+        homes = {}
+        if members and not more_data:
+            mpc_members = search_mpc_users_by_name(
+                search_first_name or "", search_last_name or ""
+            )
+            homes = {int(mpc["ABFNumber"]): mpc["ClubName"] for mpc in mpc_members}
 
         if request.is_ajax:
-            if members.count() > 30:
-                msg = "Too many results (%s)" % members.count()
+            if more_data:
+                msg = f"Too many results (more than {AJAX_SEARCH_LIMIT})"
                 members = None
-            elif members.count() == 0:
+            elif not members:
                 msg = f"No matches found. Have they registered for {GLOBAL_TITLE}? Registration is free."
             html = render_to_string(
                 template_name="accounts/search/search_results_ajax.html",
@@ -191,32 +191,19 @@ def member_search_htmx(request):
         exclude_list,
     ) = _get_exclude_list_and_base_values(request)
 
-    if last_name_search and first_name_search:
-        name_list = (
-            base_queryset.filter(last_name__istartswith=last_name_search)
-            .filter(first_name__istartswith=first_name_search)
-            .exclude(pk__in=exclude_list)
-        )
-        # COB-469 - include home club where possible
-        mpc_members = search_mpc_users_by_name(first_name_search, last_name_search)
-    elif last_name_search:
-        name_list = base_queryset.filter(
-            last_name__istartswith=last_name_search
-        ).exclude(pk__in=exclude_list)
-        mpc_members = search_mpc_users_by_name("", last_name_search)
-    else:
-        name_list = base_queryset.filter(
-            first_name__istartswith=first_name_search
-        ).exclude(pk__in=exclude_list)
-        mpc_members = search_mpc_users_by_name(first_name_search, "")
-
-    homes = {int(mpc["ABFNumber"]): mpc["ClubName"] for mpc in mpc_members}
+    name_list, more_data = search_by_name(
+        base_queryset.exclude(pk__in=exclude_list),
+        first_name_search,
+        last_name_search,
+    )
 
-    # See if there is more data
-    more_data = False
-    if name_list.count() > 10:
-        more_data = True
-        name_list = name_list[:10]
+    # COB-469 - include home club where possible
+    homes = {}
+    if name_list:
+        mpc_members = search_mpc_users_by_name(
+            first_name_search or "", last_name_search or ""
+        )
+        homes = {int(mpc["ABFNumber"]): mpc["ClubName"] for mpc in mpc_members}
 
     return render(
         request,
@@ -250,6 +237,10 @@ def system_number_search_htmx(request):
             # "<span class='cobalt-form-error''>Enter a number to look up, or type in the name fields</span>"
         )
 
+    # Partly typed or not a number, no point asking the database
+    if not system_number or not system_number.isdigit():
+        return HttpResponse("No match found")
+
     # Get exclude list etc
     (
         include_me,
@@ -448,25 +439,18 @@ def search_ajax(request):
         else:
             search_first_name = None
 
-        if search_first_name and search_last_name:
-            members = User.objects.filter(
-                first_name__istartswith=search_first_name,
-                last_name__istartswith=search_last_name,
-            ).exclude(pk=request.user.id)
-        elif search_last_name:
-            members = User.objects.filter(
-                last_name__istartswith=search_last_name
-            ).exclude(pk=request.user.id)
-        else:
-            members = User.objects.filter(
-                first_name__istartswith=search_first_name
-            ).exclude(pk=request.user.id)
+        members, more_data = search_by_name(
+            User.objects.exclude(pk=request.user.id),
+            search_first_name,
+            search_last_name,
+            limit=AJAX_SEARCH_LIMIT,
+        )
 
         if request.is_ajax:
-            if members.count() > 30:
-                msg = "Too many results (%s)" % members.count()
+            if more_data:
+                msg = f"Too many results (more than {AJAX_SEARCH_LIMIT})"
                 members = None
-            elif members.count() == 0:
+            elif not members:
                 msg = f"No matches found. Have they registered for {GLOBAL_TITLE}? Registration is free."
             html = render_to_string(
                 template_name="accounts/search/search_results.html",
@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        """Called when Django starts up. Registers signals to remove tokens from the
+        token cache (see api/core.py) when they are changed or deleted."""
+
+        # Can't import at top of file - Django won't be ready yet
+        from django.db.models.signals import post_save, post_delete
+        from accounts.models import APIToken
+        from api.core import api_token_revoke
+
+        def _revoke_cached_token(sender, instance, **kwargs):
+            api_token_revoke(instance.token)
+
+        for signal in [post_save, post_delete]:
+            signal.connect(
+                _revoke_cached_token,
+                sender=APIToken,
+                dispatch_uid=f"api_token_cache_{signal}",
+            )
@@ -1,9 +1,23 @@
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection
 from ninja import NinjaAPI
 
+from accounts.models import APIToken
+from api.models import ApiRateCount
 from rbac.core import rbac_user_has_role
+from utils.views.cobalt_cache import shared_version, shared_version_bump
 
 api = NinjaAPI()
 
+logger = logging.getLogger("cobalt")
+
 
 def api_rbac(request, role):
     """Check if API user has RBAC role"""
@@ -16,3 +30,176 @@ def api_rbac(request, role):
         return False, api.create_response(request, json_payload, status=403)
 
     return True, None
+
+
+# -------------------------------------------------------------------------------------
+#   Token cache
+#
+#   Scorer software and the mobile app call the API constantly, so we cache the user
+#   for each token rather than looking it up on every call. The cache is per process, so
+#   saving or deleting an APIToken (see apps.py) bumps a version shared by all processes
+#   which is part of every key, and a revoked token stops working everywhere within
+#   SHARED_VERSION_LOCAL_SECONDS.
+#
+#   Calls are counted per token per minute. Each process adds up its own calls and adds
+#   them to ApiRateCount every API_RATE_FLUSH_SECONDS, so the counts cover every server
+#   but can be that far behind.
+# -------------------------------------------------------------------------------------
+
+API_TOKEN_CACHE_SECONDS = 60
+API_TOKEN_INVALID_CACHE_SECONDS = 10
+""" also cache bad tokens, but not for long """
+
+API_RATE_MINUTES = 60
+""" how many minutes of call counts to keep for each token """
+
+API_RATE_FLUSH_SECONDS = 10
+""" how often each process adds its call counts to the database """
+
+_INVALID_TOKEN = "invalid"
+
+
+def _token_cache_key(token):
+    return (
+        f"api_token:{shared_version('api_token')}:"
+        f"{hashlib.sha256(token.encode()).hexdigest()}"
+    )
+
+
+def api_token_lookup(token):
+    """Return the APIToken (with user loaded) for a token string, or None"""
+
+    if not token:
+        return None
+
+    cache_key = _token_cache_key(token)
+    api_token = cache.get(cache_key)
+
+    if api_token == _INVALID_TOKEN:
+        return None
+
+    if api_token is None:
+        api_token = APIToken.objects.select_related("user").filter(token=token).first()
+
+        if api_token:
+            cache.set(cache_key, api_token, API_TOKEN_CACHE_SECONDS)
+        else:
+            cache.set(cache_key, _INVALID_TOKEN, API_TOKEN_INVALID_CACHE_SECONDS)
+
+    return api_token
+
+
+def api_token_revoke(token):
+    """Remove a token from the cache. Call after changing or deleting an APIToken.
+    Every process drops all of its cached tokens, tokens change rarely."""
+
+    cache.delete(_token_cache_key(token))
+    shared_version_bump("api_token")
+
+
+_pending_calls = Counter()
+""" (api_token_id, minute) -> calls counted by this process since the last flush """
+
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+_last_purge_minute = 0
+
+
+def _current_minute():
+    return int(time.time() // 60)
+
+
+def api_rate_count(api_token):
+    """Count a call for this token in the current minute"""
+
+    with _pending_lock:
+        _pending_calls[(api_token.id, _current_minute())] += 1
+        flush_now = time.monotonic() - _last_flush >= API_RATE_FLUSH_SECONDS
+
+    if flush_now:
+        flush_api_rate_counts()
+
+
+def flush_api_rate_counts():
+    """Add the calls counted by this process to ApiRateCount. Never raises"""
+
+    global _pending_calls, _last_flush, _last_purge_minute
+
+    with _pending_lock:
+        pending = _pending_calls
+        _pending_calls = Counter()
+        _last_flush = time.monotonic()
+
+    if not pending:
+        return
+
+    table = ApiRateCount._meta.db_table
+    rows = [
+        (api_token_id, minute, calls)
+        for (api_token_id, minute), calls in pending.items()
+    ]
+
+    try:
+        # Add to the counts from other processes in one statement
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (api_token_id, minute, calls)
+                VALUES {", ".join(["(%s, %s, %s)"] * len(rows))}
+                ON CONFLICT (api_token_id, minute)
+                DO UPDATE SET calls = {table}.calls + EXCLUDED.calls
+                """,
+                [value for row in rows for value in row],
+            )
+
+        this_minute = _current_minute()
+        if this_minute - _last_purge_minute >= API_RATE_MINUTES:
+            ApiRateCount.objects.filter(
+                minute__lte=this_minute - API_RATE_MINUTES
+            ).delete()
+            _last_purge_minute = this_minute
+
+    except Exception as exc:  # noqa
+        logger.error(f"Unable to save API call counts: {exc}")
+
+
+atexit.register(flush_api_rate_counts)
+
+
+def api_rate_summary(api_tokens):
+    """Return call counts for a list of APITokens as a list of dictionaries with
+    api_token, this_minute, last_5_minutes and last_hour, busiest first"""
+
+    # Include what we have so far from this process too
+    flush_api_rate_counts()
+
+    this_minute = _current_minute()
+
+    counts = {}
+    for rate_count in ApiRateCount.objects.filter(
+        api_token__in=api_tokens,
+        minute__gt=this_minute - API_RATE_MINUTES,
+        minute__lte=this_minute,
+    ):
+        counts[(rate_count.api_token_id, rate_count.minute)] = rate_count.calls
+
+    summary = []
+    for api_token in api_tokens:
+
+        def _calls(since):
+            return sum(
+                calls
+                for (api_token_id, minute), calls in counts.items()
+                if api_token_id == api_token.id and minute > this_minute - since
+            )
+
+        summary.append(
+            {
+                "api_token": api_token,
+                "this_minute": _calls(1),
+                "last_5_minutes": _calls(5),
+                "last_hour": _calls(API_RATE_MINUTES),
+            }
+        )
+
+    return sorted(summary, key=lambda item: item["last_hour"], reverse=True)
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.15 on 2026-10-19 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0073_name_search_indexes"),
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ApiRateCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("minute", models.IntegerField()),
+                ("calls", models.IntegerField(default=0)),
+                (
+                    "api_token",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="accounts.apitoken",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("api_token", "minute")},
+            },
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.db import models
 
-from accounts.models import User
+from accounts.models import User, APIToken
 
 
 class ApiLog(models.Model):
@@ -13,3 +13,18 @@ class ApiLog(models.Model):
 
     def __str__(self):
         return f"{self.api} - {self.version} - {self.admin} - {self.created_date}"
+
+
+class ApiRateCount(models.Model):
+    """Number of calls made with a token in one minute, see api.core.api_rate_count"""
+
+    api_token = models.ForeignKey(APIToken, on_delete=models.CASCADE)
+    minute = models.IntegerField()
+    """ minutes since the epoch """
+    calls = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("api_token", "minute")
+
+    def __str__(self):
+        return f"{self.api_token} - {self.minute} - {self.calls}"
@@ -0,0 +1,55 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import APIToken
+from api.core import api_token_lookup
+from tests.test_manager import CobaltTestManagerIntegration
+
+
+class TokenCacheTests:
+    """Unit tests for the API token cache"""
+
+    def __init__(self, manager: CobaltTestManagerIntegration):
+        self.manager = manager
+
+    def token_cache(self):
+        """A cached token costs no queries and a revoked token is looked up again"""
+
+        api_token = APIToken(user=self.manager.fiona)
+        api_token.save()
+
+        # Cold then warm
+        api_token_lookup(api_token.token)
+        with CaptureQueriesContext(connection) as context:
+            found = api_token_lookup(api_token.token)
+
+        self.manager.save_results(
+            status=found == api_token and len(context) == 0,
+            test_name="API token cache - warm",
+            test_description="Look up the same token twice, the second time should not use the database",
+            output=f"Found {found}. Queries on second look up: {len(context)}",
+        )
+
+        # Bad tokens are cached too
+        api_token_lookup("not a real token")
+        with CaptureQueriesContext(connection) as context:
+            found = api_token_lookup("not a real token")
+
+        self.manager.save_results(
+            status=found is None and len(context) == 0,
+            test_name="API token cache - invalid",
+            test_description="Look up a bad token twice, the second time should not use the database",
+            output=f"Found {found}. Queries on second look up: {len(context)}",
+        )
+
+        # Deleting the token takes it out of the cache
+        token = api_token.token
+        api_token.delete()
+        found = api_token_lookup(token)
+
+        self.manager.save_results(
+            status=found is None,
+            test_name="API token cache - revoked",
+            test_description="Delete a cached token, it should no longer be found",
+            output=f"Found {found}",
+        )
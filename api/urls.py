@@ -8,8 +8,10 @@ import urllib.parse
 from ninja import NinjaAPI
 from ninja.errors import ValidationError
 
-from accounts.models import User, APIToken
+from accounts.models import User
+from utils.views.cobalt_buffer import CobaltWriteBuffer
 from .apis import router as cobalt_router
+from .core import api_token_lookup, api_rate_count
 from ninja.security import (
     APIKeyQuery,
     APIKeyHeader,
@@ -23,13 +25,18 @@ from .models import ApiLog
 logger = logging.getLogger("cobalt")
 
 
+_api_log_buffer = CobaltWriteBuffer(ApiLog, max_size=100, max_seconds=10)
+""" ApiLog rows waiting to be written """
+
+
 def log_api_call(request, user=None):
-    """Log a call to the API. For anonymous calls the user will be empty"""
+    """Log a call to the API. For anonymous calls the user will be empty.
+    Calls are buffered and written in bulk, so created_date is when they are written"""
 
     # All API calls are versioned. Log call details. Throw error if version not set
     url_parts = urllib.parse.urlparse(request.path)
     path_parts = url_parts[2].rpartition("/")
-    ApiLog(api=path_parts[0], version=path_parts[2], admin=user).save()
+    _api_log_buffer.add(ApiLog(api=path_parts[0], version=path_parts[2], admin=user))
 
 
 class AuthCheck:
@@ -38,8 +45,9 @@ class AuthCheck:
 
     def authenticate(self, request, key):
         """Returns the user associated with this key or None (invalid)"""
-        api_key = APIToken.objects.filter(token=key).first()
+        api_key = api_token_lookup(key)
         if api_key:
+            api_rate_count(api_key)
             log_api_call(request, api_key.user)
             return api_key.user
 
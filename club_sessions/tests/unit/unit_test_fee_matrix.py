@@ -0,0 +1,185 @@
+from decimal import Decimal
+
+from club_sessions.models import (
+    Session,
+    SessionType,
+    SessionEntry,
+    SessionTypePaymentMethod,
+    SessionTypePaymentMethodMembership,
+)
+from club_sessions.views.core import (
+    SessionFeeMatrix,
+    bridge_credits_for_club,
+    get_session_fee_for_player,
+    SITOUT,
+    PLAYING_DIRECTOR,
+)
+from organisations.models import Organisation, MembershipType, MemberMembershipType
+from payments.models import OrgPaymentMethod
+from tests.test_manager import CobaltTestManagerIntegration
+
+MEMBER = 100
+GUEST = 101
+NO_PAYMENT_METHOD = 102
+
+# Fees we set up for the session type, by membership (None is Guest) and payment method
+MEMBER_BRIDGE_CREDITS_FEE = Decimal("4.50")
+MEMBER_CASH_FEE = Decimal(6)
+GUEST_BRIDGE_CREDITS_FEE = Decimal("9.25")
+GUEST_CASH_FEE = Decimal(11)
+
+
+class SessionFeeMatrixTests:
+    """Unit tests for pricing a whole session at once with SessionFeeMatrix"""
+
+    def __init__(self, manager: CobaltTestManagerIntegration):
+        self.manager = manager
+
+        # load static
+        self.club = Organisation.objects.filter(name="Payments Bridge Club").first()
+        self.bridge_credits = bridge_credits_for_club(self.club)
+        self.cash = OrgPaymentMethod.objects.filter(
+            active=True, organisation=self.club, payment_method="Cash"
+        ).first()
+
+        # our own session type and fees, so we know what the answers should be
+        session_type = SessionType(organisation=self.club, name="Fee Matrix Test")
+        session_type.save()
+
+        membership_type = MembershipType(
+            organisation=self.club,
+            name="Fee Matrix Test",
+            last_modified_by=self.manager.alan,
+        )
+        membership_type.save()
+
+        MemberMembershipType(
+            system_number=MEMBER,
+            membership_type=membership_type,
+            membership_state=MemberMembershipType.MEMBERSHIP_STATE_CURRENT,
+            last_modified_by=self.manager.alan,
+        ).save()
+
+        for payment_method, member_fee, guest_fee in [
+            (self.bridge_credits, MEMBER_BRIDGE_CREDITS_FEE, GUEST_BRIDGE_CREDITS_FEE),
+            (self.cash, MEMBER_CASH_FEE, GUEST_CASH_FEE),
+        ]:
+            session_type_payment_method = SessionTypePaymentMethod(
+                session_type=session_type, payment_method=payment_method
+            )
+            session_type_payment_method.save()
+            for membership, fee in [(membership_type, member_fee), (None, guest_fee)]:
+                SessionTypePaymentMethodMembership(
+                    session_type_payment_method=session_type_payment_method,
+                    membership=membership,
+                    fee=fee,
+                ).save()
+
+        # create a session
+        self.session = Session(
+            director=self.manager.alan,
+            session_type=session_type,
+            description="Testing fee matrix",
+            default_secondary_payment_method=self.cash,
+        )
+        self.session.save()
+
+        # create a table of entries, plus one with no payment method
+        self.session_entries = {}
+        for seat, system_number, payment_method in [
+            ("N", MEMBER, self.bridge_credits),
+            ("S", GUEST, self.cash),
+            ("E", SITOUT, self.bridge_credits),
+            ("W", PLAYING_DIRECTOR, self.bridge_credits),
+            ("N", NO_PAYMENT_METHOD, None),
+        ]:
+            session_entry = SessionEntry(
+                session=self.session,
+                system_number=system_number,
+                pair_team_number=1 if system_number != NO_PAYMENT_METHOD else 2,
+                seat=seat,
+                payment_method=payment_method,
+                fee=-99,
+            )
+            session_entry.save()
+            self.session_entries[system_number] = session_entry
+
+    def _expected(self, member_fee, guest_fee):
+        """fees we expect by entry id, with the member and guest paying these"""
+
+        return {
+            self.session_entries[MEMBER].id: member_fee,
+            self.session_entries[GUEST].id: guest_fee,
+            self.session_entries[SITOUT].id: Decimal(0),
+            self.session_entries[PLAYING_DIRECTOR].id: Decimal(0),
+            self.session_entries[NO_PAYMENT_METHOD].id: Decimal(-99),
+        }
+
+    def fee_matrix_tests(self):
+        """Check the fees against the ones we set up"""
+
+        session_entries = list(self.session_entries.values())
+
+        fee_matrix = SessionFeeMatrix(self.session, self.club)
+        fees = fee_matrix.fees_for_entries(session_entries)
+        expected = self._expected(MEMBER_BRIDGE_CREDITS_FEE, GUEST_CASH_FEE)
+
+        self.manager.save_results(
+            status=fees == expected,
+            test_name="Bulk fees",
+            test_description="Price a table with fees_for_entries. Member pays member rate, guest pays guest rate, sit outs and directors are free and no payment method is -99",
+            output=f"Expected: {expected}. Got: {fees}",
+        )
+
+        single_fees = {
+            session_entry.id: get_session_fee_for_player(session_entry, self.club)
+            for session_entry in session_entries
+        }
+
+        self.manager.save_results(
+            status=single_fees == expected,
+            test_name="Single player fees",
+            test_description="Price each entry with get_session_fee_for_player",
+            output=f"Expected: {expected}. Got: {single_fees}",
+        )
+
+        # Re-price the whole session with cash
+        fee_matrix.reprice_entries(
+            SessionEntry.objects.filter(session=self.session).exclude(
+                system_number=NO_PAYMENT_METHOD
+            ),
+            payment_method=self.cash,
+        )
+
+        saved_fees = {
+            session_entry.id: session_entry.fee
+            for session_entry in SessionEntry.objects.filter(session=self.session)
+        }
+        expected = self._expected(MEMBER_CASH_FEE, GUEST_CASH_FEE)
+
+        self.manager.save_results(
+            status=saved_fees == expected,
+            test_name="Re-price session saves fees",
+            test_description="Change everyone to cash with reprice_entries and check the fees in the database",
+            output=f"Expected: {expected}. Saved: {saved_fees}",
+        )
+
+        # A payment method with no fee set up for the session type is an error, not free
+        session_entry = SessionEntry.objects.get(
+            session=self.session, system_number=MEMBER
+        )
+        session_entry.payment_method = OrgPaymentMethod.objects.get_or_create(
+            organisation=self.club, payment_method="No Fee Test"
+        )[0]
+
+        try:
+            fee = fee_matrix.fee_for_entry(session_entry)
+        except ValueError as exc:
+            fee = exc
+
+        self.manager.save_results(
+            status=isinstance(fee, ValueError),
+            test_name="Missing fee is an error",
+            test_description="Price an entry with a payment method that has no fee for the session type",
+            output=f"Payment method {session_entry.payment_method}. Expected a ValueError, got: {fee}",
+        )
@@ -9,13 +9,13 @@ import logging
 from django.db import transaction
 from django.db.models import Sum, Max
 
+from accounts.identity import resolve_system_numbers
 from accounts.models import User, UnregisteredUser
 from club_sessions.models import (
     SessionEntry,
     SessionTypePaymentMethodMembership,
     SessionMiscPayment,
     Session,
-    SessionTypePaymentMethod,
 )
 from cobalt.settings import (
     GLOBAL_ORG,
@@ -26,17 +26,13 @@ from cobalt.settings import (
     SUPPORT_EMAIL,
     GLOBAL_TITLE,
 )
-from masterpoints.factories import masterpoint_factory_creator
 from masterpoints.views import abf_checksum_is_valid
 from notifications.views.core import (
     send_cobalt_email_to_system_number,
     send_cobalt_email_with_template,
 )
 from organisations.models import ClubLog, Organisation
-from organisations.club_admin_core import (
-    get_membership_type_for_players,
-    get_membership_type,
-)
+from organisations.club_admin_core import get_membership_type_for_players
 from payments.models import OrgPaymentMethod, MemberTransaction, UserPendingPayment
 from payments.views.core import (
     org_balance,
@@ -238,37 +234,118 @@ def get_session_fees_for_session(session):
     return session_fees
 
 
-def get_session_fee_for_player(session_entry: SessionEntry, club: Organisation):
-    """return correct fee for a player"""
-
-    if session_entry.system_number in [PLAYING_DIRECTOR, SITOUT]:
-        return Decimal(0)
+class SessionFeeMatrix:
+    """Fees for a whole session, loaded once so that we can price any number of entries
+    without going back to the database for each player.
 
-    # Get session
-    session = session_entry.session
+    The matrix is keyed the same way as get_session_fees_for_session (membership name, then
+    payment method name) and uses get_membership_type_for_players to map system numbers
+    to membership names. Anyone without an active membership is a Guest.
 
-    # Get membership for this player. None for Guests
-    membership = get_membership_type(club, session_entry.system_number)
+    Args:
+        session (Session): the session to price
+        club (Organisation): the club running the session
+        system_number_list (list): optional list of system numbers to load memberships for.
+            Defaults to everyone in the session.
+    """
 
-    # Check if we have a payment method
-    if not session_entry.payment_method:
-        session_entry.payment_method = session.default_secondary_payment_method
+    def __init__(self, session: Session, club: Organisation, system_number_list=None):
+        self.session = session
+        self.club = club
 
-    # Get session type and payment method
-    session_type_payment_method = SessionTypePaymentMethod.objects.filter(
-        session_type=session.session_type, payment_method=session_entry.payment_method
-    ).first()
+        if system_number_list is None:
+            system_number_list = SessionEntry.objects.filter(
+                session=session
+            ).values_list("system_number", flat=True)
 
-    # Finally get the fee
-    session_type_payment_method_membership = (
-        SessionTypePaymentMethodMembership.objects.filter(
-            session_type_payment_method=session_type_payment_method
+        self.session_fees = get_session_fees_for_session(session)
+        self.membership_type_dict = get_membership_type_for_players(
+            club, system_number_list
         )
-        .filter(membership=membership)
-        .first()
+
+    def membership_for_system_number(self, system_number):
+        """return the membership name used to look up fees for this player"""
+
+        return self.membership_type_dict.get(system_number, "Guest")
+
+    def fee_for_entry(self, session_entry: SessionEntry):
+        """return correct fee for a single entry.
+
+        Entries without a payment method can't be priced yet and get -99, the same as a new
+        entry. calculate_payment_method_and_balance picks their payment method (Bridge
+        Credits for Users) and prices them later.
+
+        Raises ValueError if the session type has no fee for this membership and payment
+        method, rather than letting the player play for nothing."""
+
+        if session_entry.system_number in [PLAYING_DIRECTOR, SITOUT]:
+            return Decimal(0)
+
+        if not session_entry.payment_method:
+            return Decimal(-99)
+
+        membership = self.membership_for_system_number(session_entry.system_number)
+        payment_method = session_entry.payment_method.payment_method
+
+        fee = self.session_fees.get(membership, {}).get(payment_method)
+
+        if fee is None:
+            logger.error(
+                f"{self.session.session_type} at {self.club} has no fee for {membership} "
+                f"paying by {payment_method}"
+            )
+            raise ValueError(
+                f"No fee set for {membership} paying by {payment_method} in session type "
+                f"{self.session.session_type}"
+            )
+
+        return fee
+
+    def fees_for_entries(self, session_entries):
+        """return fees for a list or queryset of session entries as a dictionary
+
+        e.g. {session_entry.id: Decimal(5)}
+
+        """
+
+        return {
+            session_entry.id: self.fee_for_entry(session_entry)
+            for session_entry in session_entries
+        }
+
+    def reprice_entries(self, session_entries, payment_method=None):
+        """Set the fee (and optionally the payment method) on session entries and write
+        them back with a single bulk_update. Returns the list of updated entries.
+
+        Fees come from fee_for_entry, so entries without a payment method are left at -99."""
+
+        session_entries = list(session_entries)
+
+        for session_entry in session_entries:
+            if payment_method:
+                session_entry.payment_method = payment_method
+
+            session_entry.fee = self.fee_for_entry(session_entry)
+
+        SessionEntry.objects.bulk_update(session_entries, ["payment_method", "fee"])
+
+        return session_entries
+
+
+def get_session_fee_for_player(session_entry: SessionEntry, club: Organisation):
+    """return correct fee for a player
+
+    For more than one player build a SessionFeeMatrix and use fees_for_entries instead.
+    """
+
+    if session_entry.system_number in [PLAYING_DIRECTOR, SITOUT]:
+        return Decimal(0)
+
+    fee_matrix = SessionFeeMatrix(
+        session_entry.session, club, [session_entry.system_number]
     )
 
-    return session_type_payment_method_membership.fee
+    return fee_matrix.fee_for_entry(session_entry)
 
 
 def get_extras_as_total_for_session_entries(
@@ -483,6 +560,9 @@ def calculate_payment_method_and_balance(session_entries, session_fees, club):
 
     bridge_credit_payment_method = bridge_credits_for_club(club)
 
+    # Collect changed entries so we can write them back with one bulk_update
+    changed_session_entries = []
+
     # Go through and add balance to session entries
     for session_entry in session_entries:
 
@@ -510,13 +590,18 @@ def calculate_payment_method_and_balance(session_entries, session_fees, club):
             session_entry_changed = True
 
         if session_entry_changed:
-            session_entry.save()
+            changed_session_entries.append(session_entry)
 
         if session_entry.fee:
             session_entry.total = session_entry.fee + session_entry.extras
         else:
             session_entry.total = "NA"
 
+    if changed_session_entries:
+        SessionEntry.objects.bulk_update(
+            changed_session_entries, ["payment_method", "fee"]
+        )
+
     return session_entries
 
 
@@ -1088,14 +1173,21 @@ def handle_change_secondary_payment_method(
 ):
     """make changes when the secondary payment method is updated"""
 
-    session_entries = (
+    session_entries = list(
         SessionEntry.objects.filter(session=session, payment_method=old_method)
         .exclude(system_number__in=[PLAYING_DIRECTOR, SITOUT])
         .exclude(is_paid=True)
     )
+
+    # Change the payment method and re-price everyone affected with one update
+    fee_matrix = SessionFeeMatrix(
+        session,
+        club,
+        [session_entry.system_number for session_entry in session_entries],
+    )
+    fee_matrix.reprice_entries(session_entries, payment_method=new_method)
+
     for session_entry in session_entries:
-        session_entry.payment_method = new_method
-        session_entry.save()
 
         # Handle IOUs
         if new_method.payment_method == "IOU":
@@ -1193,9 +1285,12 @@ def handle_change_session_type(session, administrator):
     if session.status != session.SessionStatus.DATA_LOADED:
         return ". Session type cannot be changed after payments have been made."
 
-    # Update fees on all entries. We can do this by just setting to default -99 and letting
-    # the fees be applied later
-    SessionEntry.objects.filter(session=session).update(fee=-99)
+    # Re-price all entries against the new session type in one go. Anyone without a
+    # payment method gets -99 and is priced when the payment method is set
+    fee_matrix = SessionFeeMatrix(session, session.session_type.organisation)
+    fee_matrix.reprice_entries(
+        SessionEntry.objects.filter(session=session).select_related("payment_method")
+    )
 
     return ". Session rates have been applied."
 
@@ -1440,6 +1535,9 @@ def process_bridge_credits(session_entries, session, club, bridge_credits, extra
     users_qs = User.objects.filter(system_number__in=system_numbers)
     users_by_system_number = {user.system_number: user for user in users_qs}
 
+    # fees - loaded once in case we need to re-price failures
+    fee_matrix = SessionFeeMatrix(session, club, system_numbers)
+
     # loop through and try to make payments
     for session_entry in session_entries:
 
@@ -1485,7 +1583,7 @@ def process_bridge_credits(session_entries, session, club, bridge_credits, extra
                     else f"{session_entry.player_name_from_file} ({GLOBAL_ORG}: {session_entry.system_number})"
                 )
                 session_entry.payment_method = session.default_secondary_payment_method
-                session_entry.fee = get_session_fee_for_player(session_entry, club)
+                session_entry.fee = fee_matrix.fee_for_entry(session_entry)
                 session_entry.save()
 
                 # Also change extras payment method
@@ -1700,6 +1798,8 @@ def change_user_on_session_entry(
     # Non-ABF visitor
     if non_abf_visitor:
         session_entry.system_number = VISITOR
+        if not session_entry.payment_method:
+            session_entry.payment_method = session.default_secondary_payment_method
         session_entry = reset_values_on_session_entry(session_entry, club)
         session_entry.player_name_from_file = (
             f"{member_first_name_search} {member_last_name_search}"
@@ -1714,25 +1814,34 @@ def change_user_on_session_entry(
             # We don't know about this user, so add them. We don't add an email address though
 
             # lookup name from system_number
-            mp_source = masterpoint_factory_creator()
-            status, return_value = mp_source.system_number_lookup_api(system_number)
+            identity = resolve_system_numbers([system_number]).get(system_number)
 
-            if not status:
+            if (
+                not identity
+                or identity["type"] == "User"
+                or (identity["type"] == "MPC" and not identity["value"]["IsActive"])
+            ):
                 return f"Error looking up {GLOBAL_ORG} Number: {system_number}"
 
-            UnregisteredUser(
-                system_number=system_number,
-                last_updated_by=director,
-                last_name=return_value[1],
-                first_name=return_value[0],
-                origin="Manual",
-                added_by_club=club,
-            ).save()
-            ClubLog(
-                organisation=club,
-                actor=director,
-                action=f"Added un-registered user {return_value[0]} {return_value[1]}",
-            ).save()
+            # Only add them if they are new, they could have been added since the search was done
+            if identity["type"] == "MPC":
+                # only use first name from given names
+                first_name = identity["value"]["GivenNames"].split(" ")[0]
+                last_name = identity["value"]["Surname"]
+
+                UnregisteredUser(
+                    system_number=system_number,
+                    last_updated_by=director,
+                    last_name=last_name,
+                    first_name=first_name,
+                    origin="Manual",
+                    added_by_club=club,
+                ).save()
+                ClubLog(
+                    organisation=club,
+                    actor=director,
+                    action=f"Added un-registered user {first_name} {last_name}",
+                ).save()
 
         # Set payment method
         if source in ["mpc", "unregistered"]:
@@ -126,6 +126,11 @@ if AWS_SES_CONFIGURATION_SET_DEFAULT is None:
 else:
     AWS_SES_CONFIGURATION_SET = AWS_SES_configuration_set_selector
 
+# post_office_email_sender_cron - worker processes (one is the priority lane) and
+# the SES maximum send rate in emails per second
+EMAIL_SENDER_PROCESSES = int(set_value("EMAIL_SENDER_PROCESSES", 4))
+EMAIL_SEND_RATE = float(set_value("EMAIL_SEND_RATE", 14))
+
 # Set this to false so we don't need to install m2crypto which needs OS installs to work
 # Not verifying the certificate is lower risk than having us rely on an OS install
 AWS_SES_VERIFY_EVENT_SIGNATURES = False
@@ -154,6 +159,9 @@ USE_SQLITE = set_value("USE_SQLITE", 0)
 XERO_CLIENT_ID = set_value("XERO_CLIENT_ID")
 XERO_CLIENT_SECRET = set_value("XERO_CLIENT_SECRET")
 XERO_TENANT_NAME = "17 Ways"
+# can be pointed at a stub server for testing
+XERO_API_URL = set_value("XERO_API_URL", "https://api.xero.com")
+XERO_IDENTITY_URL = set_value("XERO_IDENTITY_URL", "https://identity.xero.com")
 
 DATABASES = {
     "default": {
@@ -166,6 +174,20 @@ DATABASES = {
     }
 }
 
+# The default cache is in memory, per process, so reading it never costs a query. The
+# shared cache is a database table (created by utils migration 0015) for the few values
+# every process on every node must agree on, see utils/views/cobalt_cache.py
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "cobalt_cache",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+
 # Test Only - Dummy data count
 DUMMY_DATA_COUNT = int(set_value("DUMMY_DATA_COUNT", 20))
 
@@ -173,6 +195,9 @@ DUMMY_DATA_COUNT = int(set_value("DUMMY_DATA_COUNT", 20))
 # Set this to the string "ON" to put site into maintenance mode - only admins can login
 MAINTENANCE_MODE = set_value("MAINTENANCE_MODE", "OFF")
 
+# Fraction of requests to profile for query counts and timings, 0 (default) is off
+SQL_PROFILING_SAMPLE_RATE = float(set_value("SQL_PROFILING_SAMPLE_RATE", 0))
+
 # Recaptcha keys
 RECAPTCHA_SITE_KEY = set_value("RECAPTCHA_SITE_KEY")
 RECAPTCHA_SECRET_KEY = set_value("RECAPTCHA_SECRET_KEY")
@@ -246,6 +271,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "utils.middleware.SqlProfilingMiddleware",
     "utils.middleware.CobaltMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -4,3 +4,80 @@ from django.apps import AppConfig
 
 class DashboardConfig(AppConfig):
     name = "dashboard"
+
+    def ready(self):
+        """Called when Django starts up. Registers signals to remove cached dashboard
+        widgets (see dashboard/widgets.py) when the data behind them changes."""
+
+        # Can't import at top of file - Django won't be ready yet
+        from django.db.models.signals import post_save, post_delete
+        from accounts.models import User
+        from dashboard.widgets import (
+            dashboard_widget_invalidate,
+            dashboard_widget_invalidate_all,
+        )
+        from events.models import BasketItem, EventEntry, EventEntryPlayer
+        from forums.models import ForumFollow
+        from organisations.models import MemberMembershipType
+        from payments.models import MemberTransaction, UserPendingPayment
+        from results.models import ResultsFile
+
+        def _user_ids_for_system_number(system_number):
+            return User.objects.filter(system_number=system_number).values_list(
+                "id", flat=True
+            )
+
+        def _player_ids_for_event_entry(event_entry_id):
+            return EventEntryPlayer.objects.filter(
+                event_entry_id=event_entry_id
+            ).values_list("player_id", flat=True)
+
+        def _member_transaction_changed(sender, instance, **kwargs):
+            dashboard_widget_invalidate("payments", [instance.member_id])
+
+        def _pending_payment_changed(sender, instance, **kwargs):
+            dashboard_widget_invalidate(
+                "payments", _user_ids_for_system_number(instance.system_number)
+            )
+
+        def _event_entry_player_changed(sender, instance, **kwargs):
+            dashboard_widget_invalidate("events", [instance.player_id])
+
+        def _event_entry_changed(sender, instance, **kwargs):
+            # everyone in the entry sees its status and who has it in their cart
+            event_entry_id = (
+                instance.id if sender == EventEntry else instance.event_entry_id
+            )
+            dashboard_widget_invalidate(
+                "events", _player_ids_for_event_entry(event_entry_id)
+            )
+
+        def _membership_changed(sender, instance, **kwargs):
+            dashboard_widget_invalidate(
+                "events", _user_ids_for_system_number(instance.system_number)
+            )
+
+        def _forum_follow_changed(sender, instance, **kwargs):
+            dashboard_widget_invalidate("forums", [instance.user_id])
+
+        def _results_file_changed(sender, **kwargs):
+            dashboard_widget_invalidate_all("results")
+
+        receivers = [
+            (_member_transaction_changed, MemberTransaction),
+            (_pending_payment_changed, UserPendingPayment),
+            (_event_entry_player_changed, EventEntryPlayer),
+            (_event_entry_changed, EventEntry),
+            (_event_entry_changed, BasketItem),
+            (_membership_changed, MemberMembershipType),
+            (_forum_follow_changed, ForumFollow),
+            (_results_file_changed, ResultsFile),
+        ]
+
+        for signal in [post_save, post_delete]:
+            for receiver, sender in receivers:
+                signal.connect(
+                    receiver,
+                    sender=sender,
+                    dispatch_uid=f"dashboard_widget_{sender.__name__}_{signal}",
+                )
@@ -10,4 +10,10 @@ urlpatterns = [
     path("help", views.help, name="help"),
     path("scroll1", views.scroll1, name="scroll1"),
     path("scroll2", views.scroll2, name="scroll2"),
+    path("widgets/masterpoints", views.masterpoints_htmx, name="masterpoints_htmx"),
+    path(
+        "widgets/recent-results",
+        views.recent_results_htmx,
+        name="recent_results_htmx",
+    ),
 ]
@@ -14,6 +14,7 @@ from utils.utils import cobalt_paginator
 from forums.models import Post, ForumFollow
 from rbac.core import rbac_user_blocked_for_model
 from django.shortcuts import redirect
+from dashboard.widgets import WidgetTimings, dashboard_widget
 import logging
 
 logger = logging.getLogger("cobalt")
@@ -26,45 +27,112 @@ def dashboard(request):
 
 
 def home(request):
-    """Home page"""
+    """Home page.
+
+    The widgets are cached per user (see widgets.py). Masterpoints and results are
+    loaded afterwards by htmx so the page doesn't wait on them."""
 
     if request.user.is_authenticated:
-        system_number = request.user.system_number
-        masterpoints = get_masterpoints(system_number)
-        payments = get_balance_detail(request.user)
-        posts = get_posts(request)
+        timings = WidgetTimings()
+
+        payments = dashboard_widget(
+            "payments", request.user, _build_payments_widget, timings
+        )
+        events = dashboard_widget("events", request.user, _build_events_widget, timings)
+        posts = get_posts(request, timings)
         posts2 = get_announcements(request)
-        events, unpaid, more_events, total_events = get_events(request.user)
-        recent_results, more_results = get_recent_results(request.user)
-        user_pending_payments = get_user_pending_payments(system_number)
-        pending_memberships = user_has_outstanding_membership_fees(request.user)
 
         # Show tour for this page?
         tour = request.GET.get("tour", None)
 
-        return render(
+        response = render(
             request,
             "dashboard/home.html",
             {
-                "mp": masterpoints,
-                "payments": payments,
+                **payments,
+                **events,
                 "posts": posts,
                 "posts2": posts2,
-                "events": events,
-                "unpaid": unpaid,
-                "more_events": more_events,
-                "total_events": total_events,
-                "recent_results": recent_results,
-                "user_pending_payments": user_pending_payments,
                 "tour": tour,
-                "pending_memberships": pending_memberships,
             },
         )
 
+        return timings.add_header(response)
+
     else:  # not logged in
         return redirect("logged_out")
 
 
+def _build_payments_widget(user):
+    return {
+        "payments": get_balance_detail(user),
+        "user_pending_payments": list(get_user_pending_payments(user.system_number)),
+    }
+
+
+def _build_events_widget(user):
+    events, unpaid, more_events, total_events = get_events(user)
+    return {
+        "events": list(events),
+        "unpaid": unpaid,
+        "more_events": more_events,
+        "total_events": total_events,
+        "pending_memberships": user_has_outstanding_membership_fees(user),
+    }
+
+
+def _build_results_widget(user):
+    recent_results, more_results = get_recent_results(user)
+    return {"recent_results": list(recent_results), "more_results": more_results}
+
+
+def _build_masterpoints_widget(user):
+    return {"mp": get_masterpoints(user.system_number)}
+
+
+def _build_forums_widget(user):
+    """The forums whose posts this user sees under Discussions"""
+
+    # Get users preferences plus default Forums
+    # TODO: ADD EVERYONE
+    forum_list = list(
+        ForumFollow.objects.filter(user=user).values_list("forum", flat=True)
+    )
+
+    # get list of forums user cannot access
+    blocked = list(
+        rbac_user_blocked_for_model(
+            user=user, app="forums", model="forum", action="view"
+        )
+    )
+
+    return {"forum_list": forum_list, "blocked": blocked}
+
+
+@login_required()
+def masterpoints_htmx(request):
+    """Masterpoints box for the dashboard, loaded after the page"""
+
+    timings = WidgetTimings()
+    masterpoints = dashboard_widget(
+        "masterpoints", request.user, _build_masterpoints_widget, timings
+    )
+
+    response = render(request, "dashboard/home_masterpoints_htmx.html", masterpoints)
+    return timings.add_header(response)
+
+
+@login_required()
+def recent_results_htmx(request):
+    """Recent results for the dashboard, loaded after the page"""
+
+    timings = WidgetTimings()
+    results = dashboard_widget("results", request.user, _build_results_widget, timings)
+
+    response = render(request, "dashboard/home_recent_results_htmx.html", results)
+    return timings.add_header(response)
+
+
 def logged_out(request):
     """Home screen for logged out users"""
 
@@ -124,19 +192,12 @@ def get_announcements(request):
     return cobalt_paginator(request, posts_list, 20)
 
 
-def get_posts(request):
+def get_posts(request, timings=None):
     """internal function to get Posts"""
 
-    # Get users preferences plus default Forums
-    # TODO: ADD EVERYONE
-    forum_list = list(
-        ForumFollow.objects.filter(user=request.user).values_list("forum", flat=True)
-    )
-
-    # get list of forums user cannot access
-    blocked = rbac_user_blocked_for_model(
-        user=request.user, app="forums", model="forum", action="view"
-    )
+    forums = dashboard_widget("forums", request.user, _build_forums_widget, timings)
+    forum_list = forums["forum_list"]
+    blocked = forums["blocked"]
 
     # Remove anything blocked
     if forum_list:
@@ -0,0 +1,99 @@
+""" Cached dashboard widgets
+
+    The dashboard is the most visited page after login, so each part of it (a widget)
+    is built once and cached per user for WIDGET_TIMEOUTS[name] seconds.
+
+    Widgets are also invalidated when the data behind them changes, by signals
+    registered in apps.py. Changes for one user delete that user's entry, changes that
+    affect everyone (e.g. new results) bump a version which is part of every key for that
+    widget. Bulk writes (bulk_create, bulk_update, update) don't send signals, so code
+    doing them calls dashboard_widget_invalidate itself, e.g.
+    update_accounts_for_organisations. The widgets are cached per process, so deleting one
+    user's entry only affects this process and the others show theirs until it times
+    out. The timeouts are short for anything involving money for this reason. The
+    version is shared by every process (see utils/views/cobalt_cache.py).
+
+    The masterpoints and results widgets are not built by the home page at all. They
+    are loaded afterwards by htmx so the page never waits on the external masterpoint
+    source.
+
+    Each widget's time (build or cache hit) is added to a Server-Timing header so the
+    breakdown shows up in the browser's developer tools.
+"""
+import logging
+import time
+
+from django.core.cache import cache
+
+from utils.views.cobalt_cache import shared_version, shared_version_bump
+
+logger = logging.getLogger("cobalt")
+
+WIDGET_TIMEOUTS = {
+    "payments": 60,
+    "events": 5 * 60,
+    "forums": 10 * 60,
+    "results": 60 * 60,
+    "masterpoints": 60 * 60,
+}
+""" widget name -> seconds to cache it for """
+
+
+def _widget_key(name, user_id):
+    return f"dashboard_widget:{name}:{user_id}:{shared_version(f'dashboard_widget:{name}')}"
+
+
+class WidgetTimings:
+    """Time taken by each widget for a request, as a Server-Timing header"""
+
+    def __init__(self):
+        self.timings = []
+
+    def add(self, name, seconds, cached):
+        self.timings.append((name, seconds, cached))
+
+    def add_header(self, response):
+        response["Server-Timing"] = ", ".join(
+            f'{name};dur={seconds * 1000:.1f};desc="{"cached" if cached else "built"}"'
+            for name, seconds, cached in self.timings
+        )
+        return response
+
+
+def dashboard_widget(name, user, builder, timings=None):
+    """Return the cached widget for this user, building it with builder(user) if
+    it isn't in the cache. The result of builder must be picklable."""
+
+    start_time = time.perf_counter()
+
+    cache_key = _widget_key(name, user.id)
+    widget = cache.get(cache_key)
+    cached = widget is not None
+
+    if not cached:
+        widget = builder(user)
+        cache.set(cache_key, widget, WIDGET_TIMEOUTS[name])
+
+    elapsed = time.perf_counter() - start_time
+
+    logger.debug(
+        f"Dashboard widget {name} for {user.id} {'cached' if cached else 'built'} in {elapsed:.3f}s"
+    )
+
+    if timings is not None:
+        timings.add(name, elapsed, cached)
+
+    return widget
+
+
+def dashboard_widget_invalidate(name, user_ids):
+    """Remove a widget from the cache for these users"""
+
+    cache.delete_many([_widget_key(name, user_id) for user_id in user_ids])
+
+
+def dashboard_widget_invalidate_all(name):
+    """Remove a widget from the cache for everyone. Bumps the version so the old
+    entries are never used again and expire by themselves"""
+
+    shared_version_bump(f"dashboard_widget:{name}")
@@ -2,4 +2,36 @@ from django.apps import AppConfig
 
 
 class EventsConfig(AppConfig):
-    name = 'events'
+    name = "events"
+
+    def ready(self):
+        """Called when Django starts up. Registers signals to keep the index of entries
+        with money due (EventEntryPlayerNeedingAttention) up to date."""
+
+        # Can't import at top of file - Django won't be ready yet
+        from django.db.models.signals import post_save
+        from events.models import EventEntry, EventEntryPlayer
+        from events.views.core import update_event_entry_players_needing_attention
+
+        def _event_entry_player_saved(sender, instance, raw=False, **kwargs):
+            if not raw:
+                update_event_entry_players_needing_attention([instance.id])
+
+        def _event_entry_saved(sender, instance, raw=False, created=False, **kwargs):
+            # entry status (e.g. cancelled) applies to all of the players
+            if not raw and not created:
+                update_event_entry_players_needing_attention(
+                    instance.evententryplayer_set.values_list("id", flat=True)
+                )
+
+        # Deletes don't need anything, the index rows are deleted by the cascade
+        post_save.connect(
+            _event_entry_player_saved,
+            sender=EventEntryPlayer,
+            dispatch_uid="events_needing_attention_event_entry_player",
+        )
+        post_save.connect(
+            _event_entry_saved,
+            sender=EventEntry,
+            dispatch_uid="events_needing_attention_event_entry",
+        )
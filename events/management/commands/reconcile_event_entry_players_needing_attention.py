@@ -0,0 +1,57 @@
+"""
+Check the index of event entry players with money due (EventEntryPlayerNeedingAttention)
+against a full scan of the entries and fix any differences.
+
+The index is maintained by signals so there shouldn't be any, but bulk changes that
+forget to update it, or changes made directly in the database, will show up here.
+Runs before handle_closed_congresses_with_unpaid_entries which relies on the index.
+
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+
+from events.views.core import reconcile_event_entry_players_needing_attention
+
+logger = logging.getLogger("cobalt")
+
+MAX_IDS_TO_SHOW = 50
+
+
+class Command(BaseCommand):
+    help = "Check and rebuild the index of event entry players with money due"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report differences but don't fix them",
+        )
+
+    def handle(self, *args, **options):
+
+        missing, extra = reconcile_event_entry_players_needing_attention(
+            fix=not options["dry_run"]
+        )
+
+        if not missing and not extra:
+            self.stdout.write(self.style.SUCCESS("Index is up to date"))
+            return
+
+        action = "found" if options["dry_run"] else "fixed"
+
+        for description, event_entry_player_ids in [
+            ("missing or under the wrong congress", missing),
+            ("no longer owing money", extra),
+        ]:
+            if event_entry_player_ids:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{len(event_entry_player_ids)} event entry player(s) {description} {action}: "
+                        f"{event_entry_player_ids[:MAX_IDS_TO_SHOW]}"
+                    )
+                )
+
+        logger.warning(
+            f"EventEntryPlayerNeedingAttention {action} {len(missing)} missing and {len(extra)} extra"
+        )
@@ -0,0 +1,66 @@
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+
+
+def populate_event_entry_players_needing_attention(apps, schema_editor):
+    """Fill the index from the existing entries. Same rules as
+    events.views.core.event_entry_players_with_money_due"""
+
+    EventEntryPlayer = apps.get_model("events", "EventEntryPlayer")
+    EventEntryPlayerNeedingAttention = apps.get_model(
+        "events", "EventEntryPlayerNeedingAttention"
+    )
+
+    money_due = (
+        EventEntryPlayer.objects.exclude(payment_status__in=["Paid", "Free"])
+        .exclude(entry_fee=F("payment_received"))
+        .exclude(event_entry__entry_status="Cancelled")
+        .exclude(entry_fee=0)
+        .values_list("pk", "event_entry__event__congress_id")
+    )
+
+    EventEntryPlayerNeedingAttention.objects.bulk_create(
+        [
+            EventEntryPlayerNeedingAttention(
+                event_entry_player_id=event_entry_player_id, congress_id=congress_id
+            )
+            for event_entry_player_id, congress_id in money_due.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0119_alter_event_entry_fee"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EventEntryPlayerNeedingAttention",
+            fields=[
+                (
+                    "event_entry_player",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="events.evententryplayer",
+                    ),
+                ),
+                (
+                    "congress",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="events.congress",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(
+            populate_event_entry_players_needing_attention,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -1126,6 +1126,23 @@ class EventEntryPlayer(models.Model):
         super(EventEntryPlayer, self).save(*args, **kwargs)
 
 
+class EventEntryPlayerNeedingAttention(models.Model):
+    """Index of event entry players who still owe money, so we can find finished congresses
+    with money due without looking at every entry ever made.
+
+    Kept up to date by signals (see apps.py) and by anything that bulk updates entries
+    calling update_event_entry_players_needing_attention. The
+    reconcile_event_entry_players_needing_attention command checks it against the full scan."""
+
+    event_entry_player = models.OneToOneField(
+        EventEntryPlayer, on_delete=models.CASCADE, primary_key=True
+    )
+    congress = models.ForeignKey(Congress, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.congress} - {self.event_entry_player_id}"
+
+
 class PlayerBatchId(models.Model):
     """Maps a batch Id associated with a payment to the user who made the
     payment. We use the same approach for all players so can't assume it
@@ -1,9 +1,16 @@
 import random
 import string
+from decimal import Decimal
 
-from events.views.core import events_payments_primary_callback
+from events.views.core import (
+    events_payments_primary_callback,
+    SETTLEMENT_RELATED_FIELDS,
+    _mark_event_entry_players_as_paid_and_book_payments,
+    _update_entries_process_their_system_dollars_make_payments,
+)
 from events.models import (
     Congress,
+    CongressMaster,
     Event,
     EventEntry,
     EventEntryPlayer,
@@ -11,7 +18,8 @@ from events.models import (
     BasketItem,
 )
 from notifications.tests.common_functions import check_email_sent
-from payments.views.core import update_account
+from organisations.models import Organisation
+from payments.views.core import get_balance, update_account, org_balance
 from tests.test_manager import CobaltTestManagerIntegration
 
 
@@ -109,6 +117,39 @@ def _event_entry_test_helper(manager, test_name, event, entrants, expected_statu
         )
 
 
+def _settlement_entry_test_helper(
+    event, player, entry_fee, payment_received=0, payment_type="my-system-dollars"
+):
+    """Helper to create an entry for one player, loaded ready to settle"""
+
+    event_entry = EventEntry(event=event, primary_entrant=player)
+    event_entry.save()
+
+    event_entry_player = EventEntryPlayer(
+        event_entry=event_entry,
+        player=player,
+        payment_type=payment_type,
+        entry_fee=Decimal(entry_fee),
+        payment_received=Decimal(payment_received),
+    )
+    event_entry_player.save()
+
+    return EventEntryPlayer.objects.select_related(*SETTLEMENT_RELATED_FIELDS).get(
+        pk=event_entry_player.id
+    )
+
+
+def _set_balance_test_helper(member, balance):
+    """Helper to set a member's balance to a known amount"""
+
+    update_account(
+        member=member,
+        amount=balance - get_balance(member),
+        description="Set balance for test",
+        payment_type="Refund",
+    )
+
+
 class CallbackTests:
     """Unit tests for the callbacks which are called when payments are made"""
 
@@ -194,6 +235,8 @@ class CallbackTests:
             payment_type="Refund",
         )
 
+        morris_balance = get_balance(morris)
+
         # Pairs - My Bridge Credits and Their Bridge Credits
         _event_entry_test_helper(
             manager=self.manager,
@@ -206,6 +249,18 @@ class CallbackTests:
             expected_status="Complete",
         )
 
+        # Morris should have paid his own entry fee from his account
+        entry_fee, *_ = self.pairs_event.entry_fee_for(morris)
+        expected_balance = morris_balance - float(entry_fee)
+        new_balance = get_balance(morris)
+
+        self.manager.save_results(
+            status=abs(new_balance - expected_balance) < 0.01,
+            test_name="Pairs entry Their Bridge Credits - check balance",
+            test_description="Check the player paying with their own Bridge Credits has been charged their entry fee.",
+            output=f"Expected balance {expected_balance}, got: {new_balance}",
+        )
+
     def primary_functions_teams(self):
         """Tests for the callback for the primary entrant - teams"""
 
@@ -245,3 +300,142 @@ class CallbackTests:
         #     ],
         #     expected_status="Complete",
         # )
+
+    def settlement_functions(self):
+        """Tests for settling event_entry_players and booking the payments"""
+
+        lucy = self.manager.lucy
+        natalie = self.manager.natalie
+        penelope = self.manager.penelope
+
+        # Partial payment - only the rest of the fee is charged
+        _set_balance_test_helper(natalie, 100.0)
+        event_entry_player = _settlement_entry_test_helper(
+            self.pairs_event, natalie, entry_fee=30, payment_received=10
+        )
+        _mark_event_entry_players_as_paid_and_book_payments([event_entry_player])
+        event_entry_player.refresh_from_db()
+        balance = get_balance(natalie)
+
+        self.manager.save_results(
+            status=event_entry_player.payment_status == "Paid"
+            and event_entry_player.payment_received == Decimal(30)
+            and abs(balance - 80.0) < 0.01,
+            test_name="Settlement - partial payment",
+            test_description="Settle an entry of 30 that already has 10 paid. Player should be charged 20.",
+            output=f"Status {event_entry_player.payment_status}, received {event_entry_player.payment_received}. Expected balance 80.0, got: {balance}",
+        )
+
+        # Someone else pays
+        _set_balance_test_helper(lucy, 100.0)
+        _set_balance_test_helper(natalie, 100.0)
+        event_entry_player = _settlement_entry_test_helper(
+            self.pairs_event, natalie, entry_fee=25
+        )
+        _mark_event_entry_players_as_paid_and_book_payments(
+            [event_entry_player], who_paid=lucy
+        )
+        event_entry_player.refresh_from_db()
+        lucy_balance = get_balance(lucy)
+        natalie_balance = get_balance(natalie)
+
+        self.manager.save_results(
+            status=event_entry_player.paid_by == lucy
+            and abs(lucy_balance - 75.0) < 0.01
+            and abs(natalie_balance - 100.0) < 0.01,
+            test_name="Settlement - someone else pays",
+            test_description="Lucy pays 25 for Natalie's entry. Lucy should be charged, not Natalie.",
+            output=f"Paid by {event_entry_player.paid_by}. Lucy's balance {lucy_balance} (expected 75.0), Natalie's {natalie_balance} (expected 100.0)",
+        )
+
+        # Not enough money when the payments are booked - nothing happens
+        _set_balance_test_helper(natalie, 10.0)
+        event_entry_player = _settlement_entry_test_helper(
+            self.pairs_event, natalie, entry_fee=25
+        )
+        settled = _mark_event_entry_players_as_paid_and_book_payments(
+            [event_entry_player], check_funds=True
+        )
+        event_entry_player.refresh_from_db()
+        balance = get_balance(natalie)
+
+        self.manager.save_results(
+            status=not settled
+            and event_entry_player.payment_status != "Paid"
+            and abs(balance - 10.0) < 0.01,
+            test_name="Settlement - insufficient funds",
+            test_description="Settle an entry of 25 checking funds for a player with 10. Should not be paid.",
+            output=f"Settled {settled}, status {event_entry_player.payment_status}. Expected balance 10.0, got: {balance}",
+        )
+
+        # Their system dollars with a failed top up - not paid, other players still are
+        penelope.stripe_auto_confirmed = "Off"
+        penelope.save()
+        _set_balance_test_helper(penelope, 10.0)
+        _set_balance_test_helper(natalie, 100.0)
+        penelope_entry = _settlement_entry_test_helper(
+            self.pairs_event,
+            penelope,
+            entry_fee=25,
+            payment_type="their-system-dollars",
+        )
+        natalie_entry = _settlement_entry_test_helper(
+            self.pairs_event, natalie, entry_fee=25, payment_type="their-system-dollars"
+        )
+        _update_entries_process_their_system_dollars_make_payments(
+            {penelope: [penelope_entry], natalie: [natalie_entry]}
+        )
+        penelope_entry.refresh_from_db()
+        natalie_entry.refresh_from_db()
+        penelope_balance = get_balance(penelope)
+
+        self.manager.save_results(
+            status=penelope_entry.payment_status != "Paid"
+            and abs(penelope_balance - 10.0) < 0.01
+            and natalie_entry.payment_status == "Paid",
+            test_name="Settlement - failed top up",
+            test_description="Penelope has 10 and no auto top up, Natalie has 100. Both owe 25. Only Natalie should be paid.",
+            output=f"Penelope {penelope_entry.payment_status} with balance {penelope_balance} (expected 10.0). Natalie {natalie_entry.payment_status}",
+        )
+
+        # Basket with entries for congresses run by two different organisations
+        first_org = self.pairs_event.congress.congress_master.org
+        second_org = Organisation.objects.exclude(pk=first_org.id).first()
+        congress_master = CongressMaster(
+            org=second_org, name="Settlement Test Congress Master"
+        )
+        congress_master.save()
+        congress = Congress(congress_master=congress_master)
+        congress.save()
+        second_event = Event(
+            congress=congress,
+            event_name="Settlement test event",
+            event_type="Open",
+            entry_fee=Decimal(40),
+            player_format="Pairs",
+        )
+        second_event.save()
+
+        _set_balance_test_helper(natalie, 100.0)
+        first_org_balance = org_balance(first_org)
+        second_org_balance = org_balance(second_org)
+        settled = _mark_event_entry_players_as_paid_and_book_payments(
+            [
+                _settlement_entry_test_helper(self.pairs_event, natalie, entry_fee=20),
+                _settlement_entry_test_helper(second_event, natalie, entry_fee=40),
+            ],
+            check_funds=True,
+        )
+        first_org_change = org_balance(first_org) - first_org_balance
+        second_org_change = org_balance(second_org) - second_org_balance
+        balance = get_balance(natalie)
+
+        self.manager.save_results(
+            status=len(settled) == 2
+            and abs(balance - 40.0) < 0.01
+            and abs(first_org_change - 20.0) < 0.01
+            and abs(second_org_change - 40.0) < 0.01,
+            test_name="Settlement - two organisations",
+            test_description="Natalie pays 20 to one organisation and 40 to another from 100.",
+            output=f"Settled {len(settled)}. Natalie's balance {balance} (expected 40.0). {first_org} received {first_org_change} (expected 20.0), {second_org} received {second_org_change} (expected 40.0)",
+        )
@@ -3,7 +3,6 @@
 import csv
 from datetime import timedelta
 from itertools import chain
-from threading import Thread
 
 import bleach
 from dateutil.relativedelta import relativedelta
@@ -29,9 +28,10 @@ from notifications.views.core import (
     create_rbac_batch_id,
 )
 from logs.views import log_event
-from django.db import transaction, connection
+from django.db import transaction
 
 from utils.views.general import download_csv
+from utils.views.cobalt_jobs import cobalt_job, queue_job
 from events.models import (
     Congress,
     Category,
@@ -1217,17 +1217,22 @@ def admin_congress_email(request, congress_id):
 
 
 # DEPRECATED - replaced by club menu | comms | edit batch etc
-def _admin_email_common_thread(request, congress, subject, body, recipients, batch_id):
-    """we run a thread so we can return to the user straight away.
+@cobalt_job
+def _admin_email_common_job(user_id, congress_id, subject, body, recipients, batch_pk):
+    """we use the job queue so we can return to the user straight away.
     Probably not necessary now we have Django Post Office"""
 
+    user = User.objects.get(pk=user_id)
+    congress = Congress.objects.get(pk=congress_id)
+    batch_id = BatchID.objects.get(pk=batch_pk)
+
     # For some old congresses, contact_email was not required. Should be able to remove this in the future
-    reply_to = congress.contact_email or request.user.email
+    reply_to = congress.contact_email or user.email
 
     for recipient in recipients:
         context = {
             "name": recipient[0],
-            "title1": f"Message from {request.user.full_name} on behalf of {congress}",
+            "title1": f"Message from {user.full_name} on behalf of {congress}",
             "title2": subject,
             "email_body": body,
             "subject": subject,
@@ -1244,9 +1249,6 @@ def _admin_email_common_thread(request, congress, subject, body, recipients, bat
             batch_size=len(recipients),
         )
 
-    # Django creates a new database connection for this thread so close it
-    connection.close()
-
 
 # DEPRECATED - replaced by club menu | comms | edit batch etc
 def _admin_email_common(request, all_recipients, congress, event=None):
@@ -1295,19 +1297,17 @@ def _admin_email_common(request, all_recipients, congress, event=None):
         activity.activity_id = event.id if event else congress.id
         activity.save()
 
-        # start thread
-        args = {
-            "request": request,
-            "congress": congress,
-            "subject": subject,
-            "body": body,
-            "recipients": recipients,
-            "batch_id": batch_id,
-        }
-
-        thread = Thread(target=_admin_email_common_thread, kwargs=args)
-        thread.setDaemon(True)
-        thread.start()
+        # send in the background. Don't retry, we could send duplicates
+        queue_job(
+            _admin_email_common_job,
+            max_attempts=1,
+            user_id=request.user.id,
+            congress_id=congress.id,
+            subject=subject,
+            body=body,
+            recipients=list(recipients),
+            batch_pk=batch.pk,
+        )
 
         if "test" in request.POST:
             messages.success(
@@ -2,6 +2,7 @@ import logging
 from datetime import datetime, timedelta, date
 
 import pytz
+from django.db import transaction
 from django.db.models import Q, F
 from django.template import loader
 from django.template.defaultfilters import pluralize
@@ -19,21 +20,20 @@ from cobalt.settings import (
     AUTO_TOP_UP_LOW_LIMIT,
 )
 
+from dashboard.widgets import dashboard_widget_invalidate
 from logs.views import log_event
 from notifications.models import BlockNotification, BatchID
 from notifications.views.core import (
     send_cobalt_email_with_template,
     create_rbac_batch_id,
 )
-from payments.views.payments_api import (
-    payment_api_batch,
-    calculate_auto_topup_amount,
-)
+from payments.views.payments_api import calculate_auto_topup_amount
 from rbac.core import rbac_get_users_with_role
 from events.models import (
     BasketItem,
     EventEntry,
     EventEntryPlayer,
+    EventEntryPlayerNeedingAttention,
     PlayerBatchId,
     EventLog,
     Congress,
@@ -43,6 +43,12 @@ from events.models import (
 
 TZ = pytz.timezone(TIME_ZONE)
 
+SETTLEMENT_RELATED_FIELDS = (
+    "player",
+    "event_entry__event__congress__congress_master__org",
+)
+""" what settling an event_entry_player needs, load with select_related """
+
 logger = logging.getLogger("cobalt")
 
 
@@ -68,10 +74,12 @@ def events_payments_secondary_callback(status, route_payload):
         return
 
     # Update entries
-    for paid_event_entry_player in paid_event_entry_players:
-        _mark_event_entry_player_as_paid_and_book_payments(
-            paid_event_entry_player, payment_user
-        )
+    paid_event_entry_players = list(
+        paid_event_entry_players.select_related(*SETTLEMENT_RELATED_FIELDS)
+    )
+    _mark_event_entry_players_as_paid_and_book_payments(
+        paid_event_entry_players, payment_user
+    )
 
     # Check if still in primary entrants basket and handle
     _events_payments_secondary_callback_process_basket(
@@ -138,8 +146,8 @@ def _events_payments_secondary_callback_process_basket(
     #             book_internals=False,
     #         )
     #     ):
-    #         _mark_event_entry_player_as_paid_and_book_payments(
-    #             event_entry_all_player, primary_entrant
+    #         _mark_event_entry_players_as_paid_and_book_payments(
+    #             [event_entry_all_player], primary_entrant
     #         )
 
     # Check if status has changed
@@ -298,60 +306,143 @@ def _update_entries(event_entry_players, event_entries, payment_user, route_payl
 def _update_entries_change_entries(event_entry_players, payment_user):
     """First part of _update_entries. This changes the entries themselves"""
 
-    # Update EntryEventPlayer objects
-    for event_entry_player in event_entry_players:
-        _mark_event_entry_player_as_paid_and_book_payments(
-            event_entry_player, payment_user
+    _mark_event_entry_players_as_paid_and_book_payments(
+        list(event_entry_players.select_related(*SETTLEMENT_RELATED_FIELDS)),
+        payment_user,
+    )
+
+
+def _mark_event_entry_players_as_paid_and_book_payments(
+    event_entry_players, who_paid=None, check_funds=False
+):
+    """Settle a batch of event_entry_players. Marks them as paid and creates the payments for
+    the users and the organisations.
+
+    Everything is written in bulk - one insert each for the member transactions,
+    organisation transactions and event logs, and one update for the event_entry_players.
+    The balances are locked per player while the payments are booked
+    (see payments_core.update_accounts_for_organisations).
+
+    By default this doesn't check anyone has the money, payments (my-system-dollars) has
+    already taken it. With check_funds the payers' balances are read under the same lock
+    and anyone who can't pay for all of their entries is left out.
+
+    Args:
+        event_entry_players: list of EventEntryPlayers loaded with SETTLEMENT_RELATED_FIELDS
+        who_paid: User who paid for all of them, or None if each player paid for themselves
+        check_funds: only settle the entries of payers who have enough in their account
+
+    Returns:
+        list: the event_entry_players that were settled
+    """
+
+    if not event_entry_players:
+        return []
+
+    with transaction.atomic():
+
+        if check_funds:
+            event_entry_players = _event_entry_players_payers_can_afford(
+                event_entry_players, who_paid
+            )
+            if not event_entry_players:
+                return []
+
+        now = timezone.now().astimezone(TZ)
+        payments = []
+        event_logs = []
+
+        for event_entry_player in event_entry_players:
+
+            # this could be a partial payment
+            amount = event_entry_player.entry_fee - event_entry_player.payment_received
+            event = event_entry_player.event_entry.event
+
+            event_entry_player.payment_status = "Paid"
+            event_entry_player.payment_received = event_entry_player.entry_fee
+            event_entry_player.paid_by = who_paid or event_entry_player.player
+            event_entry_player.entry_complete_date = now
+
+            event_logs.append(
+                EventLog(
+                    event=event,
+                    actor=event_entry_player.paid_by,
+                    action=f"Paid for {event_entry_player.player} with {amount} {BRIDGE_CREDITS}",
+                    event_entry=event_entry_player.event_entry,
+                )
+            )
+
+            payments.append(
+                {
+                    "member": event_entry_player.paid_by,
+                    "organisation": event.congress.congress_master.org,
+                    "amount": amount,
+                    "description": f"{event.event_name} - {event_entry_player.player}",
+                    "event": event,
+                }
+            )
+
+            log_event(
+                user=event_entry_player.paid_by,
+                severity="INFO",
+                source="Events",
+                sub_source="events_entry",
+                message=f"{event_entry_player.paid_by.href} paid for {event_entry_player.player.href} to enter {event.href}",
+            )
+
+        payments_core.update_accounts_for_organisations(payments, "Entry to an event")
+
+        EventEntryPlayer.objects.bulk_update(
+            event_entry_players,
+            ["payment_status", "payment_received", "paid_by", "entry_complete_date"],
         )
 
+        EventLog.objects.bulk_create(event_logs)
 
-def _mark_event_entry_player_as_paid_and_book_payments(event_entry_player, who_paid):
-    """Update a single event_entry_player record to be paid, and create the payments for the
-    user and the organisation"""
-
-    # this could be a partial payment
-    amount = event_entry_player.entry_fee - event_entry_player.payment_received
-
-    event_entry_player.payment_status = "Paid"
-    event_entry_player.payment_received = event_entry_player.entry_fee
-    event_entry_player.paid_by = who_paid
-    event_entry_player.entry_complete_date = timezone.now().astimezone(TZ)
-    event_entry_player.save()
-
-    EventLog(
-        event=event_entry_player.event_entry.event,
-        actor=event_entry_player.paid_by,
-        action=f"Paid for {event_entry_player.player} with {amount} {BRIDGE_CREDITS}",
-        event_entry=event_entry_player.event_entry,
-    ).save()
-
-    log_event(
-        user=event_entry_player.paid_by,
-        severity="INFO",
-        source="Events",
-        sub_source="events_entry",
-        message=f"{event_entry_player.paid_by.href} paid for {event_entry_player.player.href} to enter {event_entry_player.event_entry.event.href}",
-    )
+        update_event_entry_players_needing_attention(
+            event_entry_player.id for event_entry_player in event_entry_players
+        )
 
-    # create payments in org account
-    payments_core.update_organisation(
-        organisation=event_entry_player.event_entry.event.congress.congress_master.org,
-        amount=amount,
-        description=f"{event_entry_player.event_entry.event.event_name} - {event_entry_player.player}",
-        payment_type="Entry to an event",
-        member=who_paid,
-        event=event_entry_player.event_entry.event,
+    # bulk writes don't send signals
+    dashboard_widget_invalidate(
+        "payments", {payment["member"].id for payment in payments}
     )
-
-    # create payment for user
-    payments_core.update_account(
-        member=who_paid,
-        amount=-amount,
-        description=f"{event_entry_player.event_entry.event.event_name} - {event_entry_player.player}",
-        payment_type="Entry to an event",
-        organisation=event_entry_player.event_entry.event.congress.congress_master.org,
+    dashboard_widget_invalidate(
+        "events",
+        {event_entry_player.player_id for event_entry_player in event_entry_players},
     )
 
+    return event_entry_players
+
+
+def _event_entry_players_payers_can_afford(event_entry_players, who_paid=None):
+    """Part of _mark_event_entry_players_as_paid_and_book_payments. Locks the payers' accounts
+    and returns the event_entry_players whose payer has enough to pay for all of their entries.
+    Must be called inside the transaction that books the payments."""
+
+    totals = {}
+    for event_entry_player in event_entry_players:
+        payer = who_paid or event_entry_player.player
+        totals[payer] = totals.get(payer, 0.0) + float(
+            event_entry_player.entry_fee - event_entry_player.payment_received
+        )
+
+    balances = payments_core.lock_member_balances(payer.id for payer in totals)
+
+    short = set()
+    for payer, total in totals.items():
+        if total > balances[payer.id]:
+            logger.warning(
+                f"{payer} has {balances[payer.id]} but needs {total} to pay for entries, not paying"
+            )
+            short.add(payer)
+
+    return [
+        event_entry_player
+        for event_entry_player in event_entry_players
+        if (who_paid or event_entry_player.player) not in short
+    ]
+
 
 def _update_entries_process_their_system_dollars(payment_user):
     # sourcery skip: extract-method
@@ -374,56 +465,57 @@ def _update_entries_process_their_system_dollars(payment_user):
     """
 
     # build a dictionary with players
-    (
-        event_entries,
-        event_entries_by_player,
-    ) = _update_entries_process_their_system_dollars_build_dict(payment_user)
+    event_entries_by_player = _update_entries_process_their_system_dollars_build_dict(
+        payment_user
+    )
 
     # Now go through each player and do auto top up for full amount if required
     _update_entries_process_their_system_dollars_make_payments(event_entries_by_player)
 
 
 def _update_entries_process_their_system_dollars_build_dict(payment_user):
-    """Sub process for handling their system dollars. This builds the dictionary of players"""
+    """Sub process for handling their system dollars. This builds the dictionary of players
+    from everything in the basket, in one query"""
 
-    event_entries_as_dict = BasketItem.objects.filter(player=payment_user).values(
-        "event_entry"
+    event_entry_players = (
+        EventEntryPlayer.objects.filter(
+            event_entry__in=BasketItem.objects.filter(player=payment_user).values(
+                "event_entry"
+            ),
+            payment_type="their-system-dollars",
+        )
+        .exclude(payment_status__in=["Paid", "Free"])
+        .select_related(*SETTLEMENT_RELATED_FIELDS)
+        .order_by("pk")
     )
 
-    # Start by building a dictionary with player then list of event_entry_players to pay for
+    # Build a dictionary with player then list of event_entry_players to pay for
     event_entries_by_player = {}
-    event_entries = []
 
-    for event_entry_id in event_entries_as_dict:
-        event_entry = EventEntry.objects.get(pk=event_entry_id["event_entry"])
-        event_entries.append(event_entry)
-
-        for event_entry_player in event_entry.evententryplayer_set.all():
-            if (
-                event_entry_player.payment_type == "their-system-dollars"
-                and event_entry_player.payment_status not in ["Paid", "Free"]
-            ):
-                this_player = event_entry_player.player
+    for event_entry_player in event_entry_players:
+        event_entries_by_player.setdefault(event_entry_player.player, []).append(
+            event_entry_player
+        )
 
-                # Add key if not present
-                if this_player not in event_entries_by_player:
-                    event_entries_by_player[this_player] = []
+    return event_entries_by_player
 
-                # Add event_entry_player to list
-                event_entries_by_player[this_player].append(event_entry_player)
 
-    return event_entries, event_entries_by_player
+def _update_entries_process_their_system_dollars_make_payments(event_entries_by_player):
+    """Sub process for handling their system dollars - make payments
 
+    We top up anyone who doesn't have enough for all of their entries, then settle
+    everyone who can pay in one batch. The balances are checked again under the lock when
+    the payments are booked, as something else could have spent the money since the top up.
+    """
 
-def _update_entries_process_their_system_dollars_make_payments(event_entries_by_player):
-    """Sub process for handling their system dollars - make payments"""
+    payable_event_entry_players = []
 
-    for this_player in event_entries_by_player:
-        total_amount_for_player = 0.0
-        for event_entry_player in event_entries_by_player[this_player]:
-            total_amount_for_player += float(event_entry_player.entry_fee) - float(
-                event_entry_player.payment_received
-            )
+    for this_player, event_entry_players in event_entries_by_player.items():
+        total_amount_for_player = sum(
+            float(event_entry_player.entry_fee)
+            - float(event_entry_player.payment_received)
+            for event_entry_player in event_entry_players
+        )
 
         # we now have the players total for all events in all congresses. See if this is enough.
         player_balance = payments_core.get_balance(this_player)
@@ -439,42 +531,34 @@ def _update_entries_process_their_system_dollars_make_payments(event_entries_by_
             if not status:
                 # Payment failed - abandon for this user. the called functions will handle notifying them
                 logger.error(f"Auto top up for {this_player} failed: {msg}")
+                for event_entry_player in event_entry_players:
+                    logger.warning(
+                        f"{this_player} payment failed for their-system-dollars for {event_entry_player.event_entry}"
+                    )
                 continue
 
-        # Now go through and make all of the payments, they should work as there is enough money
-        for event_entry_player in event_entries_by_player[this_player]:
-
-            event_entry = event_entry_player.event_entry
-
-            if payment_api_batch(
-                member=event_entry_player.player,
-                description=event_entry.event.event_name,
-                amount=event_entry_player.entry_fee,
-                organisation=event_entry_player.event_entry.event.congress.congress_master.org,
-                payment_type="Entry to an event",
-                book_internals=True,
-                event=event_entry.event,
-            ):
-                event_entry_player.payment_status = "Paid"
-                event_entry_player.entry_complete_date = datetime.now()
-                event_entry_player.paid_by = event_entry_player.player
-                event_entry_player.payment_received = event_entry_player.entry_fee
-                event_entry_player.save()
+        payable_event_entry_players.extend(event_entry_players)
 
-                EventLog(
-                    event=event_entry.event,
-                    actor=event_entry_player.player,
-                    action=f"Paid with {BRIDGE_CREDITS}",
-                    event_entry=event_entry,
-                ).save()
-
-                logger.info(
-                    f"{event_entry_player.player} paid with their-system-dollars for {event_entry}"
-                )
-            else:
-                logger.warning(
-                    f"{event_entry_player.player} payment failed for their-system-dollars for {event_entry}"
-                )
+    # Now make all of the payments for anyone who still has enough money
+    settled_event_entry_players = _mark_event_entry_players_as_paid_and_book_payments(
+        payable_event_entry_players, check_funds=True
+    )
+
+    settled_players = {
+        event_entry_player.player for event_entry_player in settled_event_entry_players
+    }
+
+    for this_player in settled_players:
+        logger.info(f"{this_player} paid with their-system-dollars")
+
+        # Top up again (or warn) if this has taken them below the limit
+        if (
+            this_player.stripe_auto_confirmed == "On"
+            and payments_core.get_balance(this_player) < AUTO_TOP_UP_LOW_LIMIT
+        ):
+            payments_core.auto_topup_member(this_player)
+        else:
+            _low_balance_check(this_player)
 
 
 def _send_notifications(
@@ -998,6 +1082,105 @@ def get_event_statistics():
     }
 
 
+def event_entry_players_with_money_due():
+    """All event entry players who still owe money, in any congress. This is the full
+    scan, use EventEntryPlayerNeedingAttention (which is built from this) to look things up."""
+
+    return (
+        EventEntryPlayer.objects
+        # ignore paid or free entries
+        .exclude(payment_status__in=["Paid", "Free"])
+        # Some edited entries are paid but marked as unpaid
+        .exclude(entry_fee=F("payment_received"))
+        # Ignore cancelled entries
+        .exclude(event_entry__entry_status="Cancelled")
+        # Ignore anything with no money due
+        .exclude(entry_fee=0)
+    )
+
+
+def update_event_entry_players_needing_attention(event_entry_player_ids):
+    """Bring EventEntryPlayerNeedingAttention up to date for these event entry players.
+    Called by signals when an entry player or entry is saved, and needs to be called
+    by anything that changes them in bulk (bulk_update or update don't send signals)."""
+
+    event_entry_player_ids = list(event_entry_player_ids)
+
+    if not event_entry_player_ids:
+        return
+
+    money_due = event_entry_players_with_money_due().filter(
+        pk__in=event_entry_player_ids
+    )
+
+    with transaction.atomic():
+        EventEntryPlayerNeedingAttention.objects.filter(
+            event_entry_player_id__in=event_entry_player_ids
+        ).delete()
+
+        EventEntryPlayerNeedingAttention.objects.bulk_create(
+            [
+                EventEntryPlayerNeedingAttention(
+                    event_entry_player_id=event_entry_player_id,
+                    congress_id=congress_id,
+                )
+                for event_entry_player_id, congress_id in money_due.values_list(
+                    "pk", "event_entry__event__congress_id"
+                )
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def reconcile_event_entry_players_needing_attention(fix=True):
+    """Compare EventEntryPlayerNeedingAttention with the full scan and optionally fix it
+
+    Returns:
+        missing: list of event entry player ids that should be there but aren't (or are under the wrong congress)
+        extra: list of event entry player ids that are there but shouldn't be
+    """
+
+    expected = dict(
+        event_entry_players_with_money_due().values_list(
+            "pk", "event_entry__event__congress_id"
+        )
+    )
+    actual = dict(
+        EventEntryPlayerNeedingAttention.objects.values_list(
+            "event_entry_player_id", "congress_id"
+        )
+    )
+
+    missing = [
+        event_entry_player_id
+        for event_entry_player_id, congress_id in expected.items()
+        if actual.get(event_entry_player_id) != congress_id
+    ]
+    extra = [
+        event_entry_player_id
+        for event_entry_player_id in actual
+        if event_entry_player_id not in expected
+    ]
+
+    if fix:
+        update_event_entry_players_needing_attention(missing + extra)
+
+    return missing, extra
+
+
+def _finished_congress_entries_needing_attention(congress=None):
+    """Rows from the index for congresses that have finished, optionally just one congress"""
+
+    needing_attention = EventEntryPlayerNeedingAttention.objects.filter(
+        congress__end_date__lt=timezone.now()
+    )
+
+    if congress:
+        needing_attention = needing_attention.filter(congress=congress)
+
+    return needing_attention
+
+
 def get_completed_congresses_with_money_due(congress=None):
     """
     Find congresses which are finished but still have outstanding money to collect
@@ -1005,49 +1188,19 @@ def get_completed_congresses_with_money_due(congress=None):
     Optionally only list a single congress
     """
 
-    event_entry_players_needing_attention = get_event_entry_players_needing_attention(
-        congress
+    return Congress.objects.filter(
+        pk__in=_finished_congress_entries_needing_attention(congress).values("congress")
     )
 
-    # filter
-    congress_list = event_entry_players_needing_attention.values_list(
-        "event_entry__event__congress"
-    ).distinct("event_entry__event__congress")
-
-    return Congress.objects.filter(pk__in=congress_list)
-
 
 def get_event_entry_players_needing_attention(congress):
     """Get the entries that are causing a congress to be in an unfinished state"""
 
-    # Get the player entries that are causing problems
-    event_entry_players_needing_attention = (
-        # Look at entries in congresses that have finished
-        EventEntryPlayer.objects.filter(
-            event_entry__event__congress__end_date__lt=timezone.now()
-        )
-        # ignore paid or free entries
-        .exclude(payment_status__in=["Paid", "Free"])
-        # Some edited entries are paid but marked as unpaid
-        .exclude(entry_fee=F("payment_received"))
-        # Ignore cancelled entries
-        .exclude(event_entry__entry_status="Cancelled")
-        # Ignore anything with no money due
-        .exclude(entry_fee=0)
-        # also get the event and congress - maybe later, see how it goes
-        # .select_related("event_entry__event")
-        .select_related("event_entry__event__congress")
-    )
-
-    # If we got a congress, then only show that one
-    if congress:
-        event_entry_players_needing_attention = (
-            event_entry_players_needing_attention.filter(
-                event_entry__event__congress=congress
-            )
+    return EventEntryPlayer.objects.filter(
+        pk__in=_finished_congress_entries_needing_attention(congress).values(
+            "event_entry_player"
         )
-
-    return event_entry_players_needing_attention
+    ).select_related("event_entry__event__congress")
 
 
 def fix_closed_congress(congress, actor):
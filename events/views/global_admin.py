@@ -26,7 +26,7 @@ from rbac.core import (
 )
 from rbac.decorators import rbac_check_role
 from rbac.views import rbac_forbidden
-from utils.utils import cobalt_paginator
+from utils.utils import cobalt_keyset_paginator
 
 
 @login_required()
@@ -245,7 +245,7 @@ def events_activity_view_logs_htmx(request):
     events_logs_qs = EventLog.objects.order_by("-pk").select_related(
         "event", "event__congress", "event__congress__congress_master__org", "actor"
     )
-    events_logs = cobalt_paginator(request, events_logs_qs, 15)
+    events_logs = cobalt_keyset_paginator(request, events_logs_qs, 15)
     hx_post = reverse("events:events_activity_view_logs_htmx")
     hx_target = "#event_log"
 
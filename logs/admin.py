@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import Log
+from .models import Log, LogDailySummary
 
 admin.site.register(Log)
+admin.site.register(LogDailySummary)
@@ -0,0 +1,79 @@
+""" Cron job to summarise and delete old log entries """
+import logging
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from logs.models import Log, LogDailySummary
+
+logger = logging.getLogger("cobalt")
+
+DEFAULT_RETENTION_MONTHS = 6
+DELETE_CHUNK_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = "Roll up old Log entries into daily counts and delete them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=DEFAULT_RETENTION_MONTHS,
+            help=f"Keep this many months of detail (default {DEFAULT_RETENTION_MONTHS})",
+        )
+        parser.add_argument(
+            "--keep-critical",
+            action="store_true",
+            help="Don't delete CRITICAL entries",
+        )
+
+    def handle(self, *args, **options):
+        print("running purge_old_logs...")
+
+        cut_off = timezone.now() - relativedelta(months=options["months"])
+
+        old_logs = Log.objects.filter(event_date__lt=cut_off)
+        if options["keep_critical"]:
+            old_logs = old_logs.exclude(severity=Log.SeverityCodes.CRITICAL)
+
+        # One transaction per chunk, so each chunk is rolled up and deleted together and
+        # we only ever hold locks on DELETE_CHUNK_SIZE rows. Locked rows are skipped in
+        # case another run is working on them.
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                chunk = list(
+                    old_logs.select_for_update(skip_locked=True)
+                    .order_by("event_date")
+                    .values_list("id", flat=True)[:DELETE_CHUNK_SIZE]
+                )
+                if not chunk:
+                    break
+
+                chunk_logs = Log.objects.filter(id__in=chunk)
+
+                # Roll up, adding to anything already there from a previous chunk or run
+                daily_counts = (
+                    chunk_logs.annotate(date=TruncDate("event_date"))
+                    .values("date", "severity", "source")
+                    .annotate(count=Count("id"))
+                    .order_by()
+                )
+
+                for daily_count in daily_counts:
+                    summary = LogDailySummary.objects.select_for_update().get_or_create(
+                        date=daily_count["date"],
+                        severity=daily_count["severity"],
+                        source=daily_count["source"],
+                    )[0]
+                    summary.count += daily_count["count"]
+                    summary.save()
+
+                deleted += chunk_logs.delete()[0]
+
+        logger.info(f"purge_old_logs deleted {deleted} log entries before {cut_off}")
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.15 on 2026-10-19 09:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # The log table is big and written to all the time, build the indexes without
+    # locking out writes
+    atomic = False
+
+    dependencies = [
+        ("logs", "0009_auto_20220923_1048"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LogDailySummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("severity", models.CharField(blank=True, max_length=8, null=True)),
+                ("source", models.CharField(blank=True, max_length=40, null=True)),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "verbose_name_plural": "Log daily summaries",
+                "unique_together": {("date", "severity", "source")},
+            },
+        ),
+        AddIndexConcurrently(
+            model_name="log",
+            index=models.Index(fields=["event_date"], name="logs_log_event_date_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="log",
+            index=models.Index(
+                fields=["severity", "event_date"], name="logs_log_severity_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="log",
+            index=models.Index(
+                fields=["source", "event_date"], name="logs_log_source_idx"
+            ),
+        ),
+    ]
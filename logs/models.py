@@ -42,5 +42,31 @@ class Log(models.Model):
     message = models.TextField(blank=True, null=True)
     ip = models.CharField(max_length=15, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["event_date"], name="logs_log_event_date_idx"),
+            models.Index(
+                fields=["severity", "event_date"], name="logs_log_severity_idx"
+            ),
+            models.Index(fields=["source", "event_date"], name="logs_log_source_idx"),
+        ]
+
     def __str__(self):
         return f"{self.event_date}: {self.severity}: {self.source}: {self.sub_source}: {self.user}: {self.message}"
+
+
+class LogDailySummary(models.Model):
+    """Counts of Log entries per day. Written by the purge_old_logs command before
+    it deletes old logs, so we still know what happened after the detail has gone"""
+
+    date = models.DateField()
+    severity = models.CharField(max_length=8, blank=True, null=True)
+    source = models.CharField(max_length=40, blank=True, null=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("date", "severity", "source")
+        verbose_name_plural = "Log daily summaries"
+
+    def __str__(self):
+        return f"{self.date}: {self.severity}: {self.source}: {self.count}"
@@ -1,5 +1,5 @@
 from logs.models import Log
-from logs.views import log_event
+from logs.views import log_event, flush_log_buffer
 from tests.test_manager import CobaltTestManagerIntegration
 
 
@@ -13,6 +13,9 @@ def _log_event_helper(
 
     log_event(user, severity, source, sub_source, message, request)
 
+    # entries are buffered
+    flush_log_buffer()
+
     last_log_event = Log.objects.all().last()
 
     output = f"""This test will crash if it fails, any output means success.
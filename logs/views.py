@@ -1,3 +1,5 @@
+import hashlib
+import logging
 from datetime import timedelta
 
 from django.contrib.auth.decorators import user_passes_test
@@ -10,9 +12,23 @@ from accounts.models import User
 from cobalt.settings import DEFAULT_FROM_EMAIL, SUPPORT_EMAIL
 from events.models import EventLog
 from organisations.models import ClubLog
-from utils.utils import cobalt_paginator
+from utils.utils import cobalt_keyset_paginator
+from utils.views.cobalt_buffer import CobaltWriteBuffer
+from utils.views.cobalt_cache import shared_cache
+from utils.views.cobalt_jobs import cobalt_job, queue_job
 from .models import Log
 
+logger = logging.getLogger("cobalt")
+
+LOG_ALERT_DEDUPE_SECONDS = 600
+""" only send one email for the same critical event in this time, across all processes
+as the dedupe is in the shared cache """
+
+LOG_VIEWER_PAGE_SIZE = 100
+
+_log_buffer = CobaltWriteBuffer(Log, max_size=50, max_seconds=5)
+""" Log entries waiting to be written """
+
 
 def get_client_ip(request):
     x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
@@ -37,6 +53,9 @@ def log_event(user, severity, source, sub_source, message, request=None):
 
     Logging needs to be very defensive, we don't want logging to cause an outage (happened once already)
 
+    Entries are buffered and written in bulk (see flush_log_buffer) so they may not be in
+    the database straight away. CRITICAL events are also emailed to support from the job queue.
+
     """
 
     # If we got a real user then use that for the user_object, and use the text name for the user
@@ -66,44 +85,82 @@ def log_event(user, severity, source, sub_source, message, request=None):
     except (TypeError, AttributeError):
         ip = None
 
-    # Create entry
-    Log(
-        user=user,
-        user_object=user_object,
-        ip=ip,
-        severity=severity,
-        source=source,
-        sub_source=sub_source,
-        message=message,
-    ).save()
+    # Add to the buffer, it will be written in bulk
+    _log_buffer.add(
+        Log(
+            event_date=timezone.now(),
+            user=user,
+            user_object=user_object,
+            ip=ip,
+            severity=severity,
+            source=source,
+            sub_source=sub_source,
+            message=message,
+        )
+    )
 
     if severity == "CRITICAL":
+        _queue_critical_alert(severity, source, sub_source, user, message)
+
+
+def flush_log_buffer():
+    """Write any buffered log entries to the database now"""
+
+    _log_buffer.flush()
+
 
-        try:
-            mail_subject = f"{severity} - {source}"
-            message = (
-                "Severity: %s\nSource: %s\nSub-Source: %s\nUser: %s\nMessage: %s"
-                % (
-                    severity,
-                    source,
-                    sub_source,
-                    user,
-                    message,
-                )
-            )
-            send_mail(
-                mail_subject,
-                message,
-                DEFAULT_FROM_EMAIL,
-                SUPPORT_EMAIL,
-                fail_silently=False,
-            )
-        except Exception as e:
-            print(f"{e}")
+def _queue_critical_alert(severity, source, sub_source, user, message):
+    """Email support about a critical event, in the background and only once for
+    repeats of the same event within LOG_ALERT_DEDUPE_SECONDS"""
+
+    dedupe_key = hashlib.md5(
+        f"{source}:{sub_source}:{message}".encode(errors="replace")
+    ).hexdigest()
+
+    try:
+        if not shared_cache().add(
+            f"log_alert:{dedupe_key}", True, LOG_ALERT_DEDUPE_SECONDS
+        ):
+            return
+
+        queue_job(
+            send_critical_log_alert,
+            severity=severity,
+            source=source,
+            sub_source=sub_source,
+            user=str(user),
+            message=str(message),
+        )
+    except Exception as exc:  # noqa
+        logger.error(f"Unable to queue critical log alert: {exc}")
+
+
+@cobalt_job
+def send_critical_log_alert(severity, source, sub_source, user, message):
+    """Email support about a critical event. Run from the job queue"""
+
+    mail_subject = f"{severity} - {source}"
+    message = "Severity: %s\nSource: %s\nSub-Source: %s\nUser: %s\nMessage: %s" % (
+        severity,
+        source,
+        sub_source,
+        user,
+        message,
+    )
+    send_mail(
+        mail_subject,
+        message,
+        DEFAULT_FROM_EMAIL,
+        SUPPORT_EMAIL,
+        fail_silently=False,
+    )
 
 
 @user_passes_test(lambda u: u.is_superuser)
 def home(request):
+    """Log viewer. Pages through the logs newest first using the last row shown
+    (keyset pagination) rather than an offset, so it stays fast on a big table"""
+
     form_severity = request.GET.get("severity")
     form_source = request.GET.get("source")
     form_sub_source = request.GET.get("sub_source")
@@ -114,9 +171,7 @@ def home(request):
 
     ref_date = timezone.now() - timedelta(days=days)
 
-    events_list = Log.objects.filter(event_date__gte=ref_date).select_related(
-        "user_object"
-    )
+    events_list = Log.objects.filter(event_date__gte=ref_date)
 
     # only show sub sources if sources has been selected
     sub_sources = None
@@ -135,8 +190,8 @@ def home(request):
             events_list = events_list.filter(sub_source=form_sub_source)
 
     # lists should be based upon other filters
-    severities = events_list.values("severity").distinct()
-    sources = events_list.values("source").distinct()
+    severities = events_list.values("severity").distinct().order_by("severity")
+    sources = events_list.values("source").distinct().order_by("source")
     users = events_list.exclude(user=None).values("user").distinct()
 
     unique_users = []
@@ -147,11 +202,17 @@ def home(request):
 
     unique_users.sort()
 
+    things = cobalt_keyset_paginator(
+        request,
+        events_list.select_related("user_object").order_by("-event_date", "-pk"),
+        LOG_VIEWER_PAGE_SIZE,
+    )
+
     return render(
         request,
         "logs/event_list.html",
         {
-            "things": events_list,
+            "things": things,
             "severities": severities,
             "days": days,
             "form_severity": form_severity,
@@ -55,6 +55,10 @@ class MasterpointFactory:
     def user_summary(self, system_number):
         """Get basic information about a user"""
 
+    def system_number_details(self, system_number):
+        """Get name and status for a system number. Returns None if the number isn't known,
+        raises an exception if we can't tell (e.g. the MPC is down)"""
+
 
 class MasterpointDB(MasterpointFactory):
     """Concrete implementation of a masterpoint factory using a database to get the data"""
@@ -114,6 +118,21 @@ class MasterpointDB(MasterpointFactory):
 
         return False, "Invalid or inactive number"
 
+    def system_number_details(self, system_number):
+
+        response = requests.get(f"{GLOBAL_MPSERVER}/id/{system_number}", timeout=10)
+        response.raise_for_status()
+        rows = response.json()
+
+        if not rows:
+            return None
+
+        return {
+            "GivenNames": html.unescape(rows[0]["GivenNames"]),
+            "Surname": html.unescape(rows[0]["Surname"]),
+            "IsActive": rows[0]["IsActive"] == "Y",
+        }
+
     def user_summary(self, system_number):
 
         # Get summary data
@@ -208,6 +227,20 @@ class MasterpointFile(MasterpointFactory):
             "home_club": None,
         }
 
+    def system_number_details(self, system_number):
+
+        pattern = f"{int(system_number):07}"
+        result = mp_file_grep(pattern)
+
+        if not result:
+            return None
+
+        return {
+            "GivenNames": result[2],
+            "Surname": result[1],
+            "IsActive": result[6] == "Y",
+        }
+
 
 def masterpoint_factory_creator():
     return MasterpointFile() if MP_USE_FILE else MasterpointDB()
@@ -137,8 +137,8 @@ def _notifications_api_common_messages_for_user_v1(messages):
 
     # return messages as list
     return_messages = []
+    unread_ids = []
 
-    # mark messages as read now
     for message in messages:
         created_datetime = message.created_time.astimezone(TZ).strftime(
             "%a %d-%b-%Y %-I:%M"
@@ -149,8 +149,14 @@ def _notifications_api_common_messages_for_user_v1(messages):
             id=message.id, message=message.msg, created_datetime=created_datetime
         )
         return_messages.append(item)
-        message.has_been_read = True
-        message.save()
+        if not message.has_been_read:
+            unread_ids.append(message.id)
+
+    # mark messages as read now, in one go
+    if unread_ids:
+        RealtimeNotification.objects.filter(id__in=unread_ids).update(
+            has_been_read=True
+        )
 
     return 200, {
         "status": api_app.APIStatus.SUCCESS,
@@ -5,18 +5,52 @@ from dateutil.relativedelta import relativedelta
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
-from notifications.models import Email, InAppNotification
+from notifications.models import InAppNotification
 
 logger = logging.getLogger("cobalt")
 
+DEFAULT_RETENTION_MONTHS = 3
+DELETE_CHUNK_SIZE = 5000
+
+
+def delete_in_app_notifications_before(cut_off, chunk_size=DELETE_CHUNK_SIZE):
+    """Delete InAppNotifications created before cut_off. Returns how many were deleted.
+
+    Deletes oldest first, chunk_size at a time, each in its own statement so we never
+    hold locks on lots of rows. The ids come from the index on created_date so we
+    don't scan the table or load the notifications."""
+
+    old_notifications = InAppNotification.objects.filter(
+        created_date__lt=cut_off
+    ).order_by("created_date")
+
+    deleted = 0
+    while True:
+        chunk = list(old_notifications.values_list("id", flat=True)[:chunk_size])
+        if not chunk:
+            break
+        deleted += InAppNotification.objects.filter(id__in=chunk).delete()[0]
+
+    return deleted
+
 
 class Command(BaseCommand):
+    help = "Delete old in app notifications"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=DEFAULT_RETENTION_MONTHS,
+            help=f"Keep this many months of notifications (default {DEFAULT_RETENTION_MONTHS})",
+        )
+        parser.add_argument("--chunk-size", type=int, default=DELETE_CHUNK_SIZE)
+
     def handle(self, *args, **options):
         print("running delete_old_in_app_notifications...")
 
-        three_months_ago = timezone.now() - relativedelta(months=3)
-        notifications = InAppNotification.objects.filter(
-            created_date__lt=three_months_ago
-        )
-        logger.info(f"Deleting {len(notifications)} InAppNotifications.")
-        notifications.delete()
+        cut_off = timezone.now() - relativedelta(months=options["months"])
+
+        deleted = delete_in_app_notifications_before(cut_off, options["chunk_size"])
+
+        logger.info(f"Deleted {deleted} InAppNotifications before {cut_off}.")
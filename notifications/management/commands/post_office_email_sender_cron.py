@@ -1,27 +1,226 @@
-""" Cron job to send email """
+""" Cron job to send email
+
+    Queued post office emails are sent by --processes worker processes for up to
+    --max-time seconds. Worker 0 is the priority lane and only sends high priority
+    mail (password resets, payment receipts etc). The other workers share out
+    everything else by email id, so no two workers can pick up the same email and a
+    large club or congress mail-out can't hold up transactional mail.
+
+    All workers take from one token bucket to stay within the SES send rate, and the
+    bulk workers leave some tokens for the priority lane.
+
+    Django Post Office uses file locks for controlling its cron, we can't use that
+    in a distributed environment so we do our own locking and only one node sends
+    at a time.
+"""
+from multiprocessing import get_context
 import logging
+import time
 
+from django import db
 from django.core.management.base import BaseCommand
-from post_office.mail import send_queued
+from django.db.models import F, Q
+from django.utils import timezone
+from post_office.mail import _send_bulk
+from post_office.models import Email as PostOfficeEmail, PRIORITY, STATUS
+
+from cobalt.settings import EMAIL_SENDER_PROCESSES, EMAIL_SEND_RATE
+from utils.views.cobalt_buffer import flush_all_buffers
 
 logger = logging.getLogger("cobalt")
 
+PRIORITY_LANE = "priority"
+BULK_LANE = "bulk"
+
+PRIORITY_LANE_RESERVE = 0.2
+""" fraction of the send rate the bulk workers leave for the priority lane """
+
+SEND_BATCH_SIZE = 20
+""" emails a worker picks up at a time, small so priority order is kept """
+
+POLL_INTERVAL = 1
+""" seconds to wait when there is nothing to send """
+
+
+class TokenBucket:
+    """Rate limiter shared between forked worker processes"""
+
+    def __init__(self, context, rate):
+        self.rate = rate
+        self.capacity = rate
+        self._tokens = context.Value("d", rate, lock=False)
+        self._updated = context.Value("d", time.monotonic(), lock=False)
+        self._lock = context.Lock()
+
+    def take(self, reserve=0):
+        """Wait for a token, leaving at least reserve tokens in the bucket"""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens.value = min(
+                    self.capacity,
+                    self._tokens.value + (now - self._updated.value) * self.rate,
+                )
+                self._updated.value = now
+
+                if self._tokens.value - 1 >= reserve:
+                    self._tokens.value -= 1
+                    return
+
+                wait = (1 + reserve - self._tokens.value) / self.rate
+
+            time.sleep(wait)
+
+
+_bucket = None
+""" the shared TokenBucket, inherited by the workers """
+
+
+def _init_worker(bucket):
+    global _bucket
+    _bucket = bucket
+
+
+def _queued_emails(lane, shard, shards):
+    """Emails ready to send for this lane and shard, most urgent first"""
+
+    now = timezone.now()
+
+    queued = (
+        PostOfficeEmail.objects.filter(status=STATUS.queued)
+        .filter(Q(scheduled_time__lte=now) | Q(scheduled_time=None))
+        .filter(Q(expires_at__gt=now) | Q(expires_at=None))
+    )
+
+    if lane == PRIORITY_LANE:
+        queued = queued.filter(priority__gte=PRIORITY.high)
+    else:
+        queued = (
+            queued.filter(priority__lt=PRIORITY.high)
+            .annotate(shard=F("id") % shards)
+            .filter(shard=shard)
+        )
+
+    return (
+        queued.select_related("template")
+        .prefetch_related("attachments")
+        .order_by("-priority", "id")
+    )
+
+
+def sender_worker(lane, shard, shards, max_time):
+    """Send emails for this lane and shard until we run out of time.
+    Returns the lane and the number sent and failed"""
+
+    # Each worker needs its own database connection
+    db.connections.close_all()
+
+    reserve = 0 if lane == PRIORITY_LANE else _bucket.capacity * PRIORITY_LANE_RESERVE
+    end_time = time.monotonic() + max_time
+    sent = 0
+    failed = 0
+
+    while time.monotonic() < end_time:
+
+        try:
+            emails = list(_queued_emails(lane, shard, shards)[:SEND_BATCH_SIZE])
+
+            if not emails:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            for _ in emails:
+                _bucket.take(reserve)
+
+            results = _send_bulk(emails, uses_multiprocessing=False)
+            sent += results[0]
+            failed += results[1]
+
+        except Exception as exc:  # noqa
+            logger.error(f"Email sender {lane} {shard} failed: {exc}")
+            time.sleep(POLL_INTERVAL)
+
+    # pool workers don't run atexit handlers
+    flush_all_buffers()
+    db.connections.close_all()
+
+    return lane, sent, failed
+
 
 class Command(BaseCommand):
-    def handle(self, *args, **options):
-        """If we can get a lock on the email topic then send emails
+    help = "Send queued post office emails"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=EMAIL_SENDER_PROCESSES,
+            help=f"Worker processes, including the priority lane (default {EMAIL_SENDER_PROCESSES})",
+        )
+        parser.add_argument(
+            "--max-time",
+            type=int,
+            default=25,
+            help="Seconds to send for (default 25, cron starts us every 30 seconds)",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=EMAIL_SEND_RATE,
+            help=f"Maximum emails per second across all workers (default {EMAIL_SEND_RATE})",
+        )
 
-        Django Post Office using file locks for controlling its cron,
-        we can't use that in a distributed environment so we do our own locking.
+    def handle(self, *args, **options):
+        """If we can get a lock on the email topic then send emails"""
 
-        """
         from utils.views.cobalt_lock import CobaltLock
 
         logger.info("Post Office cron looking for work")
 
         lock = CobaltLock("email")
-        if lock.get_lock():
-            send_queued(processes=1)
-            lock.free_lock()
-        else:
+        if not lock.get_lock():
             logger.info("Topic: 'email' is currently locked")
+            return
+
+        try:
+            self.send(options)
+        finally:
+            lock.free_lock()
+
+    def send(self, options):
+        """Run the priority lane and bulk workers and report what they did"""
+
+        bulk_shards = max(1, options["processes"] - 1)
+
+        worker_args = [(PRIORITY_LANE, 0, 1, options["max_time"])] + [
+            (BULK_LANE, shard, bulk_shards, options["max_time"])
+            for shard in range(bulk_shards)
+        ]
+
+        context = get_context("fork")
+        bucket = TokenBucket(context, options["rate"])
+
+        start_time = time.perf_counter()
+
+        db.connections.close_all()
+        with context.Pool(
+            processes=len(worker_args),
+            initializer=_init_worker,
+            initargs=(bucket,),
+        ) as pool:
+            results = pool.starmap(sender_worker, worker_args)
+
+        elapsed = time.perf_counter() - start_time
+
+        sent = sum(result[1] for result in results)
+        failed = sum(result[2] for result in results)
+        priority_sent = sum(
+            result[1] for result in results if result[0] == PRIORITY_LANE
+        )
+
+        if sent or failed:
+            logger.info(
+                f"Post Office sent {sent} emails ({priority_sent} priority), {failed} failed "
+                f"in {elapsed:.1f}s, {sent / elapsed:.1f} per second with {len(worker_args)} workers"
+            )
@@ -0,0 +1,38 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # These tables are busy, build the indexes without locking out writes
+    atomic = False
+
+    dependencies = [
+        ("notifications", "0054_add_snooper_indexes"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="inappnotification",
+            index=models.Index(
+                fields=["member", "acknowledged", "created_date"],
+                name="notif_inapp_member_ack_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="inappnotification",
+            index=models.Index(
+                fields=["member", "created_date"], name="notif_inapp_member_date_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="inappnotification",
+            index=models.Index(fields=["created_date"], name="notif_inapp_date_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="realtimenotification",
+            index=models.Index(
+                fields=["member", "has_been_read"], name="notif_rt_member_read_idx"
+            ),
+        ),
+    ]
@@ -38,6 +38,21 @@ class InAppNotification(models.Model):
 
     created_date = models.DateTimeField("Creation Date", default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # unacknowledged count and list for the menu
+            models.Index(
+                fields=["member", "acknowledged", "created_date"],
+                name="notif_inapp_member_ack_idx",
+            ),
+            # all notifications for a user, newest first
+            models.Index(
+                fields=["member", "created_date"], name="notif_inapp_member_date_idx"
+            ),
+            # nightly clean up
+            models.Index(fields=["created_date"], name="notif_inapp_date_idx"),
+        ]
+
 
 class NotificationMapping(models.Model):
     """Stores mappings of users to events and actions"""
@@ -493,6 +508,14 @@ class RealtimeNotification(models.Model):
     """ Optional device for FCM """
     created_time = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # unread messages for the app
+            models.Index(
+                fields=["member", "has_been_read"], name="notif_rt_member_read_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.member.full_name} - {self.created_time.strftime('%Y-%m-%d%H:%M:%S')}"
 
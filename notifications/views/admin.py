@@ -26,7 +26,7 @@ from notifications.views.core import _cloudwatch_reader, send_fcm_message
 from rbac.core import rbac_user_has_role
 from rbac.decorators import rbac_check_role
 from rbac.views import rbac_forbidden
-from utils.utils import cobalt_paginator
+from utils.utils import cobalt_paginator, cobalt_keyset_paginator
 from post_office.models import Email as PostOfficeEmail
 
 
@@ -40,7 +40,7 @@ def admin_view_all_emails(request):
         return rbac_forbidden(request, role)
 
     emails = PostOfficeEmail.objects.all().select_related("snooper").order_by("-pk")
-    things = cobalt_paginator(request, emails)
+    things = cobalt_keyset_paginator(request, emails, estimate_count=True)
 
     return render(
         request, "notifications/admin_view_all_emails.html", {"things": things}
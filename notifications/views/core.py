@@ -2,7 +2,6 @@ import logging
 import re
 import mimetypes
 from datetime import datetime, date
-from threading import Thread
 from itertools import chain
 from urllib.parse import urlencode
 
@@ -16,7 +15,7 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.mail import EmailMultiAlternatives
 from django.core.paginator import Paginator
-from django.db import connection, IntegrityError
+from django.db import IntegrityError
 from django.db.models import Count, OuterRef, Subquery, CharField, Q
 from django.db.models.functions import Cast
 from django.http import HttpResponse
@@ -97,6 +96,7 @@ from organisations.club_admin_core import (
 from organisations.models import (
     Organisation,
     ClubTag,
+    MemberClubDetails,
     MemberClubTag,
     OrgEmailTemplate,
 )
@@ -105,6 +105,7 @@ from rbac.core import rbac_user_has_role, rbac_get_users_with_role
 from rbac.views import rbac_forbidden
 
 from post_office.models import Email as PostOfficeEmail
+from utils.views.cobalt_jobs import cobalt_job, queue_job
 
 logger = logging.getLogger("cobalt")
 
@@ -396,6 +397,124 @@ def send_cobalt_email_with_template(
     return True
 
 
+def _email_addresses_on_bounce_list(to_addresses):
+    """Bulk version of _email_address_on_bounce_list. Returns the set of addresses
+    that we should not send to"""
+
+    to_addresses = set(to_addresses)
+
+    suppressed = set(
+        UserAdditionalInfo.objects.filter(
+            user__email__in=to_addresses, email_hard_bounce=True
+        ).values_list("user__email", flat=True)
+    )
+    suppressed.update(
+        MemberClubDetails.objects.filter(
+            email__in=to_addresses, email_hard_bounce=True
+        ).values_list("email", flat=True)
+    )
+    suppressed.update(
+        UnregisteredBlockedEmail.objects.filter(email__in=to_addresses).values_list(
+            "email", flat=True
+        )
+    )
+
+    for to_address in suppressed:
+        logger.info(f"Not sending email to suppressed address - {to_address}")
+
+    return suppressed
+
+
+def send_cobalt_email_with_template_many(
+    emails,
+    template="system - default flex",
+    sender=None,
+    priority="medium",
+    batch_id=None,
+    reply_to=None,
+):
+    """Queue many emails using the same template with a single insert rather than
+    calling send_cobalt_email_with_template for each one.
+
+    Args:
+        emails (list): list of (to_address, context) tuples. Context is as for
+            send_cobalt_email_with_template
+        template (str or EmailTemplate instance): template to use for all emails
+        sender (str): who to send from (None will use default from settings file)
+        priority (str): Django Post Office priority (not "now")
+        batch_id (BatchID): batch_id for this batch of emails
+        reply_to (str): email address to send replies to
+
+    Returns:
+        int: number of emails queued
+    """
+
+    if not emails:
+        return 0
+
+    suppressed = _email_addresses_on_bounce_list(
+        [to_address for to_address, _ in emails]
+    )
+
+    batch_size = len(emails)
+
+    # COB-793 - add custom header with batch size
+    headers = {"X-Myabf-Batch-Size": batch_size}
+    if reply_to:
+        headers["Reply-to"] = reply_to
+
+    limited_notifications = apply_large_email_batch_config(batch_size)
+
+    post_office_emails = []
+
+    for to_address, context in emails:
+
+        if to_address in suppressed:
+            continue
+
+        # Augment context
+        context["host"] = COBALT_HOSTNAME
+        context.setdefault("show_club_footer", True)
+        context.setdefault("img_src", "notifications/img/myabf-email.png")
+        context.setdefault("link_colour", "primary")
+        if "subject" not in context and "title" in context:
+            context["subject"] = context["title"]
+        if context.get("subject"):
+            context["subject"] = mark_safe(context["subject"])
+        context["inline_banner"] = context["img_src"][0] != "/"
+
+        # Check for playpen - don't send emails to users unless on production or similar
+        to_address, context = _to_address_checker(to_address, context)
+
+        post_office_emails.append(
+            po_email.send(
+                sender=sender,
+                recipients=to_address,
+                template=template,
+                context=context,
+                render_on_delivery=True,
+                priority=priority,
+                headers=headers,
+                commit=False,
+            )
+        )
+
+    post_office_emails = PostOfficeEmail.objects.bulk_create(post_office_emails)
+
+    Snooper.objects.bulk_create(
+        [
+            Snooper(
+                post_office_email=email,
+                batch_id=batch_id,
+                limited_notifications=limited_notifications,
+            )
+            for email in post_office_emails
+        ]
+    )
+
+    return len(post_office_emails)
+
+
 def send_cobalt_email_preformatted(
     to_address,
     subject,
@@ -509,17 +628,20 @@ def send_cobalt_bulk_email(bcc_addresses, subject, message, reply_to=""):
         Nothing
     """
 
-    # start thread
-    thread = Thread(
-        target=send_cobalt_bulk_email_thread,
-        args=[bcc_addresses, subject, message, reply_to],
+    # Don't retry, some of the emails could already have gone
+    queue_job(
+        send_cobalt_bulk_email_job,
+        max_attempts=1,
+        bcc_addresses=bcc_addresses,
+        subject=subject,
+        message=message,
+        reply_to=reply_to,
     )
-    thread.setDaemon(True)
-    thread.start()
 
 
-def send_cobalt_bulk_email_thread(bcc_addresses, subject, message, reply_to):
-    """Send bulk emails. Asynchronous thread
+@cobalt_job
+def send_cobalt_bulk_email_job(bcc_addresses, subject, message, reply_to):
+    """Send bulk emails. Run from the job queue
 
     Args:
         bcc_addresses (list): who to send to, list of strings
@@ -565,9 +687,6 @@ def send_cobalt_bulk_email_thread(bcc_addresses, subject, message, reply_to):
                 status="Sent",
             ).save()
 
-    # Django creates a new database connection for this thread so close it
-    connection.close()
-
 
 def send_cobalt_bulk_notifications(
     msg_list,
@@ -2694,35 +2813,36 @@ def _dispatch_batch(request, club, batch, attachments, test_user=None):
             _finalise_email_batch(batch, batch_size=1)
 
     else:
-        # send in a separate thread
-
-        # start thread
-        thread = Thread(
-            target=_dispatch_batch_thread,
-            args=[
-                batch,
-                recipients,
-                context,
-                po_template,
-                reply_to,
-                attachments,
-            ],
+        # send in the background. Don't retry, we could send duplicates
+
+        queue_job(
+            _dispatch_batch_job,
+            max_attempts=1,
+            batch_pk=batch.pk,
+            context=context,
+            po_template=po_template,
+            reply_to=reply_to,
+            attachments=attachments,
         )
-        thread.setDaemon(True)
-        thread.start()
 
     return True
 
 
-def _dispatch_batch_thread(
-    batch,
-    recipients,
+@cobalt_job
+def _dispatch_batch_job(
+    batch_pk,
     context,
     po_template,
     reply_to,
     attachments,
 ):
-    """Asynchronous thread to send bulk emails for a batch"""
+    """Send bulk emails for a batch. Run from the job queue"""
+
+    batch = BatchID.objects.get(pk=batch_pk)
+    recipients = Recipient.objects.filter(
+        batch=batch,
+        include=True,
+    )
 
     # Mark the batch as in flight
     batch.state = BatchID.BATCH_STATE_IN_FLIGHT
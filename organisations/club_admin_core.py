@@ -20,7 +20,27 @@ import bleach
 from datetime import datetime, date, timedelta
 from itertools import chain
 import logging
-
+import time
+
+from django.db import transaction
+from django.db.models import (
+    BooleanField,
+    Case,
+    CharField,
+    Count,
+    DateField,
+    DecimalField,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Lower, NullIf
 from django.urls import reverse
 from django.utils import timezone
 from django.template.loader import render_to_string
@@ -31,6 +51,7 @@ from accounts.models import (
     UserAdditionalInfo,
 )
 from cobalt.settings import (
+    AUTO_TOP_UP_LOW_LIMIT,
     BLEACH_ALLOWED_TAGS,
     BLEACH_ALLOWED_ATTRIBUTES,
     BLEACH_ALLOWED_STYLES,
@@ -40,6 +61,7 @@ from cobalt.settings import (
     ABF_USER,
     COBALT_HOSTNAME,
 )
+from dashboard.widgets import dashboard_widget_invalidate
 
 from utils.templatetags.cobalt_tags import cobalt_nice_date_short
 
@@ -1126,6 +1148,50 @@ def club_email_for_member(club, system_number):
     return user.email
 
 
+def club_emails_for_members(club, system_numbers):
+    """Set based version of club_email_for_member for many members
+
+    Args:
+        club (Organisation): the club
+        system_numbers (list): members' system numbers
+
+    Returns:
+        dict: system number to email address, only for members with one
+    """
+
+    member_details = (
+        MemberClubDetails.objects.filter(
+            club=club,
+            system_number__in=system_numbers,
+        )
+        .exclude(membership_status=MemberClubDetails.MEMBERSHIP_STATUS_DECEASED)
+        .order_by("pk")
+    )
+
+    club_emails = {}
+    check_user = []
+
+    for member_detail in member_details:
+        # last one wins, as for club_email_for_member
+        club_emails.pop(member_detail.system_number, None)
+        if member_detail.email:
+            club_emails[member_detail.system_number] = member_detail.email
+        elif (
+            member_detail.membership_status
+            != MemberClubDetails.MEMBERSHIP_STATUS_CONTACT
+        ):
+            check_user.append(member_detail.system_number)
+
+    # no club specific email, so check for a user record
+    for system_number, email in User.objects.filter(
+        system_number__in=check_user
+    ).values_list("system_number", "email"):
+        if system_number not in club_emails:
+            club_emails[system_number] = email
+
+    return club_emails
+
+
 def has_club_email_bounced(email):
     """Checks for any club email reference to this email which has bounced
 
@@ -1668,6 +1734,39 @@ def add_member(
     return (True, message)
 
 
+def _set_membership_paid_status(membership, ok):
+    """Update a membership's paid fields and state once we know if it has been paid.
+    Part of _process_membership_payment, also used to undo a payment that can't be booked."""
+
+    membership.is_paid = ok
+    membership.paid_until_date = membership.end_date if ok else None
+
+    today = timezone.now().date()
+    if ok:
+        membership.paid_date = today
+        membership.auto_pay_date = None
+        if membership.is_in_effect:
+            membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_CURRENT
+        elif membership.start_date > today:
+            membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_FUTURE
+        else:
+            # should never happen (creating a membership in the past) ...
+            membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_LAPSED
+    else:
+        if membership.fee == 0:
+            membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_CURRENT
+        elif membership.start_date > today:
+            membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_FUTURE
+        elif membership.due_date >= today:
+            membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_DUE
+        else:
+            # something has gone wrong, past due but not paid successfully
+            # make due date today to give a chance of recovery
+            # JPG - perhaps should have an "overdue" status as well as lapsed?
+            membership.due_date = today
+            membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_DUE
+
+
 def _process_membership_payment(
     club,
     is_registered_user,
@@ -1675,6 +1774,7 @@ def _process_membership_payment(
     payment_method,
     description,
     process_payment=True,
+    book_internals=True,
 ):
     """
     Common processing of membership payments. On successful completion the following membership fields
@@ -1691,6 +1791,8 @@ def _process_membership_payment(
         payment_method (OrgPaymentMethod): payment method to be used, or None
         description (str): description to be used on the payment transactions
         process_payments (bool): should a Bridge Credit payment be processed (if the select method)?
+        book_internals (bool): passed to payment_api_batch. If False the caller must book the
+            member and organisation transactions for a successful Bridge Credit payment
 
     Returns:
         bool: False if unable to process the Bridge Credits, the payment method is invalid or already paid
@@ -1710,58 +1812,17 @@ def _process_membership_payment(
     if membership.is_paid:
         return (False, "Already paid")
 
-    def _has_paid(ok):
-        """Updates when paid status is known"""
-
-        membership.is_paid = ok
-        membership.paid_until_date = membership.end_date if ok else None
-
-        today = timezone.now().date()
-        if ok:
-            membership.paid_date = today
-            membership.auto_pay_date = None
-            if membership.is_in_effect:
-                membership.membership_state = (
-                    MemberMembershipType.MEMBERSHIP_STATE_CURRENT
-                )
-            elif membership.start_date > today:
-                membership.membership_state = (
-                    MemberMembershipType.MEMBERSHIP_STATE_FUTURE
-                )
-            else:
-                # should never happen (creating a membership in the past) ...
-                membership.membership_state = (
-                    MemberMembershipType.MEMBERSHIP_STATE_LAPSED
-                )
-        else:
-            if membership.fee == 0:
-                membership.membership_state = (
-                    MemberMembershipType.MEMBERSHIP_STATE_CURRENT
-                )
-            elif membership.start_date > today:
-                membership.membership_state = (
-                    MemberMembershipType.MEMBERSHIP_STATE_FUTURE
-                )
-            elif membership.due_date >= today:
-                membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_DUE
-            else:
-                # something has gone wrong, past due but not paid successfully
-                # make due date today to give a chance of recovery
-                # JPG - perhaps should have an "overdue" status as well as lapsed?
-                membership.due_date = today
-                membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_DUE
-
     if membership.fee == 0:
         # nothing to pay so ignore everything else
         membership.payment_method = None
-        _has_paid(True)
+        _set_membership_paid_status(membership, True)
         return (True, "Nothing to pay")
 
     # check the payment method
     if payment_method:
         if payment_method.payment_method == "Bridge Credits" and not is_registered_user:
             membership.payment_method = None
-            _has_paid(False)
+            _set_membership_paid_status(membership, False)
             logger.error(
                 f"Unregistered {membership.system_number} cannot pay with {BRIDGE_CREDITS}"
             )
@@ -1783,26 +1844,26 @@ def _process_membership_payment(
                     amount=membership.fee,
                     organisation=club,
                     payment_type="Club Membership",
-                    book_internals=True,
+                    book_internals=book_internals,
                 ):
                     # Payment successful
-                    _has_paid(True)
+                    _set_membership_paid_status(membership, True)
                     message = f"Paid by {BRIDGE_CREDITS}"
                 else:
                     # Payment failed, leave as unpaid
                     logger.error("Error processing Bridge Credits payment")
-                    _has_paid(False)
+                    _set_membership_paid_status(membership, False)
                     success = False
                     message = f"{BRIDGE_CREDITS} payment UNSUCCESSFUL"
             else:
-                _has_paid(False)
+                _set_membership_paid_status(membership, False)
                 message = f"{BRIDGE_CREDITS} payment not attempted"
         else:
             # off system payment, always mark as paid
-            _has_paid(True)
+            _set_membership_paid_status(membership, True)
             message = f"Paid by {payment_method.payment_method}"
     else:
-        _has_paid(False)
+        _set_membership_paid_status(membership, False)
         message = "No payment method specified"
 
     return (success, message)
@@ -2367,6 +2428,233 @@ def renew_membership(
     return (True, "Membership extended" + (f". {message}" if message else ""))
 
 
+BULK_RENEWAL_CHUNK_SIZE = 500
+""" members renewed per transaction by bulk_renew_memberships """
+
+
+def bulk_renew_memberships(
+    members,
+    renewal_parameters,
+    batch_id=None,
+    process_payment=False,
+    requester=None,
+    progress=None,
+):
+    """Set based equivalent of calling renew_membership for each member.
+
+    The members are validated in one pass, then each chunk of BULK_RENEWAL_CHUNK_SIZE
+    is written with a bulk_create for the memberships and the log records, one ledger
+    batch for any Bridge Credit payments and one insert for the renewal notices.
+
+    Args:
+        members (list): MemberClubDetails annotated by get_members_for_renewal
+        renewal_parameters (RenewalParameters): the parameters
+        batch_id (BatchID): the rbac batch id for the renewal notices, if sending notices
+        process_payment (bool): should Bridge Credit payments be processed
+        requester (User): the requesting user
+        progress (function): optional, called with the number of members done after each chunk
+
+    Returns:
+        int: renewed count
+        int: error count
+    """
+
+    from notifications.views.core import (
+        custom_sender,
+        send_cobalt_email_with_template_many,
+        update_context_for_club_default_template,
+    )
+    from payments.views.core import (
+        get_balance,
+        lock_member_balances,
+        low_balance_warning,
+        update_accounts_for_organisation,
+    )
+
+    club = renewal_parameters.club
+    actor_id = requester.id if requester else ABF_USER
+
+    # the member list may be out of date if this is running in the background
+    with_future = set(
+        MemberMembershipType.objects.filter(
+            membership_type__organisation=club,
+            membership_state=MemberMembershipType.MEMBERSHIP_STATE_FUTURE,
+            system_number__in=[member.system_number for member in members],
+        ).values_list("system_number", flat=True)
+    )
+
+    # same checks as can_perform_action("extend", ...) without a query per member
+    renewable = []
+    for member in members:
+        if member.system_number in with_future:
+            reason = "Member already has a future dated membership"
+        elif member.membership_status not in [
+            MemberClubDetails.MEMBERSHIP_STATUS_CURRENT,
+            MemberClubDetails.MEMBERSHIP_STATUS_DUE,
+        ]:
+            reason = "Member must in a current member to extend"
+        elif member.latest_membership.membership_type.does_not_renew:
+            reason = f"{member.latest_membership.membership_type.name} memberships do not renew"
+        elif renewal_parameters.end_date <= member.latest_membership.end_date:
+            reason = "New end date must be later than the current end date"
+        else:
+            renewable.append(member)
+            continue
+
+        logger.warning(f"Unable to renew {member.system_number} at {club}: {reason}")
+
+    error_count = len(members) - len(renewable)
+
+    # the club default email styling is the same for every notice
+    notice_style = {}
+    notice_sender = None
+    notice_reply_to = None
+    if renewal_parameters.send_notice and renewal_parameters.club_template is None:
+        default_template = update_context_for_club_default_template(club, notice_style)
+        if default_template:
+            notice_sender = custom_sender(default_template.from_name)
+            notice_reply_to = default_template.reply_to
+
+    ok_count = 0
+
+    for start in range(0, len(renewable), BULK_RENEWAL_CHUNK_SIZE):
+
+        chunk = renewable[start : start + BULK_RENEWAL_CHUNK_SIZE]
+
+        new_memberships = []
+        ledger_entries = []
+        logs = []
+
+        for member in chunk:
+
+            new_membership = MemberMembershipType(
+                system_number=member.system_number,
+                membership_type=renewal_parameters.membership_type,
+                start_date=renewal_parameters.start_date,
+                due_date=renewal_parameters.due_date,
+                end_date=renewal_parameters.end_date,
+                auto_pay_date=renewal_parameters.auto_pay_date,
+                fee=renewal_parameters.fee,
+                last_modified_by=requester,
+                membership_state=MemberMembershipType.MEMBERSHIP_STATE_FUTURE,
+            )
+
+            # the ledger entries are booked for the whole chunk below
+            _process_membership_payment(
+                club,
+                (member.user_type == f"{GLOBAL_TITLE} User"),
+                new_membership,
+                renewal_parameters.payment_method,
+                "Membership renewal",
+                process_payment=process_payment,
+                book_internals=False,
+            )
+
+            if (
+                new_membership.is_paid
+                and new_membership.fee
+                and new_membership.payment_method.payment_method == "Bridge Credits"
+            ):
+                ledger_entries.append((member.user_id, new_membership))
+
+            new_memberships.append(new_membership)
+
+            logs.append(
+                ClubMemberLog(
+                    club=club,
+                    system_number=member.system_number,
+                    actor_id=actor_id,
+                    description=f"{member.latest_membership.membership_type.name} membership extended from "
+                    + f"{new_membership.start_date.strftime('%d-%m-%Y')} to {new_membership.end_date.strftime('%d-%m-%Y')}",
+                )
+            )
+
+        # only registered users can pay with Bridge Credits
+        paying_users = User.objects.in_bulk([user_id for user_id, _ in ledger_entries])
+
+        with transaction.atomic():
+
+            # _process_membership_payment checked the balances, check again under the lock
+            # in case anything has been spent since
+            balances = lock_member_balances(paying_users)
+            booked_entries = []
+            for user_id, new_membership in ledger_entries:
+                if float(new_membership.fee) > balances[user_id]:
+                    logger.warning(
+                        f"Unable to take renewal payment from {new_membership.system_number} at {club}: "
+                        + f"balance is now {balances[user_id]}, less than the fee of {new_membership.fee}"
+                    )
+                    _set_membership_paid_status(new_membership, False)
+                    new_membership.paid_date = None
+                    new_membership.auto_pay_date = renewal_parameters.auto_pay_date
+                    continue
+                booked_entries.append((paying_users[user_id], new_membership.fee))
+            ledger_entries = booked_entries
+
+            update_accounts_for_organisation(
+                club, ledger_entries, "Membership renewal", "Club Membership"
+            )
+
+            logs.extend(
+                ClubMemberLog(
+                    club=club,
+                    system_number=new_membership.system_number,
+                    actor_id=actor_id,
+                    description=f"Membership paid using {new_membership.payment_method.payment_method}",
+                )
+                for new_membership in new_memberships
+                if new_membership.is_paid
+                and new_membership.fee
+                and new_membership.payment_method
+            )
+
+            MemberMembershipType.objects.bulk_create(new_memberships)
+            ClubMemberLog.objects.bulk_create(logs)
+
+            # bulk_create doesn't send the signals that normally do this
+            renewed_user_ids = [member.user_id for member in chunk if member.user_id]
+            transaction.on_commit(
+                lambda user_ids=renewed_user_ids: dashboard_widget_invalidate(
+                    "events", user_ids
+                )
+            )
+
+        # payment_api_batch doesn't warn about low balances if we book the internals
+        for member, _ in ledger_entries:
+            if (
+                member.stripe_auto_confirmed != "On"
+                and float(get_balance(member)) < AUTO_TOP_UP_LOW_LIMIT
+            ):
+                low_balance_warning(member)
+
+        ok_count += len(chunk)
+
+        if renewal_parameters.send_notice:
+            emails = []
+            for member in chunk:
+                club_email, context = _format_renewal_notice_email(
+                    member, renewal_parameters
+                )
+                if club_email:
+                    context.update(notice_style)
+                    emails.append((club_email, context))
+
+            send_cobalt_email_with_template_many(
+                emails,
+                sender=notice_sender,
+                batch_id=batch_id,
+                reply_to=notice_reply_to,
+            )
+
+        if progress:
+            progress(error_count + ok_count)
+
+    if progress and not renewable:
+        progress(error_count)
+
+    return (ok_count, error_count)
+
+
 def _format_renewal_notice_email(
     member_details, renewal_parameters, test_email_address=None
 ):
@@ -3470,6 +3758,87 @@ def _notify_user_of_membership(member_details, user=None):
     )
 
 
+def _annotate_member_identity(
+    queryset, club, member_email, include_internal_unreg=False
+):
+    """Annotate a queryset of objects with a system_number with details of the
+    member, worked out in the database rather than by loading the User,
+    UnregisteredUser and MemberClubOptions records and merging them in Python.
+
+    Members with neither a User nor an UnregisteredUser record are excluded.
+
+    Args:
+        queryset (QuerySet): MemberClubDetails or MemberMembershipType
+        club (Organisation): the club
+        member_email (Expression): the club specific email for the member
+        include_internal_unreg (bool): include unregistered users with internal system numbers
+
+    Returns:
+        QuerySet: annotated with
+            user_id (int): the pk of the User, or None
+            first_name (str)
+            last_name (str)
+            user_type (str): '{GLOBAL_TITLE} User' or 'Unregistered User'
+            allow_auto_pay (bool): registered and not blocking auto pay for this club
+            club_email (str): club email if set, otherwise the user's email, or None
+    """
+
+    users = User.objects.filter(system_number=OuterRef("system_number"))
+
+    unreg_manager = (
+        UnregisteredUser.all_objects
+        if include_internal_unreg
+        else UnregisteredUser.objects
+    )
+    unreg_users = unreg_manager.filter(system_number=OuterRef("system_number"))
+
+    # NOTE: Options records are created when someone looks at their profile, so we
+    # need to check for people who have blocked (default is allow).
+    blocking_auto_pay = MemberClubOptions.objects.filter(
+        club=club,
+        user__system_number=OuterRef("system_number"),
+        allow_auto_pay=False,
+    )
+
+    return (
+        queryset.annotate(
+            is_registered=Exists(users),
+            is_unregistered=Exists(unreg_users),
+            blocks_auto_pay=Exists(blocking_auto_pay),
+        )
+        .filter(Q(is_registered=True) | Q(is_unregistered=True))
+        .annotate(
+            user_id=Subquery(users.values("pk")[:1]),
+            first_name=Coalesce(
+                Subquery(users.values("first_name")[:1]),
+                Subquery(unreg_users.values("first_name")[:1]),
+            ),
+            last_name=Coalesce(
+                Subquery(users.values("last_name")[:1]),
+                Subquery(unreg_users.values("last_name")[:1]),
+            ),
+            user_type=Case(
+                When(is_registered=True, then=Value(f"{GLOBAL_TITLE} User")),
+                default=Value("Unregistered User"),
+                output_field=CharField(),
+            ),
+            allow_auto_pay=Case(
+                When(is_registered=True, blocks_auto_pay=False, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+            # Note: this needs to replicate the logic in club_email_for_member
+            club_email=NullIf(
+                Coalesce(
+                    NullIf(member_email, Value("")),
+                    Subquery(users.values("email")[:1]),
+                ),
+                Value(""),
+            ),
+        )
+    )
+
+
 def get_members_for_renewal(
     club,
     renewal_parameters,
@@ -3477,9 +3846,12 @@ def get_members_for_renewal(
     just_system_number=None,
     stats_to_date=None,
 ):
-    """Return a list of members that match the bulk renewal parameters. Also can return just a single
+    """Return the members that match the bulk renewal parameters. Also can return just a single
     member details object for a specified member.
 
+    The members are returned as an annotated queryset so callers can page through
+    them in the database. The statistics are database aggregates.
+
     Args:
         club (Organisation): the club
         renewal_parameters (RenewalParameters): the renewal parameters from the BulkRenewalLineForm
@@ -3488,7 +3860,8 @@ def get_members_for_renewal(
         stats_to_date (dict): a dictionary of statistics to add to
 
     Returns:
-        list: list of augmented MemberClubDetail objects (with allow_auto_pay and form_index)
+        QuerySet: MemberClubDetails annotated as per _annotate_member_identity and with
+            form_index, fee and auto_pay_date
         dict: a dictionary of statistics
     """
 
@@ -3497,31 +3870,20 @@ def get_members_for_renewal(
     else:
         stats = {}
 
-    def init_metrics(metric_list):
-        for metric in metric_list:
-            if metric not in stats:
-                stats[metric] = 0
-
-    def increment_count(metric):
-        stats[metric] = stats.get(metric, 0) + 1
-
-    def add_to_total(metric, amount):
-        stats[metric] = stats.get(metric, 0) + amount
-
-    init_metrics(
-        ["allowing_auto_pay", "no_email", "total_fees", "member_count", "auto_pay_fees"]
-    )
-
-    target_end_date = renewal_parameters.start_date - timedelta(days=1)
+    for metric in [
+        "allowing_auto_pay",
+        "no_email",
+        "total_fees",
+        "member_count",
+        "auto_pay_fees",
+    ]:
+        stats.setdefault(metric, 0)
 
     if just_system_number:
 
         member_qs = MemberClubDetails.objects.filter(
             club=club,
             system_number=just_system_number,
-        ).select_related(
-            "latest_membership",
-            "latest_membership__membership_type",
         )
 
     else:
@@ -3533,196 +3895,118 @@ def get_members_for_renewal(
                 MemberClubDetails.MEMBERSHIP_STATUS_CURRENT,
                 MemberClubDetails.MEMBERSHIP_STATUS_DUE,
             ],
-            latest_membership__end_date=target_end_date,
-        ).select_related(
-            "latest_membership",
-            "latest_membership__membership_type",
+            latest_membership__end_date=renewal_parameters.start_date
+            - timedelta(days=1),
         )
 
-    # check for future memberships for these candiates (cannot renew if one exists)
-
-    system_numbers = [member.system_number for member in member_qs]
-
-    with_future = MemberMembershipType.objects.filter(
-        membership_type__organisation=club,
-        membership_state=MemberMembershipType.MEMBERSHIP_STATE_FUTURE,
-        system_number__in=system_numbers,
-    ).values_list("system_number", flat=True)
-
-    member_list = [
-        member for member in member_qs if member.system_number not in with_future
-    ]
-
-    # NOTE: could use _augment_member_details, then further augment with options, but combining
-    # these here avoids a second pass through the member list which might be large
+    # cannot renew if a future membership already exists
 
-    system_numbers = [member.system_number for member in member_list]
-
-    users = User.objects.filter(system_number__in=system_numbers)
-    unreg_users = UnregisteredUser.all_objects.filter(system_number__in=system_numbers)
-
-    # NOTE: Options records are created when someone looks at their profile, so we
-    # need to check for people who have blocked (default is allow).
-
-    system_numbers_blocking_auto_pay = MemberClubOptions.objects.filter(
-        club=club,
-        user__in=users,
-        allow_auto_pay=False,
-    ).values_list(
-        "user__system_number",
-        flat=True,
+    member_qs = member_qs.exclude(
+        system_number__in=MemberMembershipType.objects.filter(
+            membership_type__organisation=club,
+            membership_state=MemberMembershipType.MEMBERSHIP_STATE_FUTURE,
+        ).values("system_number")
     )
 
-    player_dict = {
-        player.system_number: {
-            "user_type": f"{GLOBAL_TITLE} User"
-            if type(player) is User
-            else "Unregistered User",
-            "user_or_unreg": player,
-            "user_email": player.email if type(player) is User else None,
-            "allow_auto_pay": (
-                (player.system_number not in system_numbers_blocking_auto_pay)
-                and (type(player) is User)
+    member_qs = (
+        _annotate_member_identity(
+            member_qs, club, F("email"), include_internal_unreg=True
+        )
+        .annotate(
+            form_index=Value(form_index, output_field=IntegerField()),
+            fee=Value(renewal_parameters.fee, output_field=DecimalField()),
+            auto_pay_date=Value(
+                renewal_parameters.auto_pay_date, output_field=DateField()
             ),
-        }
-        for player in chain(users, unreg_users)
-    }
-
-    for member in member_list:
-        if member.system_number in player_dict:
-            member.user_or_unreg = player_dict[member.system_number]["user_or_unreg"]
-            member.first_name = member.user_or_unreg.first_name
-            member.last_name = member.user_or_unreg.last_name
-            member.user_type = player_dict[member.system_number]["user_type"]
-            member.allow_auto_pay = player_dict[member.system_number]["allow_auto_pay"]
-            member.form_index = form_index
-            member.fee = renewal_parameters.fee
-            member.auto_pay_date = renewal_parameters.auto_pay_date
-            add_to_total("total_fees", member.fee)
-            increment_count("member_count")
-            if member.allow_auto_pay:
-                increment_count("allowing_auto_pay")
-                add_to_total("auto_pay_fees", member.fee)
-
-            # Note: this needs to replicate the logic in club_email_for_member
-            if member.email:
-                member.club_email = member.email
-            else:
-                member.club_email = player_dict[member.system_number]["user_email"]
-
-            if not member.club_email:
-                increment_count("no_email")
-
-    if just_system_number:
-        return member_list[0] if len(member_list) > 0 else None
-    else:
-        return (
-            member_list,
-            stats,
         )
-
-
-def _sort_memberships(membership_list, sort_option):
-    """Sort a list of memberships by various fields
-
-    Note that the membership_list must be augments by get_outstanding_memberships"""
-
-    if sort_option == "name_desc":
-        membership_list.sort(key=lambda x: (x.last_name.lower(), x.first_name.lower()))
-
-    elif sort_option == "name_asc":
-        membership_list.sort(
-            key=lambda x: (x.last_name.lower(), x.first_name.lower()), reverse=True
+        .select_related(
+            "club",
+            "latest_membership",
+            "latest_membership__membership_type",
         )
+        .order_by(Lower("last_name"), Lower("first_name"), "pk")
+    )
 
-    if sort_option == "type_desc":
-        membership_list.sort(key=lambda x: x.user_type.lower())
-
-    elif sort_option == "type_asc":
-        membership_list.sort(key=lambda x: x.user_type.lower(), reverse=True)
+    if just_system_number:
+        return member_qs.first()
 
-    elif sort_option == "membership_desc":
-        membership_list.sort(
-            key=lambda x: (
-                x.membership_type.name,
-                x.start_date,
-                x.last_name.lower(),
-                x.first_name.lower(),
-            )
-        )
+    counts = member_qs.aggregate(
+        member_count=Count("pk"),
+        allowing_auto_pay=Count("pk", filter=Q(allow_auto_pay=True)),
+        no_email=Count("pk", filter=Q(club_email__isnull=True)),
+    )
 
-    elif sort_option == "membership_asc":
-        membership_list.sort(
-            key=lambda x: (x.last_name.lower(), x.first_name.lower(), x.start_date)
-        )
-        membership_list.sort(key=lambda x: x.membership_type.name, reverse=True)
+    fee = renewal_parameters.fee or 0
 
-    elif sort_option == "due_desc":
-        membership_list.sort(
-            key=lambda x: (
-                x.due_date,
-                x.last_name.lower(),
-                x.first_name.lower(),
-            )
-        )
+    for metric, count in counts.items():
+        stats[metric] += count
+    stats["total_fees"] += fee * counts["member_count"]
+    stats["auto_pay_fees"] += fee * counts["allowing_auto_pay"]
 
-    elif sort_option == "due_asc":
-        membership_list.sort(key=lambda x: (x.last_name.lower(), x.first_name.lower()))
-        membership_list.sort(key=lambda x: x.due_date, reverse=True)
+    return (
+        member_qs,
+        stats,
+    )
 
-    elif sort_option == "auto_desc":
-        membership_list.sort(
-            key=lambda x: (
-                x.auto_pay_sort_date,
-                x.last_name.lower(),
-                x.first_name.lower(),
-            )
-        )
 
-    elif sort_option == "auto_asc":
-        membership_list.sort(key=lambda x: (x.last_name.lower(), x.first_name.lower()))
-        membership_list.sort(key=lambda x: x.auto_pay_sort_date, reverse=True)
+# sort options for get_outstanding_memberships. Note that name_desc is A to Z.
+_OUTSTANDING_MEMBERSHIP_ORDERING = {
+    "name_desc": [Lower("last_name").asc(), Lower("first_name").asc()],
+    "name_asc": [Lower("last_name").desc(), Lower("first_name").desc()],
+    "type_desc": [Lower("user_type").asc()],
+    "type_asc": [Lower("user_type").desc()],
+    "membership_desc": [
+        F("membership_type__name").asc(),
+        F("start_date").asc(),
+        Lower("last_name").asc(),
+        Lower("first_name").asc(),
+    ],
+    "membership_asc": [
+        F("membership_type__name").desc(),
+        Lower("last_name").asc(),
+        Lower("first_name").asc(),
+        F("start_date").asc(),
+    ],
+    "due_desc": [
+        F("due_date").asc(),
+        Lower("last_name").asc(),
+        Lower("first_name").asc(),
+    ],
+    "due_asc": [
+        F("due_date").desc(),
+        Lower("last_name").asc(),
+        Lower("first_name").asc(),
+    ],
+    "auto_desc": [
+        F("auto_pay_sort_date").asc(),
+        Lower("last_name").asc(),
+        Lower("first_name").asc(),
+    ],
+    "auto_asc": [
+        F("auto_pay_sort_date").desc(),
+        Lower("last_name").asc(),
+        Lower("first_name").asc(),
+    ],
+}
 
 
 def get_outstanding_memberships(club, sort_option="name_asc"):
-    """Get a list of memberships with outstanding payments for a club
+    """Get the memberships with outstanding payments for a club
 
     Args:
         club (Organisation): the club
         sort-option (str): a string specifying the sort field and direction
 
-        The valid fields are name, membership, due and auto. Directions are asc and desc
+        The valid fields are name, type, membership, due and auto. Directions are asc and desc
 
     Returns:
-        list: augmented MemberMembershipType records
+        QuerySet: annotated and sorted MemberMembershipType records, for paging in the database
         dict: statistics dictionary
 
-    The returned objects are augments with
-        first_name (str)
-        last_name (str)
-        user_type (str): '{GLOABL_TITLE} User' or 'Unregistered User'
-        allow_auto_pay (bool)
-        user_or_unreg (User or UnregsiteredUser)
+    The returned objects are annotated as per _annotate_member_identity and with
+        auto_pay_sort_date (date): auto pay date, or a date in 2100 to sort those that won't be paid last
     """
 
-    stats = {}
-
-    def init_metrics(metric_list):
-        for metric in metric_list:
-            if metric not in stats:
-                stats[metric] = 0
-
-    def increment_count(metric):
-        stats[metric] = stats.get(metric, 0) + 1
-
-    def add_to_total(metric, amount):
-        if amount:
-            stats[metric] = stats.get(metric, 0) + amount
-
-    init_metrics(["total_fees", "auto_pay_fees"])
-
-    # get the memberships
-
     memberships = MemberMembershipType.objects.filter(
         membership_type__organisation=club,
         is_paid=False,
@@ -3734,82 +4018,39 @@ def get_outstanding_memberships(club, sort_option="name_asc"):
         ],
     ).select_related("membership_type")
 
-    # get the related User, UnregisteredUser and MemberClubOption objects
-
-    system_numbers = memberships.values_list("system_number", flat=True)
-
-    users = User.objects.filter(system_number__in=system_numbers)
-    unreg = UnregisteredUser.objects.filter(system_number__in=system_numbers)
-    member_details = MemberClubDetails.objects.filter(
-        club=club, system_number__in=system_numbers
+    club_email = Subquery(
+        MemberClubDetails.objects.filter(
+            club=club, system_number=OuterRef("system_number")
+        ).values("email")[:1]
     )
 
-    # build a dictionary of the player data
-
-    system_numbers_blocking_auto_pay = MemberClubOptions.objects.filter(
-        club=club,
-        user__in=users,
-        allow_auto_pay=False,
-    ).values_list(
-        "user__system_number",
-        flat=True,
+    memberships = _annotate_member_identity(memberships, club, club_email).annotate(
+        auto_pay_sort_date=Case(
+            # No auto pay, so sort last
+            When(auto_pay_date__isnull=True, then=Value(date(2100, 1, 3))),
+            # unreg user, sort after blocked
+            When(is_registered=False, then=Value(date(2100, 1, 2))),
+            # blocking, sort after real dates
+            When(allow_auto_pay=False, then=Value(date(2100, 1, 1))),
+            default=F("auto_pay_date"),
+            output_field=DateField(),
+        )
     )
 
-    club_email_dict = {
-        member_detail.system_number: member_detail.email
-        for member_detail in member_details
-        if member_detail.email
-    }
-
-    player_dict = {
-        player.system_number: {
-            "first_name": player.first_name,
-            "last_name": player.last_name,
-            "user_or_unreg": player,
-            "user_type": f"{GLOBAL_TITLE} User"
-            if type(player) == User
-            else "Unregistered User",
-            "allow_auto_pay": (
-                (player.system_number not in system_numbers_blocking_auto_pay)
-                and (type(player) is User)
-            ),
-        }
-        for player in chain(users, unreg)
-    }
-
-    # augment the memberships
-
-    membership_list = list(memberships)
-    for membership in membership_list:
-        if membership.system_number in player_dict:
-            for key in player_dict[membership.system_number]:
-                setattr(membership, key, player_dict[membership.system_number][key])
-            add_to_total("total_fees", membership.fee)
-            if not membership.auto_pay_date:
-                # No auto pay, so sort last
-                membership.auto_pay_sort_date = date(2100, 1, 3)
-            else:
-                if type(membership.user_or_unreg) == User:
-                    if membership.allow_auto_pay:
-                        add_to_total("auto_pay_fees", membership.fee)
-                        membership.auto_pay_sort_date = membership.auto_pay_date
-                    else:
-                        # blocking, sort after real dates
-                        membership.auto_pay_sort_date = date(2100, 1, 1)
-                else:
-                    # unreg user, sort after blocked
-                    membership.auto_pay_sort_date = date(2100, 1, 2)
-            if membership.system_number in club_email_dict:
-                membership.club_email = club_email_dict[membership.system_number]
-            else:
-                if type(membership.user_or_unreg) == User:
-                    membership.club_email = membership.user_or_unreg.email
-                else:
-                    membership.club_email = None
+    stats = memberships.aggregate(
+        total_fees=Sum("fee"),
+        auto_pay_fees=Sum(
+            "fee", filter=Q(auto_pay_date__isnull=False, allow_auto_pay=True)
+        ),
+    )
+    stats = {metric: total or 0 for metric, total in stats.items()}
 
-    _sort_memberships(membership_list, sort_option)
+    ordering = _OUTSTANDING_MEMBERSHIP_ORDERING.get(
+        sort_option, _OUTSTANDING_MEMBERSHIP_ORDERING["name_asc"]
+    )
 
-    return (membership_list, stats)
+    # pk keeps the order stable from page to page
+    return (memberships.order_by(*ordering, "pk"), stats)
 
 
 def get_clubs_with_auto_pay_memberships(date=None):
@@ -3932,3 +4173,354 @@ def get_auto_pay_memberships_for_club(club, date=None):
         memberships.append(membership)
 
     return memberships
+
+
+# -------------------------------------------------------------------------------------
+#   Set based time driven status transitions
+#
+#   Used by the nightly update_membership_status batch. Rather than calling
+#   perform_simple_action per member, candidates are loaded with a handful of
+#   queries, the transitions are worked out in memory and applied per club with
+#   bulk_update, a single delete of future memberships and a bulk_create of the logs.
+# -------------------------------------------------------------------------------------
+
+
+def _transition_club_result(club_id):
+    """Empty result dictionary for one club"""
+
+    return {
+        "club_id": club_id,
+        "lapsed": 0,
+        "to_current": 0,
+        "to_due": 0,
+        "skipped": 0,
+        "errors": [],
+        "elapsed": 0,
+    }
+
+
+class _ClubTransitionBatch:
+    """Accumulates the changes for one club so they can be written in bulk"""
+
+    def __init__(self, club_id, today):
+        self.club_id = club_id
+        self.today = today
+        self.yesterday = today - timedelta(days=1)
+        self.memberships = {}
+        self.member_details = {}
+        self.future_deletes = {}
+        self.logs = []
+        self.result = _transition_club_result(club_id)
+
+    def log(self, system_number, description):
+        self.logs.append(
+            ClubMemberLog(
+                club_id=self.club_id,
+                system_number=system_number,
+                actor_id=ABF_USER,
+                description=description,
+            )
+        )
+
+    def lapse(self, member_details, latest_membership, future_membership):
+        """In memory equivalent of perform_simple_action("lapsed", ...)
+
+        Returns whether the member was lapsed. As with the single action,
+        a member who is not in an active status is not changed."""
+
+        if not member_details.is_active_status or not latest_membership:
+            return False
+
+        previous_display = member_details.get_membership_status_display()
+
+        latest_membership.membership_state = (
+            MemberMembershipType.MEMBERSHIP_STATE_LAPSED
+        )
+        self.memberships[latest_membership.id] = latest_membership
+
+        member_details.previous_membership_status = member_details.membership_status
+        member_details.membership_status = MemberClubDetails.MEMBERSHIP_STATUS_LAPSED
+        if not member_details.left_date:
+            member_details.left_date = self.today
+        self.member_details[member_details.id] = member_details
+
+        if future_membership:
+            self.delete_future(future_membership)
+
+        self.log(
+            member_details.system_number,
+            f"Status changed from {previous_display} to Lapsed",
+        )
+
+        self.result["lapsed"] += 1
+
+        return True
+
+    def delete_future(self, future_membership):
+        self.future_deletes[future_membership.id] = future_membership
+        self.log(
+            future_membership.system_number,
+            f"Future dated membership deleted: {future_membership.membership_type.name}",
+        )
+
+    def transition_to_future(
+        self, new_state, member_details, this_membership, future_membership
+    ):
+        """Transition to a future membership with a specified state"""
+
+        this_membership.membership_state = MemberMembershipType.MEMBERSHIP_STATE_ENDED
+        self.memberships[this_membership.id] = this_membership
+
+        future_membership.membership_state = new_state
+        self.memberships[future_membership.id] = future_membership
+
+        member_details.latest_membership = future_membership
+        member_details.membership_status = new_state
+        self.member_details[member_details.id] = member_details
+
+        self.log(
+            member_details.system_number,
+            f"Transitioned to {future_membership.membership_type.name} "
+            + f" {future_membership.get_membership_state_display()}",
+        )
+
+        if new_state == MemberMembershipType.MEMBERSHIP_STATE_CURRENT:
+            self.result["to_current"] += 1
+        else:
+            self.result["to_due"] += 1
+
+    def save(self):
+        """Write all of the changes for this club"""
+
+        with transaction.atomic():
+            MemberMembershipType.objects.bulk_update(
+                [
+                    membership
+                    for membership_id, membership in self.memberships.items()
+                    if membership_id not in self.future_deletes
+                ],
+                ["membership_state", "end_date"],
+            )
+            MemberClubDetails.objects.bulk_update(
+                self.member_details.values(),
+                [
+                    "membership_status",
+                    "previous_membership_status",
+                    "left_date",
+                    "latest_membership",
+                ],
+            )
+            if self.future_deletes:
+                MemberMembershipType.objects.filter(
+                    id__in=self.future_deletes.keys()
+                ).delete()
+            ClubMemberLog.objects.bulk_create(self.logs)
+
+
+def process_membership_transitions(today=None, dry_run=False):
+    """Apply the time driven membership transitions for all full club admin clubs.
+
+    As at yesterday:
+        - unpaid memberships at their due date lapse (and are curtailed) if they
+          are the member's latest membership (scenario 3.2.1)
+        - memberships at their end date move to a paid future membership (current),
+          an unpaid future membership (due), or lapse if there is no future membership
+          or the future membership is overdue (scenarios 1, 2.2.x, 3.1.x)
+
+    Args:
+        today (Date): the processing date, defaults to today
+        dry_run (bool): work out the changes but do not save them
+
+    Returns:
+        list: one dictionary per club with counts of lapsed, to_current, to_due,
+        skipped, a list of errors and the elapsed time in seconds
+    """
+
+    if not today:
+        today = timezone.localtime().date()
+    yesterday = today - timedelta(days=1)
+
+    # Candidates - unpaid memberships at their due date
+    due_memberships = list(
+        MemberMembershipType.objects.filter(
+            membership_type__organisation__full_club_admin=True,
+            due_date=yesterday,
+        )
+        .exclude(fee=0)
+        .exclude(is_paid=True)
+        .exclude(membership_state__in=MEMBERSHIP_STATES_TERMINAL)
+        .select_related("membership_type")
+    )
+
+    # Candidates - active memberships at their end date
+    end_memberships = list(
+        MemberMembershipType.objects.filter(
+            membership_type__organisation__full_club_admin=True,
+            end_date=yesterday,
+            membership_state__in=MEMBERSHIP_STATES_ACTIVE,
+        ).select_related("membership_type")
+    )
+
+    candidates = due_memberships + end_memberships
+    if not candidates:
+        return []
+
+    club_ids = {membership.membership_type.organisation_id for membership in candidates}
+    system_numbers = {membership.system_number for membership in candidates}
+
+    # one instance per membership so changes made in the due stage are seen in the end stage
+    memberships_by_id = {membership.id: membership for membership in candidates}
+    end_memberships = [
+        memberships_by_id[membership.id] for membership in end_memberships
+    ]
+
+    # Member details
+    member_details_dict = {}
+    for member_details in MemberClubDetails.objects.filter(
+        club_id__in=club_ids, system_number__in=system_numbers
+    ).select_related("latest_membership", "latest_membership__membership_type"):
+        if member_details.latest_membership_id in memberships_by_id:
+            member_details.latest_membership = memberships_by_id[
+                member_details.latest_membership_id
+            ]
+        member_details_dict[
+            (member_details.club_id, member_details.system_number)
+        ] = member_details
+
+    # Future memberships, the last one per member wins as with .last()
+    future_dict = {}
+    for future_membership in (
+        MemberMembershipType.objects.filter(
+            membership_type__organisation_id__in=club_ids,
+            system_number__in=system_numbers,
+            membership_state=MemberMembershipType.MEMBERSHIP_STATE_FUTURE,
+        )
+        .select_related("membership_type")
+        .order_by("id")
+    ):
+        future_dict[
+            (
+                future_membership.membership_type.organisation_id,
+                future_membership.system_number,
+            )
+        ] = future_membership
+
+    # split by club
+    batches = {}
+
+    def _get_batch(club_id):
+        if club_id not in batches:
+            batches[club_id] = _ClubTransitionBatch(club_id, today)
+        return batches[club_id]
+
+    timings = {}
+
+    def _timed(club_id, start):
+        timings[club_id] = timings.get(club_id, 0) + time.perf_counter() - start
+
+    # Due date processing
+    for membership in due_memberships:
+        start = time.perf_counter()
+        club_id = membership.membership_type.organisation_id
+        batch = _get_batch(club_id)
+        key = (club_id, membership.system_number)
+        member_details = member_details_dict.get(key)
+
+        if not member_details:
+            batch.result["errors"].append(
+                f"{CobaltMemberNotFound(club_id, membership.system_number)}"
+            )
+            _timed(club_id, start)
+            continue
+
+        if member_details.latest_membership_id == membership.id:
+            # the due date is within the current membership
+            # (scenario 3.2.1 - not paid at due date). Lapse if still active and curtail
+            if not batch.lapse(member_details, membership, future_dict.pop(key, None)):
+                batch.result["skipped"] += 1
+
+            if not membership.end_date or membership.end_date > yesterday:
+                membership.end_date = yesterday
+                batch.memberships[membership.id] = membership
+
+        else:
+            # due date is for a future membership (scenario 2.1), no action required
+            batch.result["skipped"] += 1
+
+        _timed(club_id, start)
+
+    # End date processing
+    for membership in end_memberships:
+        start = time.perf_counter()
+        club_id = membership.membership_type.organisation_id
+        batch = _get_batch(club_id)
+
+        # may have been lapsed by the due date processing
+        if membership.membership_state not in MEMBERSHIP_STATES_ACTIVE:
+            _timed(club_id, start)
+            continue
+
+        key = (club_id, membership.system_number)
+        member_details = member_details_dict.get(key)
+
+        if not member_details:
+            batch.result["errors"].append(
+                f"{CobaltMemberNotFound(club_id, membership.system_number)}"
+            )
+            _timed(club_id, start)
+            continue
+
+        future_membership = future_dict.get(key)
+
+        if not future_membership:
+            # reached end date, no future (scenario 1), lapse
+            if not batch.lapse(member_details, member_details.latest_membership, None):
+                batch.result["skipped"] += 1
+
+        elif future_membership.start_date != today:
+            # invalid data state
+            batch.result["errors"].append(
+                f"{membership.system_number}: invalid start "
+                f"({future_membership.start_date}) on future membership"
+            )
+
+        elif future_membership.is_paid:
+            # scenario 2.2.1 or 3.1.1
+            batch.transition_to_future(
+                MemberMembershipType.MEMBERSHIP_STATE_CURRENT,
+                member_details,
+                membership,
+                future_membership,
+            )
+
+        elif future_membership.due_date and future_membership.due_date < today:
+            # overdue so lapse the ending membership and delete the future
+            # scenario 2.2.2
+            future_dict.pop(key)
+            if not batch.lapse(
+                member_details, member_details.latest_membership, future_membership
+            ):
+                batch.delete_future(future_membership)
+
+        else:
+            # still have time to pay, so make it due (scenario 3.1.2)
+            batch.transition_to_future(
+                MemberMembershipType.MEMBERSHIP_STATE_DUE,
+                member_details,
+                membership,
+                future_membership,
+            )
+
+        _timed(club_id, start)
+
+    # Write the changes one club at a time
+    results = []
+    for club_id, batch in batches.items():
+        start = time.perf_counter()
+        if not dry_run:
+            batch.save()
+        _timed(club_id, start)
+        batch.result["elapsed"] = timings[club_id]
+        results.append(batch.result)
+
+    return results
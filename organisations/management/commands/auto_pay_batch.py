@@ -1,16 +1,28 @@
 """
 Batch command to auto pay membership fees as at today's date
+
+Clubs are processed in parallel by a pool of worker processes (--processes).
+Each worker has its own database connection and takes a lock for the club it
+is working on. Any auto top ups are done first. Then, in one transaction, the
+club's paying members are locked (they could be paying another club in another
+worker), their balances are checked and all of the club's payments are booked
+with one insert each for the member and organisation transactions. The member
+notifications for a club are queued as one batch.
 """
 
+from multiprocessing import get_context
 import logging
 import sys
+import time
 
+from django import db
 from django.db import transaction
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.template.loader import render_to_string
 
 from cobalt.settings import (
+    AUTO_TOP_UP_LOW_LIMIT,
     BRIDGE_CREDITS,
     GLOBAL_TITLE,
     GLOBAL_ORG,
@@ -19,10 +31,12 @@ from cobalt.settings import (
 from organisations.club_admin_core import (
     get_auto_pay_memberships_for_club,
     get_clubs_with_auto_pay_memberships,
-    _process_membership_payment,
+    _set_membership_paid_status,
 )
 from organisations.models import (
     MemberClubDetails,
+    MemberMembershipType,
+    Organisation,
 )
 from notifications.models import (
     BatchID,
@@ -30,279 +44,446 @@ from notifications.models import (
 from notifications.views.core import (
     create_rbac_batch_id,
     send_cobalt_email_with_template,
+    send_cobalt_email_with_template_many,
 )
 from payments.models import (
     OrgPaymentMethod,
 )
+from payments.views.core import (
+    auto_topup_member,
+    get_balance,
+    lock_member_balances,
+    low_balance_warning,
+    update_accounts_for_organisation,
+)
+from payments.views.payments_api import calculate_auto_topup_amount
 from rbac.core import (
     rbac_get_users_with_role,
     rbac_user_has_role_exact,
 )
+from utils.views.cobalt_buffer import flush_all_buffers
 from utils.views.cobalt_lock import CobaltLock
 
 
 logger = logging.getLogger("cobalt")
 today = timezone.now().date()
 
+DEFAULT_PROCESSES = 4
+
+MEMBERSHIP_PAYMENT_FIELDS = [
+    "is_paid",
+    "paid_until_date",
+    "paid_date",
+    "auto_pay_date",
+    "due_date",
+    "membership_state",
+    "payment_method",
+]
+""" fields changed when a membership is paid """
+
+
+def notify_club(
+    club,
+    total_collected=None,
+    paid_memberships=None,
+    failed_memberships=None,
+    blocked_memberships=None,
+    unreg_memberships=None,
+    no_bridge_credits=False,
+):
+    """Send an email to the club notifying them of the results"""
+
+    # get users with the role at the club level only (not global)
+    role = f"orgs.members.{club.id}.edit"
+    member_editors = [
+        editor
+        for editor in rbac_get_users_with_role(role)
+        if rbac_user_has_role_exact(editor, role)
+    ]
+
+    if not member_editors:
+        logger.warning(f"Unable to send email to club {club}, no member editors found")
+        return
+
+    if no_bridge_credits:
 
-class Command(BaseCommand):
-    help = "Batch command to auto pay membership fees as at today's date"
-
-    def notify_club(
-        self,
-        club,
-        total_collected=None,
-        paid_memberships=None,
-        failed_memberships=None,
-        blocked_memberships=None,
-        unreg_memberships=None,
-        no_bridge_credits=False,
-    ):
-        """Send an email to the club notifying them of the results"""
-
-        # get users with the role at the club level only (not global)
-        role = f"orgs.members.{club.id}.edit"
-        member_editors = [
-            editor
-            for editor in rbac_get_users_with_role(role)
-            if rbac_user_has_role_exact(editor, role)
-        ]
-
-        if not member_editors:
-            logger.warning(
-                f"Unable to send email to club {club}, no member editors found"
-            )
-            return
-
-        if no_bridge_credits:
-
-            email_body = render_to_string(
-                "organisations/club_menu/members/auto_pay_club_email_content_no_bc.html",
-                {
-                    "club": club,
-                    "today": today,
-                    "GLOBAL_TITLE": GLOBAL_TITLE,
-                    "BRIDGE_CREDITS": BRIDGE_CREDITS,
-                },
-            )
-
-        else:
-
-            email_body = render_to_string(
-                "organisations/club_menu/members/auto_pay_club_email_content.html",
-                {
-                    "club": club,
-                    "total_collected": total_collected,
-                    "paid_memberships": paid_memberships,
-                    "failed_memberships": failed_memberships,
-                    "blocked_memberships": blocked_memberships,
-                    "unreg_memberships": unreg_memberships,
-                    "today": today,
-                    "no_bridge_credits": no_bridge_credits,
-                    "GLOBAL_TITLE": GLOBAL_TITLE,
-                    "BRIDGE_CREDITS": BRIDGE_CREDITS,
-                    "GLOBAL_ORG": GLOBAL_ORG,
-                },
-            )
-
-        context = {
-            "title": f"Membership auto pay transactions for {club.name}",
-            "email_body": email_body,
-            "box_colour": "#007bff",
-        }
-
-        # create batch ID
-        batch_id = create_rbac_batch_id(
-            rbac_role=f"notifications.orgcomms.{club.id}.edit",
-            organisation=club,
-            batch_type=BatchID.BATCH_TYPE_COMMS,
-            batch_size=len(member_editors),
-            description=context["title"],
-            complete=True,
+        email_body = render_to_string(
+            "organisations/club_menu/members/auto_pay_club_email_content_no_bc.html",
+            {
+                "club": club,
+                "today": today,
+                "GLOBAL_TITLE": GLOBAL_TITLE,
+                "BRIDGE_CREDITS": BRIDGE_CREDITS,
+            },
         )
 
-        for user in member_editors:
-
-            context["name"] = user.first_name
-
-            send_cobalt_email_with_template(
-                to_address=user.email,
-                batch_id=batch_id,
-                context=context,
-            )
-
-    def notify_member(self, club, membership, batch_id):
-
-        base_url = f"https://{COBALT_HOSTNAME}"
+    else:
 
         email_body = render_to_string(
-            "organisations/club_menu/members/auto_pay_member_email_content.html",
+            "organisations/club_menu/members/auto_pay_club_email_content.html",
             {
                 "club": club,
-                "membership": membership,
+                "total_collected": total_collected,
+                "paid_memberships": paid_memberships,
+                "failed_memberships": failed_memberships,
+                "blocked_memberships": blocked_memberships,
+                "unreg_memberships": unreg_memberships,
                 "today": today,
+                "no_bridge_credits": no_bridge_credits,
                 "GLOBAL_TITLE": GLOBAL_TITLE,
                 "BRIDGE_CREDITS": BRIDGE_CREDITS,
                 "GLOBAL_ORG": GLOBAL_ORG,
-                "base_url": base_url,
             },
         )
 
-        context = {
-            "title": f"Membership fee payment for {club.name}",
-            "name": membership.user_or_unreg.first_name,
-            "email_body": email_body,
-            "box_colour": "#007bff",
-        }
+    context = {
+        "title": f"Membership auto pay transactions for {club.name}",
+        "email_body": email_body,
+        "box_colour": "#007bff",
+    }
+
+    # create batch ID
+    batch_id = create_rbac_batch_id(
+        rbac_role=f"notifications.orgcomms.{club.id}.edit",
+        organisation=club,
+        batch_type=BatchID.BATCH_TYPE_COMMS,
+        batch_size=len(member_editors),
+        description=context["title"],
+        complete=True,
+    )
+
+    for user in member_editors:
+
+        context["name"] = user.first_name
 
         send_cobalt_email_with_template(
-            to_address=membership.user_or_unreg.email,
+            to_address=user.email,
             batch_id=batch_id,
             context=context,
-            batch_size=batch_id.batch_size,  # Added batch_size parameter
         )
 
-    def handle(self, *args, **options):
 
-        logger.info("Batch auto pay starting")
+def member_notification(club, membership):
+    """Return the (to_address, context) for a member's payment notification"""
+
+    base_url = f"https://{COBALT_HOSTNAME}"
+
+    email_body = render_to_string(
+        "organisations/club_menu/members/auto_pay_member_email_content.html",
+        {
+            "club": club,
+            "membership": membership,
+            "today": today,
+            "GLOBAL_TITLE": GLOBAL_TITLE,
+            "BRIDGE_CREDITS": BRIDGE_CREDITS,
+            "GLOBAL_ORG": GLOBAL_ORG,
+            "base_url": base_url,
+        },
+    )
+
+    context = {
+        "title": f"Membership fee payment for {club.name}",
+        "name": membership.user_or_unreg.first_name,
+        "email_body": email_body,
+        "box_colour": "#007bff",
+    }
+
+    return membership.user_or_unreg.email, context
+
+
+def _auto_top_up_members(memberships):
+    """Auto top up members who don't have enough to pay for their memberships. If a top
+    up fails auto_topup_member lets the member know and the payment fails later"""
+
+    fees = {}
+    for membership in memberships:
+        member = membership.user_or_unreg
+        if member.stripe_auto_confirmed == "On":
+            fees[member] = fees.get(member, 0.0) + float(membership.fee)
+
+    for member, fee in fees.items():
+        balance = get_balance(member)
+        if fee > balance:
+            auto_topup_member(
+                member,
+                topup_required=calculate_auto_topup_amount(member, fee, balance),
+            )
 
-        # Use a logical lock to ensure that processes are not running on
-        # multiple servers. If another job is running simply exit
-        auto_pay_lock = CobaltLock("auto_pay", expiry=10)
-        if not auto_pay_lock.get_lock():
-            logger.info("Batch auto pay already ran or running (locked), exiting")
-            sys.exit(0)
 
-        # process club by club
-        clubs = get_clubs_with_auto_pay_memberships()
+def _worker_init():
+    """Each worker needs its own database connection, don't share the parent's"""
 
-        logger.info(f"Batch auto pay found {len(clubs)} clubs with candidate payments")
+    db.connections.close_all()
 
-        for club in clubs:
 
-            logger.info(f"Batch auto pay starting {club.name}")
+def process_club(club_id):
+    """Make the auto payments for one club. Runs in a worker process.
 
-            memberships = get_auto_pay_memberships_for_club(club)
+    Returns a dictionary of results for reporting by the parent process.
+    """
 
-            if not memberships:
-                logger.warning(f"No auto pay candiates for {club.name}")
-                continue
+    start_time = time.perf_counter()
 
-            # get the bridge credit payment method for the club (if any)
-            club_bc_payment_method = OrgPaymentMethod.objects.filter(
-                organisation=club,
-                payment_method="Bridge Credits",
-                active=True,
-            ).last()
+    club = Organisation.objects.get(pk=club_id)
 
-            if not club_bc_payment_method:
-                self.notify_club(club, no_bridge_credits=True)
-                logger.info(f"{club.name} is not configured for {BRIDGE_CREDITS}")
-                continue
+    result = {
+        "club": club.name,
+        "status": "ok",
+        "total_collected": 0,
+        "paid": 0,
+        "failed": 0,
+        "blocked": 0,
+        "unreg": 0,
+        "elapsed": 0,
+    }
+
+    def _finished(status):
+        result["status"] = status
+        result["elapsed"] = time.perf_counter() - start_time
+        return result
+
+    # One lock per club so a club can never be processed twice at the same time
+    club_lock = CobaltLock(f"auto_pay_{club.id}", expiry=10)
+    if not club_lock.get_lock():
+        logger.info(f"Batch auto pay for {club.name} already ran or running (locked)")
+        return _finished("locked")
+
+    logger.info(f"Batch auto pay starting {club.name}")
+
+    memberships = get_auto_pay_memberships_for_club(club)
+
+    if not memberships:
+        logger.warning(f"No auto pay candiates for {club.name}")
+        return _finished("no candidates")
+
+    # get the bridge credit payment method for the club (if any)
+    club_bc_payment_method = OrgPaymentMethod.objects.filter(
+        organisation=club,
+        payment_method="Bridge Credits",
+        active=True,
+    ).last()
+
+    if not club_bc_payment_method:
+        notify_club(club, no_bridge_credits=True)
+        logger.info(f"{club.name} is not configured for {BRIDGE_CREDITS}")
+        return _finished(f"no {BRIDGE_CREDITS}")
+
+    # attempt the payments
+
+    paid_memberships = []
+    failed_memberships = []
+    blocked_memberships = []
+    unreg_memberships = []
+    cleared_memberships = []
+    total_collected = 0
+
+    description = f"{club.name} club membership (auto pay)"
+
+    allowed_memberships = []
+
+    for membership in memberships:
 
-            # attempt the payments
-
-            paid_memberships = []
-            failed_memberships = []
-            blocked_memberships = []
-            unreg_memberships = []
-            total_collected = 0
-
-            # create batch ID for member notifications
-            member_batch_id = create_rbac_batch_id(
-                rbac_role=f"notifications.orgcomms.{club.id}.edit",
-                organisation=club,
-                batch_type=BatchID.BATCH_TYPE_COMMS,
-                batch_size=len(memberships),  # Changed to use len(memberships) for initial size
-                description=f"Membership fee payment for {club.name}",
-                complete=False,
+        if membership.action_type == "allowed":
+            allowed_memberships.append(membership)
+
+        elif membership.action_type in ["disallowed", "unreg"]:
+            # remove the auto pay date from the membership
+
+            logger.info(
+                f"Clearing auto pay for {membership.user_or_unreg.system_number} {membership.action_type}"
             )
 
-            for membership in memberships:
+            membership.auto_pay_date = None
+            cleared_memberships.append(membership)
 
-                with transaction.atomic():
+            if membership.action_type == "disallowed":
+                blocked_memberships.append(membership)
+            else:
+                unreg_memberships.append(membership)
 
-                    if membership.action_type == "allowed":
-                        # attempt the payment
+    # Top up anyone who needs it first, we don't want to hold locks while we talk to Stripe
+    _auto_top_up_members(allowed_memberships)
+
+    # The members could be paying another club in another worker, or spending their
+    # balance somewhere else, so lock them all (in pk order) while we check their
+    # balances and book the payments for the whole club
+    with transaction.atomic():
+
+        balances = lock_member_balances(
+            membership.user_or_unreg.id for membership in allowed_memberships
+        )
+        payments = []
 
-                        success, message = _process_membership_payment(
-                            club,
-                            True,
-                            membership,
-                            club_bc_payment_method,
-                            f"{club.name} club membership (auto pay)",
-                        )
+        for membership in allowed_memberships:
 
-                        if success:
-                            membership.save()
+            member = membership.user_or_unreg
+            fee = float(membership.fee)
 
-                            if (
-                                membership.member_details.latest_membership
-                                == membership
-                            ):
-                                # need to update the status on the member details
+            membership.payment_method = club_bc_payment_method if fee else None
 
-                                membership.member_details.membership_status = (
-                                    MemberClubDetails.MEMBERSHIP_STATUS_CURRENT
-                                )
-                                membership.member_details.save()
+            if fee > balances[member.id]:
+                logger.warning(
+                    f"Auto pay failed for {member.system_number}, balance {balances[member.id]} fee {fee}"
+                )
+                membership.message = f"{BRIDGE_CREDITS} payment UNSUCCESSFUL"
+                failed_memberships.append(membership)
+                continue
 
-                            paid_memberships.append(membership)
-                            total_collected += membership.fee
-                            self.notify_member(club, membership, member_batch_id)
+            balances[member.id] -= fee
+            if fee:
+                payments.append((member, membership.fee))
 
-                            logger.info(
-                                f"Auto pay successful for {membership.user_or_unreg}"
-                            )
+            _set_membership_paid_status(membership, True)
+            paid_memberships.append(membership)
+            total_collected += membership.fee
 
-                        else:
-                            logger.warning(
-                                f"Auto pay failed for {membership.user_or_unreg.system_number} '{message}'"
-                            )
-                            membership.message = message
-                            failed_memberships.append(membership)
+            logger.info(f"Auto pay successful for {member}")
 
-                    elif membership.action_type in ["disallowed", "unreg"]:
-                        # remove the auto pay date from the membership
+        update_accounts_for_organisation(club, payments, description, "Club Membership")
 
-                        logger.info(
-                            f"Clearing auto pay for {membership.user_or_unreg.system_number} {membership.action_type}"
-                        )
+        MemberMembershipType.objects.bulk_update(
+            paid_memberships, MEMBERSHIP_PAYMENT_FIELDS
+        )
 
-                        membership.auto_pay_date = None
-                        membership.save()
+        # need to update the status on the member details for current memberships
+        current_member_details = []
+        for membership in paid_memberships:
+            if (
+                membership.member_details
+                and membership.member_details.latest_membership_id == membership.id
+            ):
+                membership.member_details.membership_status = (
+                    MemberClubDetails.MEMBERSHIP_STATUS_CURRENT
+                )
+                current_member_details.append(membership.member_details)
 
-                        if membership.action_type == "disallowed":
-                            blocked_memberships.append(membership)
-                        else:
-                            unreg_memberships.append(membership)
+        MemberClubDetails.objects.bulk_update(
+            current_member_details, ["membership_status"]
+        )
 
-            # update the members batch, or delete if no emails sent
-            if len(paid_memberships) == 0:  # Changed condition
-                member_batch_id.delete()
+    # Top up again (or warn) if this has taken anyone below the limit
+    for member in {member for member, _ in payments}:
+        if balances[member.id] < AUTO_TOP_UP_LOW_LIMIT:
+            if member.stripe_auto_confirmed == "On":
+                auto_topup_member(member)
             else:
-                member_batch_id.batch_size = len(paid_memberships)
-                member_batch_id.state = BatchID.BATCH_STATE_COMPLETE
-                member_batch_id.save()
-
-            self.notify_club(
-                club,
-                total_collected=total_collected,
-                paid_memberships=paid_memberships,
-                failed_memberships=failed_memberships,
-                blocked_memberships=blocked_memberships,
-                unreg_memberships=unreg_memberships,
-            )
+                low_balance_warning(member)
+
+    # No money involved in clearing auto pay, so these can go in one update
+    MemberMembershipType.objects.bulk_update(cleared_memberships, ["auto_pay_date"])
+
+    # queue the member notifications as one batch
+    if paid_memberships:
+        member_batch_id = create_rbac_batch_id(
+            rbac_role=f"notifications.orgcomms.{club.id}.edit",
+            organisation=club,
+            batch_type=BatchID.BATCH_TYPE_COMMS,
+            batch_size=len(paid_memberships),
+            description=f"Membership fee payment for {club.name}",
+            complete=True,
+        )
+
+        send_cobalt_email_with_template_many(
+            [member_notification(club, membership) for membership in paid_memberships],
+            batch_id=member_batch_id,
+        )
+
+    notify_club(
+        club,
+        total_collected=total_collected,
+        paid_memberships=paid_memberships,
+        failed_memberships=failed_memberships,
+        blocked_memberships=blocked_memberships,
+        unreg_memberships=unreg_memberships,
+    )
+
+    result["total_collected"] = total_collected
+    result["paid"] = len(paid_memberships)
+    result["failed"] = len(failed_memberships)
+    result["blocked"] = len(blocked_memberships)
+    result["unreg"] = len(unreg_memberships)
+
+    logger.info(
+        (
+            f"{club.name} collected {total_collected} Bridge Credits from auto pay, "
+            + f"{len(paid_memberships)} succeeded, {len(failed_memberships)} failed"
+        )
+    )
+
+    return _finished("ok")
+
+
+def _process_club_safe(club_id):
+    """Wrapper so one club failing doesn't stop the others"""
 
+    try:
+        return process_club(club_id)
+    except Exception as exc:  # noqa
+        logger.exception(f"Batch auto pay failed for club {club_id}")
+        return {"club": club_id, "status": f"error: {exc}", "elapsed": 0}
+    finally:
+        # pool workers don't run atexit handlers
+        flush_all_buffers()
+
+
+class Command(BaseCommand):
+    help = "Batch command to auto pay membership fees as at today's date"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=DEFAULT_PROCESSES,
+            help=f"Number of clubs to process in parallel (default {DEFAULT_PROCESSES})",
+        )
+
+    def handle(self, *args, **options):
+
+        logger.info("Batch auto pay starting")
+
+        start_time = time.perf_counter()
+
+        # Use a logical lock to ensure that processes are not running on
+        # multiple servers. If another job is running simply exit
+        auto_pay_lock = CobaltLock("auto_pay", expiry=10)
+        if not auto_pay_lock.get_lock():
+            logger.info("Batch auto pay already ran or running (locked), exiting")
+            sys.exit(0)
+
+        # process club by club
+        club_ids = list(
+            get_clubs_with_auto_pay_memberships().values_list("id", flat=True)
+        )
+
+        logger.info(
+            f"Batch auto pay found {len(club_ids)} clubs with candidate payments"
+        )
+
+        processes = max(1, min(options["processes"], len(club_ids)))
+
+        if processes == 1:
+            results = [_process_club_safe(club_id) for club_id in club_ids]
+        else:
+            # Don't let the workers inherit our database connection
+            db.connections.close_all()
+            with get_context("fork").Pool(
+                processes=processes, initializer=_worker_init
+            ) as pool:
+                results = pool.map(_process_club_safe, club_ids)
+
+        for result in results:
             logger.info(
-                (
-                    f"{club.name} collected {total_collected} Bridge Credits from auto pay, "
-                    + f"{len(paid_memberships)} succeeded, {len(failed_memberships)} failed"
-                )
+                f"Batch auto pay {result['club']}: {result['status']}, "
+                f"{result.get('paid', 0)} paid, {result.get('failed', 0)} failed, "
+                f"{result.get('blocked', 0)} blocked, {result.get('unreg', 0)} unregistered, "
+                f"{result.get('total_collected', 0)} collected in {result['elapsed']:.2f}s"
             )
 
         # release the lock
         # auto_pay_lock.free_lock()
         # auto_pay_lock.delete_lock()
 
-        logger.info("Batch auto pay finished")
\ No newline at end of file
+        logger.info(
+            f"Batch auto pay finished, {len(results)} clubs in "
+            f"{time.perf_counter() - start_time:.2f}s using {processes} processes"
+        )
@@ -988,6 +988,11 @@ urlpatterns = [
         organisations.views.club_menu_tabs.members.bulk_renewals_htmx,
         name="club_menu_tab_members_bulk_renewal_htmx",
     ),
+    path(
+        "club-admin/renewals/bulk/progress",
+        organisations.views.club_menu_tabs.members.bulk_renewals_progress_htmx,
+        name="club_menu_tab_members_bulk_renewal_progress_htmx",
+    ),
     path(
         "club-admin/renewals/bulk/test",
         organisations.views.club_menu_tabs.members.bulk_renewals_test_htmx,
@@ -12,6 +12,7 @@ from django.shortcuts import render, get_object_or_404
 from django.template.loader import render_to_string
 from django.utils import timezone
 
+from accounts.identity import resolve_system_numbers
 from accounts.models import (
     User,
     UnregisteredUser,
@@ -1327,36 +1328,44 @@ def process_member_import(
     added_unregistered_users = 0
     errors = []
 
+    # Find out who everyone is up front, rather than two queries per member
+    identities = resolve_system_numbers(
+        [club_member["system_number"] for club_member in member_data],
+        use_mpc=False,
+        include_system_accounts=True,
+    )
+
     # loop through members
     for club_member in member_data:
 
-        # See if we have an actual user for this
-        user_match = User.objects.filter(
-            system_number=club_member["system_number"]
-        ).first()
+        identity = identities.get(club_member["system_number"])
 
-        if user_match:
+        # See if we have an actual user for this
+        if identity and identity["type"] == "User":
             added, error = add_member_to_membership(
                 club, club_member, user, default_membership, overwrite, home_club
             )
             added_users += added
         else:
             # See if we have an unregistered user already
-            un_reg = UnregisteredUser.objects.filter(
-                system_number=club_member["system_number"]
-            ).first()
-
-            if not un_reg:
+            if not identity:
                 # Create a new unregistered user
 
-                UnregisteredUser(
+                un_reg = UnregisteredUser(
                     system_number=club_member["system_number"],
                     first_name=club_member["first_name"],
                     last_name=club_member["last_name"],
                     origin=origin,
                     last_updated_by=user,
                     added_by_club=club,
-                ).save()
+                )
+                un_reg.save()
+
+                # in case they are in the file twice
+                identities[un_reg.system_number] = {
+                    "type": "UnregisteredUser",
+                    "value": un_reg,
+                }
 
             added, error = add_member_to_membership(
                 club,
@@ -1496,6 +1505,18 @@ def process_contact_import(
     updated_contacts = 0
     errors = []
 
+    # Find out who everyone is up front, rather than two queries per contact
+    identities = resolve_system_numbers(
+        [
+            contact["system_number"]
+            for contact in contact_data
+            if "system_number" in contact
+        ],
+        use_mpc=False,
+        include_system_accounts=True,
+        include_internal=True,
+    )
+
     # loop through members
     for contact in contact_data:
 
@@ -1526,35 +1547,31 @@ def process_contact_import(
             else:
 
                 # check whether this person is already on the system
-                user_match = User.objects.filter(
-                    system_number=contact["system_number"]
-                ).first()
-
-                if not user_match:
-                    un_reg = UnregisteredUser.all_objects.filter(
-                        system_number=contact["system_number"]
-                    ).first()
-
-                    if not un_reg:
-
-                        if NextInternalSystemNumber.is_internal(
-                            contact["system_number"]
-                        ):
-                            errors.append(
-                                f"{contact['system_number']} is an internal number used by another club"
-                            )
-                            continue
+                if contact["system_number"] not in identities:
+
+                    if NextInternalSystemNumber.is_internal(contact["system_number"]):
+                        errors.append(
+                            f"{contact['system_number']} is an internal number used by another club"
+                        )
+                        continue
 
-                        #  create an unregistered user
+                    #  create an unregistered user
+
+                    un_reg = UnregisteredUser(
+                        system_number=contact["system_number"],
+                        first_name=contact["first_name"],
+                        last_name=contact["last_name"],
+                        origin=origin,
+                        last_updated_by=user,
+                        added_by_club=club,
+                    )
+                    un_reg.save()
 
-                        UnregisteredUser(
-                            system_number=contact["system_number"],
-                            first_name=contact["first_name"],
-                            last_name=contact["last_name"],
-                            origin=origin,
-                            last_updated_by=user,
-                            added_by_club=club,
-                        ).save()
+                    # in case they are in the file twice
+                    identities[un_reg.system_number] = {
+                        "type": "UnregisteredUser",
+                        "value": un_reg,
+                    }
 
         else:
             # no system number, create an unregistered user with an internal system number
@@ -2,12 +2,11 @@ import csv
 from datetime import date, timedelta
 import logging
 from itertools import chain
-from threading import Thread
 
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
 from django.db.utils import IntegrityError
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, QueryDict
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
 from django.utils import timezone
@@ -47,6 +46,7 @@ from notifications.views.core import (
 )
 from organisations.club_admin_core import (
     add_member,
+    bulk_renew_memberships,
     can_perform_action,
     change_membership,
     club_email_for_member,
@@ -125,7 +125,9 @@ from rbac.core import rbac_user_has_role
 from post_office.models import Email as PostOfficeEmail
 
 from rbac.views import rbac_forbidden
+from utils.models import Job
 from utils.utils import cobalt_currency, cobalt_paginator
+from utils.views.cobalt_jobs import cobalt_job, job_progress, queue_job
 
 logger = logging.getLogger("cobalt")
 
@@ -2746,10 +2748,72 @@ def renewals_menu_htmx(request, club):
             "club": club,
             "full_membership_mgmt": club.full_club_admin,
             "message": message,
+            **_bulk_renewal_jobs_context(club),
         },
     )
 
 
+def _bulk_renewal_jobs_context(club):
+    """Context for showing the progress of this club's recent bulk renewals"""
+
+    renewal_jobs = Job.objects.filter(
+        function=f"{_process_bulk_renewals_job.__module__}.{_process_bulk_renewals_job.__name__}",
+        kwargs__club_id=club.id,
+        created_time__gte=timezone.now() - timedelta(days=7),
+    ).order_by("-created_time")[:5]
+
+    return {
+        "renewal_jobs": renewal_jobs,
+        "renewal_jobs_active": any(
+            job.status in [Job.STATUS_QUEUED, Job.STATUS_RUNNING]
+            for job in renewal_jobs
+        ),
+    }
+
+
+@check_club_menu_access(check_members=True)
+def bulk_renewals_progress_htmx(request, club):
+    """Refresh the progress of recent bulk renewals on the renewals menu"""
+
+    return render(
+        request,
+        "organisations/club_menu/members/bulk_renewals_progress_htmx.html",
+        {"club": club, **_bulk_renewal_jobs_context(club)},
+    )
+
+
+class _ChainedQuerySets:
+    """Querysets one after the other, for a Paginator. Only the querysets
+    that overlap the requested page are fetched."""
+
+    def __init__(self, querysets):
+        self.querysets = querysets
+        self._counts = None
+
+    def _get_counts(self):
+        if self._counts is None:
+            self._counts = [queryset.count() for queryset in self.querysets]
+        return self._counts
+
+    def count(self):
+        return sum(self._get_counts())
+
+    def __getitem__(self, page_slice):
+        start = page_slice.start or 0
+        stop = page_slice.stop
+
+        items = []
+        for queryset, count in zip(self.querysets, self._get_counts()):
+            if stop <= 0:
+                break
+            if start < count:
+                items += list(queryset[start : min(stop, count)])
+            start = max(0, start - count)
+            stop -= count
+
+        return items
+
+
 @check_club_menu_access(check_members=True)
 def bulk_renewals_htmx(request, club):
     """Initiate bulk renewals
@@ -2846,18 +2910,16 @@ def bulk_renewals_htmx(request, club):
 
         else:
             if mode == "SEND":
-                # process the renewals in the background
-
-                args = {
-                    "club": club,
-                    "formset": formset,
-                    "options_form": options_form,
-                    "requester": request.user,
-                }
-
-                thread = Thread(target=_process_bulk_renewals, kwargs=args)
-                thread.setDaemon(True)
-                thread.start()
+                # process the renewals in the background. Don't retry, the renewals
+                # are committed in chunks so some could already be done
+
+                queue_job(
+                    _process_bulk_renewals_job,
+                    max_attempts=1,
+                    club_id=club.id,
+                    post_data=dict(request.POST.lists()),
+                    requester_id=request.user.id,
+                )
 
                 return _refresh_renewal_menu(
                     request, club, message="Bulk renewal initiated"
@@ -2866,7 +2928,7 @@ def bulk_renewals_htmx(request, club):
             elif mode == "MEMBERS":
                 # show the selected members
 
-                full_member_list = []
+                member_querysets = []
                 stats = None
                 for form_index, form in enumerate(formset):
                     if form.cleaned_data["selected"]:
@@ -2879,13 +2941,13 @@ def bulk_renewals_htmx(request, club):
                             form_index,
                             stats_to_date=stats,
                         )
-                        full_member_list += members
+                        member_querysets.append(members)
 
                 # Note: need to pass the page number because the common routine
                 # expects GET rather than POST
                 member_list = cobalt_paginator(
                     request,
-                    full_member_list,
+                    _ChainedQuerySets(member_querysets),
                     page_no=request.POST.get("page", 1),
                 )
 
@@ -2968,6 +3030,31 @@ def bulk_renewals_test_htmx(request, club):
         return HttpResponse(f"Test message failed: {message}")
 
 
+@cobalt_job
+def _process_bulk_renewals_job(club_id, post_data, requester_id):
+    """Run the renewals from the job queue. The forms are rebuilt from the
+    POST data (a dictionary of lists) that was validated by the view"""
+
+    club = Organisation.objects.get(pk=club_id)
+    requester = User.objects.get(pk=requester_id)
+
+    data = QueryDict(mutable=True)
+    for key, values in post_data.items():
+        data.setlist(key, values)
+
+    formset = BulkRenewalFormSet(data)
+    options_form = BulkRenewalOptionsForm(data, club=club)
+
+    if not (formset.is_valid() and options_form.is_valid()):
+        raise ValueError(f"Bulk renewal forms for {club} are no longer valid")
+
+    ok_count, error_count = _process_bulk_renewals(
+        club, formset, options_form, requester
+    )
+
+    logger.info(f"Bulk renewals for {club}: {ok_count} processed, {error_count} errors")
+
+
 def _process_bulk_renewals(
     club,
     formset,
@@ -2987,8 +3074,9 @@ def _process_bulk_renewals(
         int: error count
     """
 
-    ok_count = 0
-    error_count = 0
+    # find everyone first so we can report progress against the total
+
+    renewals = []
 
     for form_index, form in enumerate(formset):
         if form.cleaned_data["selected"]:
@@ -3003,37 +3091,56 @@ def _process_bulk_renewals(
                 form_index,
             )
 
-            # Only create batch_id if we're sending notices
-            this_batch_id = None
-            if this_renewal_parameters.send_notice:
-                this_batch_id = create_rbac_batch_id(
-                    rbac_role=f"notifications.orgcomms.{club.id}.edit",
-                    organisation=club,
-                    batch_type=BatchID.BATCH_TYPE_COMMS,
-                    batch_size=len(members),
-                    description=(
-                        this_renewal_parameters.email_subject
-                        + f" ({this_renewal_parameters.membership_type.name})"
-                    ),
-                    complete=False,
-                )
+            renewals.append((this_renewal_parameters, list(members)))
 
-            for member in members:
-                success, _ = renew_membership(
-                    member,
-                    this_renewal_parameters,
-                    batch_id=this_batch_id,  # Will be None if send_notice is False
-                    requester=requester,
-                )
-                if success:
-                    ok_count += 1
-                else:
-                    error_count += 1
+    total = sum(len(members) for _, members in renewals)
+    done_before = 0
+    ok_count = 0
+    error_count = 0
+
+    job_progress(f"0 of {total} members renewed")
+
+    for this_renewal_parameters, members in renewals:
+
+        # Only create batch_id if we're sending notices
+        this_batch_id = None
+        if this_renewal_parameters.send_notice:
+            this_batch_id = create_rbac_batch_id(
+                rbac_role=f"notifications.orgcomms.{club.id}.edit",
+                organisation=club,
+                batch_type=BatchID.BATCH_TYPE_COMMS,
+                batch_size=len(members),
+                description=(
+                    this_renewal_parameters.email_subject
+                    + f" ({this_renewal_parameters.membership_type.name})"
+                ),
+                complete=False,
+            )
 
-            # Only mark batch complete if we created one
-            if this_batch_id:
-                this_batch_id.state = BatchID.BATCH_STATE_COMPLETE
-                this_batch_id.save()
+        def _progress(done):
+            job_progress(f"{done_before + done} of {total} members renewed")
+
+        this_ok_count, this_error_count = bulk_renew_memberships(
+            members,
+            this_renewal_parameters,
+            batch_id=this_batch_id,  # Will be None if send_notice is False
+            requester=requester,
+            progress=_progress,
+        )
+
+        ok_count += this_ok_count
+        error_count += this_error_count
+        done_before += len(members)
+
+        # Only mark batch complete if we created one
+        if this_batch_id:
+            this_batch_id.state = BatchID.BATCH_STATE_COMPLETE
+            this_batch_id.save()
+
+    job_progress(
+        f"{ok_count} of {total} members renewed"
+        + (f", {error_count} errors" if error_count else "")
+    )
 
     return (ok_count, error_count)
 
@@ -3046,7 +3153,7 @@ def view_unpaid_htmx(request, club):
 
     memberships, stats = get_outstanding_memberships(club, sort_option=sort_option)
 
-    if len(memberships) == 0:
+    if not memberships.exists():
         # nothing to show, so go back to the menu with a message
 
         return _refresh_renewal_menu(
@@ -3089,7 +3196,7 @@ def email_unpaid(request, club_id):
 
     memberships, _ = get_outstanding_memberships(club)
 
-    if len(memberships) == 0:
+    if not memberships.exists():
         # nobody to email, so go back to the menu with a message
 
         return _refresh_renewal_menu(
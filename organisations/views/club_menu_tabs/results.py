@@ -1,21 +1,22 @@
 import logging
+import time
 import xml
 
 from django.db.transaction import atomic
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
+from django.template.loader import get_template
 from django.urls import reverse
 from django.utils.html import strip_tags
 from django.utils.datetime_safe import datetime
 
-from accounts.views.core import get_email_address_and_name_from_system_number
+from accounts.views.core import get_email_addresses_and_names_from_system_numbers
 from cobalt.settings import COBALT_HOSTNAME
-from notifications.models import Snooper, BatchID
+from notifications.models import BatchID
 from notifications.views.core import (
     create_rbac_batch_id,
     custom_sender,
-    send_cobalt_email_with_template,
+    send_cobalt_email_with_template_many,
     club_default_template,
 )
 from organisations.decorators import check_club_menu_access
@@ -34,6 +35,8 @@ logger = logging.getLogger("cobalt")
 def upload_results_file_valid(request, form, club):
     """sub of upload_results_file_htmx. This is separated out so the tests can call it directly"""
 
+    start_time = time.perf_counter()
+
     results_file = form.save(commit=False)
 
     # Add data
@@ -66,8 +69,18 @@ def upload_results_file_valid(request, form, club):
     results_file.event_date = event_date
     results_file.save()
 
+    parsed_time = time.perf_counter()
+
     # Create the player records so people know the results are there
-    create_player_records_from_usebio_format_pairs(results_file, usebio)
+    player_count = create_player_records_from_usebio_format_pairs(results_file, usebio)
+
+    _log_stage_timings(
+        f"Results upload for {results_file} ({player_count} players)",
+        {
+            "parse": parsed_time - start_time,
+            "player summaries": time.perf_counter() - parsed_time,
+        },
+    )
 
     return tab_results_htmx(request, message="New results successfully uploaded")
 
@@ -110,12 +123,37 @@ def toggle_result_publish_state_htmx(request, club):
     return tab_results_htmx(request, message=message)
 
 
+def _log_stage_timings(description, stage_timings):
+    """log how long each stage of processing a results file took"""
+
+    logger.info(
+        f"{description}: "
+        + ", ".join(
+            f"{stage} {seconds:.2f}s" for stage, seconds in stage_timings.items()
+        )
+    )
+
+
 def _send_results_emails(results_file, club, request):
-    """send the results email to users"""
+    """send the results email to users.
+
+    All players are looked up together and the emails are queued as one batch with
+    one insert, rather than a lookup and an insert per player."""
+
+    stage_timings = {}
+    stage_start = time.perf_counter()
+
+    def _end_stage(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        stage_timings[stage] = now - stage_start
+        stage_start = now
 
     # Get file data as usebio format
     usebio = parse_usebio_file(results_file)
 
+    _end_stage("parse")
+
     # Get results template if we have one
     results_template = OrgEmailTemplate.objects.filter(
         organisation=club, template_name__iexact="Results"
@@ -127,7 +165,7 @@ def _send_results_emails(results_file, club, request):
         )
 
     # set up context
-    context = {
+    base_context = {
         "title": f"Your Results for {results_file.description}",
         "box_colour": results_template.box_colour,
         "box_font_colour": results_template.box_font_colour,
@@ -137,7 +175,7 @@ def _send_results_emails(results_file, club, request):
     reply_to = results_template.reply_to
     from_name = results_template.from_name
     if results_template.banner:
-        context["img_src"] = results_template.banner.url
+        base_context["img_src"] = results_template.banner.url
 
     # sender = f"{from_name}<donotreply@myabf.com.au>" if from_name else None
     sender = custom_sender(from_name)
@@ -148,17 +186,8 @@ def _send_results_emails(results_file, club, request):
         kwargs={"results_file_id": results_file.id},
     )
 
-    # Create batch id to allow any admin for this club to view the email
-    batch_id = create_rbac_batch_id(
-        rbac_role=f"notifications.orgcomms.{club.id}.edit",
-        user=request.user,
-        organisation=club,
-        batch_type=BatchID.BATCH_TYPE_RESULTS,
-        description=context["title"],
-        complete=True,
-    )
-
-    # Go through data, and email results to players
+    # Go through data, and collect the results for each player
+    player_results = []
     for item in usebio["EVENT"]["PARTICIPANTS"]["PAIR"]:
         try:
             player_1_system_number = int(item["PLAYER"][0]["NATIONAL_ID_NUMBER"])
@@ -174,59 +203,92 @@ def _send_results_emails(results_file, club, request):
         masterpoints = int(item.get("MASTER_POINTS_AWARDED", 0)) / 100.0
         percentage = item["PERCENTAGE"]
 
-        for system_number in [player_1_system_number, player_2_system_number]:
+        player_results.append(
+            (player_1_system_number, player_2_name, position, masterpoints, percentage)
+        )
+        player_results.append(
+            (player_2_system_number, player_1_name, position, masterpoints, percentage)
+        )
 
-            if system_number == player_1_system_number:
-                partner = player_2_name
-            else:
-                partner = player_1_name
+    # Look up everyone at once
+    email_addresses = get_email_addresses_and_names_from_system_numbers(
+        [player_result[0] for player_result in player_results],
+        club,
+        requestor="results",
+    )
 
-            # TODO: Load this higher up as a dictionary to reduce database calls
-            email_address, first_name = get_email_address_and_name_from_system_number(
-                system_number, club, requestor="results"
+    _end_stage("players")
+
+    # Build the email bodies from one compiled template
+    email_summary_template = get_template(
+        "organisations/club_menu/results/results_email_summary.html"
+    )
+
+    emails = []
+    for (
+        system_number,
+        partner,
+        position,
+        masterpoints,
+        percentage,
+    ) in player_results:
+
+        if system_number not in email_addresses:
+            continue
+
+        email_address, first_name = email_addresses[system_number]
+
+        email_body = email_summary_template.render(
+            {
+                "position": position,
+                "masterpoints": masterpoints,
+                "percentage": percentage,
+                "club": club,
+                "partner": partner,
+                "link": link,
+                "host": COBALT_HOSTNAME,
+                "club_message": club.results_email_message,
+            }
+        )
+
+        emails.append(
+            (
+                email_address,
+                {**base_context, "name": first_name, "email_body": email_body},
             )
+        )
 
-            if email_address:
-
-                # Build email body
-                email_body = render_to_string(
-                    "organisations/club_menu/results/results_email_summary.html",
-                    {
-                        "position": position,
-                        "masterpoints": masterpoints,
-                        "percentage": percentage,
-                        "club": club,
-                        "partner": partner,
-                        "link": link,
-                        "host": COBALT_HOSTNAME,
-                        "club_message": club.results_email_message,
-                    },
-                )
-
-                context["name"] = first_name
-                context["email_body"] = email_body
-
-                # COB-793 - add batch size - assumes 80% of players in event have emails and not opted out
-
-                send_cobalt_email_with_template(
-                    to_address=email_address,
-                    context=context,
-                    batch_id=batch_id,
-                    template="system - club",
-                    reply_to=reply_to,
-                    sender=sender,
-                    batch_size=int(
-                        len(usebio["EVENT"]["PARTICIPANTS"]["PAIR"]) * 2 * 0.8
-                    ),
-                )
-
-    # Count emails sent and update batch header
-    batch_size = Snooper.objects.filter(batch_id=batch_id).count()
+    _end_stage("render")
 
+    # Create batch id to allow any admin for this club to view the email
+    batch_id = create_rbac_batch_id(
+        rbac_role=f"notifications.orgcomms.{club.id}.edit",
+        user=request.user,
+        organisation=club,
+        batch_type=BatchID.BATCH_TYPE_RESULTS,
+        description=base_context["title"],
+        complete=True,
+    )
+
+    batch_size = send_cobalt_email_with_template_many(
+        emails,
+        template="system - club",
+        sender=sender,
+        batch_id=batch_id,
+        reply_to=reply_to,
+    )
+
+    # update batch header with the number actually sent
     batch = BatchID.objects.get(batch_id=batch_id)
     batch.batch_size = batch_size
     batch.save()
 
+    _end_stage("queue")
+
+    _log_stage_timings(
+        f"Results emails for {results_file} ({batch_size} emails)", stage_timings
+    )
+
     return batch_size
 
 
@@ -44,6 +44,18 @@ TRANSACTION_TYPE = [
 ]
 
 
+def generate_reference_no():
+    """Random reference number for a transaction e.g. ABCD-1234-EF56
+
+    Set by save(), callers using bulk_create need to set it themselves."""
+
+    return "%s-%s-%s" % (
+        "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
+        "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
+        "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
+    )
+
+
 class TransactionType(models.TextChoices):
     CONGRESS = "CO"
     SESSION = "SE"
@@ -257,11 +269,7 @@ class MemberTransaction(AbstractTransaction):
         if self.description:
             self.description = self.description[:80]
         if not self.reference_no:
-            self.reference_no = "%s-%s-%s" % (
-                "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
-                "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
-                "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
-            )
+            self.reference_no = generate_reference_no()
         super(MemberTransaction, self).save(*args, **kwargs)
 
     def __str__(self):
@@ -300,11 +308,7 @@ class OrganisationTransaction(AbstractTransaction):
 
     def save(self, *args, **kwargs):
         if not self.reference_no:
-            self.reference_no = "%s-%s-%s" % (
-                "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
-                "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
-                "".join(random.choices(string.ascii_uppercase + string.digits, k=4)),
-            )
+            self.reference_no = generate_reference_no()
         super(OrganisationTransaction, self).save(*args, **kwargs)
 
     @property
@@ -56,7 +56,7 @@ from payments.views.core import (
 from rbac.core import rbac_user_has_role
 from rbac.decorators import rbac_check_role
 from rbac.views import rbac_forbidden
-from utils.utils import cobalt_paginator
+from utils.utils import cobalt_paginator, cobalt_keyset_paginator
 
 logger = logging.getLogger("cobalt")
 
@@ -79,7 +79,7 @@ def statement_admin_view(request, member_id):
     user = get_object_or_404(User, pk=member_id)
     (summary, club, balance, auto_button, events_list) = statement_common(user)
 
-    things = cobalt_paginator(request, events_list)
+    things = cobalt_keyset_paginator(request, events_list)
 
     # See if this admin can process refunds
     refund_administrator = rbac_user_has_role(request.user, "payments.global.edit")
@@ -41,7 +41,8 @@ import requests
 import stripe
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Sum, F
+from django.db import transaction
+from django.db.models import Sum, F, Max
 from django.http import HttpResponse, JsonResponse
 from django.template.loader import get_template
 from django.urls import reverse
@@ -61,9 +62,11 @@ from cobalt.settings import (
     GLOBAL_TITLE,
     COBALT_HOSTNAME,
 )
+from dashboard.widgets import dashboard_widget_invalidate
 import events.views.core as events_core
 from logs.views import log_event
 from notifications.views.core import contact_member, send_cobalt_email_with_template
+from organisations.models import Organisation
 from payments.models import (
     StripeTransaction,
     MemberTransaction,
@@ -71,6 +74,7 @@ from payments.models import (
     StripeLog,
     UserPendingPayment,
     PaymentStatic,
+    generate_reference_no,
 )
 from payments.views.payments_api import notify_member_to_member_transfer
 
@@ -122,7 +126,7 @@ def get_balance(member):
 
     """
 
-    # JPG - needs to take an update lock !!
+    # No lock, use lock_member_balances for a balance you are about to book against
     last_tran = (
         MemberTransaction.objects.filter(member=member).order_by("created_date").last()
     )
@@ -808,23 +812,25 @@ def update_account(
     # JPG TESTING - for COB-804 race condition testing
     # time.sleep(2)
 
-    # Get new balance
-    balance = get_balance(member) + float(amount)
+    with transaction.atomic():
 
-    # Create new MemberTransaction entry
-    act = MemberTransaction()
-    act.member = member
-    act.amount = amount
-    act.stripe_transaction = stripe_transaction
-    act.other_member = other_member
-    act.organisation = organisation
-    act.balance = balance
-    act.description = description
-    act.type = payment_type
-    if session:
-        act.club_session_id = session.id
+        # Get new balance, locking the member so nothing else can book from the same balance
+        balance = lock_member_balances([member.id])[member.id] + float(amount)
 
-    act.save()
+        # Create new MemberTransaction entry
+        act = MemberTransaction()
+        act.member = member
+        act.amount = amount
+        act.stripe_transaction = stripe_transaction
+        act.other_member = other_member
+        act.organisation = organisation
+        act.balance = balance
+        act.description = description
+        act.type = payment_type
+        if session:
+            act.club_session_id = session.id
+
+        act.save()
 
     return act
 
@@ -856,28 +862,242 @@ def update_organisation(
         session (club_sessions.models.Session, optional): club_session.session linked to this transaction
     """
 
-    # JPG - needs to take an update lock !!
-    last_tran = OrganisationTransaction.objects.filter(organisation=organisation).last()
-    balance = last_tran.balance if last_tran else 0.0
-    act = OrganisationTransaction()
-    act.organisation = organisation
-    act.member = member
-    act.amount = amount
-    act.other_organisation = other_organisation
-    act.balance = float(balance) + float(amount)
-    act.description = description
-    act.type = payment_type
-    act.bank_settlement_amount = bank_settlement_amount
-    if session:
-        act.club_session_id = session.id
-    if event:
-        act.event_id = event.id
-
-    act.save()
+    with transaction.atomic():
+
+        # Lock the organisation so nothing else can book from the same balance
+        list(
+            Organisation.objects.select_for_update(no_key=True)
+            .filter(pk=organisation.pk)
+            .values_list("pk")
+        )
+
+        last_tran = OrganisationTransaction.objects.filter(
+            organisation=organisation
+        ).last()
+        balance = last_tran.balance if last_tran else 0.0
+        act = OrganisationTransaction()
+        act.organisation = organisation
+        act.member = member
+        act.amount = amount
+        act.other_organisation = other_organisation
+        act.balance = float(balance) + float(amount)
+        act.description = description
+        act.type = payment_type
+        act.bank_settlement_amount = bank_settlement_amount
+        if session:
+            act.club_session_id = session.id
+        if event:
+            act.event_id = event.id
+
+        act.save()
 
     return act
 
 
+#######################################
+# update_accounts_for_organisation    #
+#######################################
+def update_accounts_for_organisation(
+    organisation,
+    member_amounts,
+    description,
+    payment_type,
+    session=None,
+    event=None,
+):
+    """Book a batch of member payments to one organisation with two inserts.
+
+    This is the bulk equivalent of calling update_account and update_organisation
+    for each payment. It doesn't check that the members can pay, use
+    payment_api_batch with book_internals=False for that first.
+
+    args:
+        organisation (organisations.models.Organisation): organisation being paid
+        member_amounts (list): list of (User, amount) tuples. Amount is positive for a
+                               payment from the member to the organisation
+        description (str): to appear on statements
+        payment_type (str): type of payment
+        session (club_sessions.models.Session, optional): club_session.session linked to these transactions
+        event (event.models.Event): optional event linked to these transactions
+
+    returns:
+        list: MemberTransactions created
+        list: OrganisationTransactions created
+    """
+
+    return update_accounts_for_organisations(
+        [
+            {
+                "member": member,
+                "organisation": organisation,
+                "amount": amount,
+                "description": description,
+                "session": session,
+                "event": event,
+            }
+            for member, amount in member_amounts
+        ],
+        payment_type,
+    )
+
+
+#######################################
+# lock_member_balances                #
+#######################################
+def lock_member_balances(member_ids):
+    """Lock members' accounts and return their balances.
+
+    Must be called inside a transaction. The User rows are locked (select_for_update, in
+    pk order) until the transaction ends, and update_account and
+    update_accounts_for_organisations take the same locks, so a check made against these
+    balances still holds when the payments are booked in the same transaction. The lock
+    is FOR NO KEY UPDATE so it doesn't hold up inserts of rows that refer to these users.
+
+    args:
+        member_ids (iterable): ids of the Users
+
+    returns:
+        dict: member id -> balance (float), 0.0 for members with no transactions
+    """
+
+    member_ids = set(member_ids)
+
+    list(
+        User.objects.select_for_update(no_key=True)
+        .filter(pk__in=member_ids)
+        .order_by("pk")
+        .values_list("pk")
+    )
+
+    balances = {member_id: 0.0 for member_id in member_ids}
+    balances.update(
+        {
+            member_transaction.member_id: float(member_transaction.balance)
+            for member_transaction in MemberTransaction.objects.filter(
+                member_id__in=member_ids
+            )
+            .order_by("member_id", "-created_date")
+            .distinct("member_id")
+        }
+    )
+
+    return balances
+
+
+#######################################
+# update_accounts_for_organisations   #
+#######################################
+def update_accounts_for_organisations(payments, payment_type):
+    """Book a batch of member payments to any number of organisations with two inserts.
+
+    Like update_account and update_organisation for each payment, but the balances are
+    read once and the rows are written with bulk_create. The members and organisations
+    are locked (select_for_update) until the rows are written, so two batches for the same
+    member can't both read the same starting balance. This doesn't check that the members
+    can pay, to do that call lock_member_balances first in the same transaction.
+
+    args:
+        payments (list): list of dicts with keys member (User), organisation (Organisation),
+                         amount (positive for a payment from the member to the organisation),
+                         description (str) and optionally event (Event) and session (Session)
+        payment_type (str): type of payment
+
+    returns:
+        list: MemberTransactions created
+        list: OrganisationTransactions created
+    """
+
+    if not payments:
+        return [], []
+
+    member_ids = {payment["member"].id for payment in payments}
+    organisation_ids = {payment["organisation"].id for payment in payments}
+
+    with transaction.atomic():
+
+        # One lock per member and organisation, always taken in the same order, members
+        # first as in update_account then update_organisation
+        balances = lock_member_balances(member_ids)
+        list(
+            Organisation.objects.select_for_update(no_key=True)
+            .filter(pk__in=organisation_ids)
+            .order_by("pk")
+            .values_list("pk")
+        )
+
+        # Current balances for all organisations in one query
+        org_balances = {
+            organisation_transaction.organisation_id: float(
+                organisation_transaction.balance
+            )
+            for organisation_transaction in OrganisationTransaction.objects.filter(
+                organisation_id__in=organisation_ids
+            )
+            .order_by("organisation_id", "-pk")
+            .distinct("organisation_id")
+        }
+
+        member_transactions = []
+        organisation_transactions = []
+
+        # Balances are found by created_date so make sure rows in this batch don't tie
+        now = timezone.now()
+
+        for index, payment in enumerate(payments):
+            member = payment["member"]
+            organisation = payment["organisation"]
+            amount = float(payment["amount"])
+            description = payment["description"]
+            session = payment.get("session")
+            event = payment.get("event")
+            created_date = now + datetime.timedelta(microseconds=index)
+
+            balances[member.id] = balances.get(member.id, 0.0) - amount
+            member_transactions.append(
+                MemberTransaction(
+                    member=member,
+                    amount=-amount,
+                    organisation=organisation,
+                    balance=balances[member.id],
+                    description=description,
+                    type=payment_type,
+                    created_date=created_date,
+                    club_session_id=session.id if session else None,
+                    reference_no=generate_reference_no(),
+                )
+            )
+
+            org_balances[organisation.id] = (
+                org_balances.get(organisation.id, 0.0) + amount
+            )
+            organisation_transactions.append(
+                OrganisationTransaction(
+                    organisation=organisation,
+                    member=member,
+                    amount=amount,
+                    balance=org_balances[organisation.id],
+                    description=description,
+                    type=payment_type,
+                    created_date=created_date,
+                    club_session_id=session.id if session else None,
+                    event_id=event.id if event else None,
+                    reference_no=generate_reference_no(),
+                )
+            )
+
+        member_transactions = MemberTransaction.objects.bulk_create(member_transactions)
+        organisation_transactions = OrganisationTransaction.objects.bulk_create(
+            organisation_transactions
+        )
+
+        # bulk_create doesn't send the signals that normally do this
+        transaction.on_commit(
+            lambda: dashboard_widget_invalidate("payments", member_ids)
+        )
+
+    return member_transactions, organisation_transactions
+
+
 ###########################
 # auto_topup_member       #
 ###########################
@@ -1290,15 +1510,74 @@ def member_to_member_transfer_callback(stripe_transaction=None):
     return HttpResponse()
 
 
-def get_payments_statistics():
-    """Get statistics about payments. Called by utils statistics"""
+def _ledger_statistics(model, previous, prefix):
+    """Turnover (sum of positive amounts) for a ledger table. Ledger rows are never
+    changed once written, so if we have a previous result we only need to add on
+    rows after its high water mark (highest id)"""
+
+    high_water = model.objects.aggregate(high_water=Max("id"))["high_water"] or 0
+    previous_high_water = previous.get(f"{prefix}_high_water", 0)
+    previous_turnover = Decimal(str(previous.get(f"{prefix}_turnover", 0)))
+
+    new_turnover = (
+        model.objects.filter(
+            id__gt=previous_high_water, id__lte=high_water, amount__gt=0
+        ).aggregate(sum=Sum("amount"))["sum"]
+        or 0
+    )
+
+    return high_water, previous_high_water, previous_turnover + new_turnover
+
+
+def get_payments_statistics(previous=None):
+    """Get statistics about payments. Called by utils statistics
+
+    Args:
+        previous (dict): optional, the result of the last call. If provided the
+            ledger totals are calculated incrementally from it
+    """
+
+    previous = previous or {}
 
     # Static
     payment_static = PaymentStatic.objects.filter(active=True).last()
 
-    members_who_have_made_payments = MemberTransaction.objects.distinct(
-        "member"
-    ).count()
+    (
+        member_transaction_high_water,
+        previous_member_transaction_high_water,
+        member_transaction_turnover,
+    ) = _ledger_statistics(MemberTransaction, previous, "member_transaction")
+
+    (
+        organisation_transaction_high_water,
+        _,
+        organisation_transaction_turnover,
+    ) = _ledger_statistics(
+        OrganisationTransaction, previous, "organisation_transaction"
+    )
+
+    # Members who have made payments - add on members whose first transaction is new
+    if "members_who_have_made_payments" in previous:
+        members_who_have_made_payments = previous["members_who_have_made_payments"] + (
+            MemberTransaction.objects.filter(
+                id__gt=previous_member_transaction_high_water,
+                id__lte=member_transaction_high_water,
+            )
+            .exclude(
+                member__in=MemberTransaction.objects.filter(
+                    id__lte=previous_member_transaction_high_water
+                ).values("member")
+            )
+            .distinct("member")
+            .count()
+        )
+    else:
+        members_who_have_made_payments = (
+            MemberTransaction.objects.filter(id__lte=member_transaction_high_water)
+            .distinct("member")
+            .count()
+        )
+
     total_stripe_transactions = StripeTransaction.objects.count()
     total_stripe_payment_amount = StripeTransaction.objects.filter(
         status__in=["Succeeded", "Partial refund", "Refunded"]
@@ -1312,12 +1591,8 @@ def get_payments_statistics():
 
     # Anything positive that moves counts as turnover
     total_turnover = (
-        MemberTransaction.objects.filter(amount__gt=0).aggregate(sum=Sum("amount"))[
-            "sum"
-        ]
-        + OrganisationTransaction.objects.filter(amount__gt=0).aggregate(
-            sum=Sum("amount")
-        )["sum"]
+        member_transaction_turnover
+        + organisation_transaction_turnover
         + StripeTransaction.objects.filter(amount__gt=0).aggregate(sum=Sum("amount"))[
             "sum"
         ]
@@ -1366,6 +1641,10 @@ def get_payments_statistics():
         "abf_fees": abf_fees,
         "estimated_stripe_fees": estimated_stripe_fees,
         "average_stripe_transaction": average_stripe_transaction,
+        "member_transaction_high_water": member_transaction_high_water,
+        "member_transaction_turnover": member_transaction_turnover,
+        "organisation_transaction_high_water": organisation_transaction_high_water,
+        "organisation_transaction_turnover": organisation_transaction_turnover,
     }
 
 
@@ -20,7 +20,7 @@ from payments.models import OrganisationTransaction
 from payments.views.core import update_organisation, update_account
 from rbac.core import rbac_user_has_role
 from rbac.views import rbac_forbidden
-from utils.utils import cobalt_paginator
+from utils.utils import cobalt_keyset_paginator
 
 TZ = pytz.timezone(TIME_ZONE)
 
@@ -75,7 +75,7 @@ def statement_org(request, org_id):
         organisation=organisation
     ).order_by("-created_date")
 
-    things = cobalt_paginator(request, events_list)
+    things = cobalt_keyset_paginator(request, events_list)
 
     page_balance = {}
 
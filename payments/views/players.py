@@ -36,7 +36,7 @@ from payments.views.core import (
 from payments.views.payments_api import payment_api_interactive
 from rbac.core import rbac_user_has_role
 from rbac.views import rbac_forbidden
-from utils.utils import cobalt_paginator
+from utils.utils import cobalt_keyset_paginator
 
 
 @login_required()
@@ -54,7 +54,7 @@ def statement(request):
     """
     (summary, club, balance, auto_button, events_list) = statement_common(request.user)
 
-    things = cobalt_paginator(request, events_list)
+    things = cobalt_keyset_paginator(request, events_list)
 
     # Check for refund eligible items
     payment_static = PaymentStatic.objects.filter(active=True).last()
@@ -2,4 +2,31 @@ from django.apps import AppConfig
 
 
 class RbacConfig(AppConfig):
-    name = 'rbac'
+    name = "rbac"
+
+    def ready(self):
+        """Called when Django starts up. Registers signals to invalidate the cached
+        RBAC trees (see rbac/tree.py) when groups are created, changed or deleted."""
+
+        # Can't import at top of file - Django won't be ready yet
+        from django.db.models.signals import post_save, post_delete
+        from rbac.models import RBACGroup, RBACAdminGroup
+        from rbac.tree import rbac_tree_invalidate
+
+        def _invalidate_rbac_tree(sender, **kwargs):
+            rbac_tree_invalidate("rbac")
+
+        def _invalidate_admin_tree(sender, **kwargs):
+            rbac_tree_invalidate("admin")
+
+        for signal in [post_save, post_delete]:
+            signal.connect(
+                _invalidate_rbac_tree,
+                sender=RBACGroup,
+                dispatch_uid=f"rbac_tree_{signal}",
+            )
+            signal.connect(
+                _invalidate_admin_tree,
+                sender=RBACAdminGroup,
+                dispatch_uid=f"admin_tree_{signal}",
+            )
@@ -0,0 +1,171 @@
+""" Cached RBAC tree
+
+    The RBAC and Admin trees are built from the dotted names of every RBACGroup or
+    RBACAdminGroup. With thousands of generated club groups building the whole tree on
+    every page load is slow, so we build it once into a dictionary of nodes keyed by path
+    and cache it.
+
+    The cache key includes a version number which is incremented by signals (see apps.py)
+    whenever a group is saved or deleted, and a cheap fingerprint (count and max id) of the
+    group table so that bulk changes are also picked up. The version is shared by every
+    process (see utils/views/cobalt_cache.py), the trees are cached per process.
+
+    The screens only ask for the children of one node at a time (see tree_nodes_htmx),
+    so opening a tree never renders the whole thing.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from organisations.models import Organisation
+from rbac.models import RBACGroup, RBACAdminGroup
+from utils.views.cobalt_cache import shared_version, shared_version_bump
+
+RBAC_TREE_CACHE_TIMEOUT = 60 * 60 * 24
+""" Cached trees are also invalidated on change, so this can be long """
+
+RBAC_TREE_MODELS = {"rbac": RBACGroup, "admin": RBACAdminGroup}
+""" tree_type -> model """
+
+ROOT_PATH = ""
+""" path of the (invisible) root node """
+
+
+def rbac_tree_version(tree_type):
+    """Return the current version number for this tree"""
+
+    return shared_version(f"rbac_tree:{tree_type}")
+
+
+def rbac_tree_invalidate(tree_type):
+    """Called when a group changes. Bumps the version so the cached tree is rebuilt"""
+
+    shared_version_bump(f"rbac_tree:{tree_type}")
+
+
+def _dom_id(tree_type, path):
+    """html safe id for a node, paths can contain anything"""
+
+    return f"rbac-tree-{tree_type}-{hashlib.md5(path.encode()).hexdigest()[:12]}"
+
+
+def _build_rbac_tree(tree_type):
+    """Build the tree structure for a model.
+
+    We turn:
+     abf.people.fred          (id=34)
+     abf.people.john          (id=45)
+     abf.animals.dogs.rover   (id=2)
+
+    into:
+     nodes[""]["children"] = ["abf"]
+     nodes["abf"]["children"] = ["abf.animals", "abf.people"]
+     nodes["abf.people"]["children"] = ["abf.people.fred", "abf.people.john"]
+     nodes["abf.people.fred"]["groups"] = [{"id": 34, "description": "..."}]
+     ...
+
+    Nodes for generated club groups (something.generated.<state>.<club pk>) are labelled
+    with the club name to make the tree easier to navigate.
+    """
+
+    model = RBAC_TREE_MODELS[tree_type]
+
+    groups = model.objects.values_list(
+        "id", "name_qualifier", "name_item", "description"
+    )
+
+    nodes = {
+        ROOT_PATH: {
+            "path": ROOT_PATH,
+            "label": "",
+            "children": [],
+            "groups": [],
+        }
+    }
+    club_nodes = {}
+
+    for group_id, name_qualifier, name_item, description in groups:
+        parts = f"{name_qualifier}.{name_item}".split(".")
+        parent = ROOT_PATH
+
+        for i in range(1, len(parts) + 1):
+            path = ".".join(parts[:i])
+
+            if path not in nodes:
+                nodes[path] = {
+                    "path": path,
+                    "label": parts[i - 1],
+                    "children": [],
+                    "groups": [],
+                }
+                nodes[parent]["children"].append(path)
+
+                # generated.<state>.<number>
+                if i > 2 and parts[i - 3] == "generated" and parts[i - 1].isdigit():
+                    club_nodes[path] = int(parts[i - 1])
+
+            parent = path
+
+        nodes[parent]["groups"].append({"id": group_id, "description": description})
+
+    # Only load the clubs we need
+    if club_nodes:
+        club_names = dict(
+            Organisation.objects.filter(pk__in=club_nodes.values()).values_list(
+                "pk", "name"
+            )
+        )
+        for path, club_pk in club_nodes.items():
+            nodes[path]["label"] = club_names.get(club_pk, nodes[path]["label"])
+
+    # Sort children by what the user sees and add ids for the html
+    for path, node in nodes.items():
+        node["children"].sort(key=lambda child: nodes[child]["label"].lower())
+        node["dom_id"] = _dom_id(tree_type, path)
+
+    return nodes
+
+
+def rbac_tree(tree_type):
+    """Return the cached tree for tree_type ("rbac" or "admin"), building it if required"""
+
+    model = RBAC_TREE_MODELS[tree_type]
+
+    fingerprint = model.objects.aggregate(count=Count("id"), max_id=Max("id"))
+    cache_key = (
+        f"rbac_tree:{tree_type}:{rbac_tree_version(tree_type)}:"
+        f"{fingerprint['count']}:{fingerprint['max_id']}"
+    )
+
+    nodes = cache.get(cache_key)
+    if nodes is None:
+        nodes = _build_rbac_tree(tree_type)
+        cache.set(cache_key, nodes, RBAC_TREE_CACHE_TIMEOUT)
+
+    return nodes
+
+
+def rbac_tree_children(tree_type, path=ROOT_PATH):
+    """Return the child nodes of path (default the top of the tree) for display.
+
+    Each node is a dictionary with path, label, dom_id, groups (list of id and
+    description for any groups with exactly this name) and has_children.
+    Returns an empty list if path is not in the tree.
+    """
+
+    nodes = rbac_tree(tree_type)
+
+    if path not in nodes:
+        return []
+
+    return [
+        {
+            "path": nodes[child]["path"],
+            "label": nodes[child]["label"],
+            "dom_id": nodes[child]["dom_id"],
+            "groups": nodes[child]["groups"],
+            "has_children": bool(nodes[child]["children"]),
+        }
+        for child in nodes[path]["children"]
+    ]
@@ -19,6 +19,8 @@ urlpatterns = [
     path("admin", views.rbac_admin, name="rbac_admin"),
     path("tests", views.rbac_tests, name="rbac_tests"),
     path("admin/tree", views.admin_tree_screen, name="admin_tree_screen"),
+    path("tree/nodes-htmx", views.tree_nodes_htmx, name="tree_nodes_htmx"),
+    path("tree/nodes-json", views.tree_nodes_json, name="tree_nodes_json"),
     path("admin/group/create", views.admin_group_create, name="admin_group_create"),
     path(
         "admin/group/view/<int:group_id>/",
@@ -1,9 +1,8 @@
 import operator
-import re
 
 from django.forms import model_to_dict
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
 from .models import (
     RBACGroup,
@@ -38,6 +37,7 @@ from .core import (
 )
 from cobalt.settings import TIME_ZONE, COBALT_HOSTNAME
 from .forms import AddGroup
+from .tree import rbac_tree_children, rbac_tree_version, RBAC_TREE_MODELS
 from django.contrib import messages
 from django.utils import timezone
 from organisations.models import Organisation
@@ -132,149 +132,77 @@ def view_screen(request):
     )
 
 
-def generic_tree_builder(groups, detail_link=None, html_type="href"):
-    """function to build an rbac tree for use with the tree viewer.
-
-    Args:
-        groups - queryset of RBACGroup or RBACAdminGroup
-        detail_link - str of link to follow
-        html_type - str to specify whether to generate <a> or <button>
-
-    Returns:
-        str - HTML string to insert into page
-
-    build a list of the tree. We want to turn:
-     abf.people.fred          (id=34)
-     abf.people.john          (id=45)
-     abf.animals.dogs.rover   (id=2)
-     abf.animals.cats.felix   (id=21)
-
-    into:
-     items["abf"]=["people", "animals"]
-     items["abf.people"]=["fred", "john"]
-     items["abf.people.fred"]=34
-     items["abf.people.john"]=45
-     items["abf.animals"]=["dogs", "cats"]
-     items["abf.animals.dogs"]=["rover"]
-     items["abf.animals.cats"]=["felix"]
-     items["abf.animals.dogs.rover"]=2
-     items["abf.animals.cats.felix"]=21
-    """
-
-    # Tree is hard to navigate for the parts that have numbers instead of club names
-    # We get the club numbers(pks) and names and substitute to make more readable
-    all_orgs = Organisation.objects.all()
-    # turn to dictionary
-    all_orgs_dict = {org.pk: org.name for org in all_orgs}
-
-    items = {}
-    items_description = {}
-    for group in groups:
-        line = f"{group.name_qualifier}.{group.name_item}"
-        parts = line.split(".")
-        for i in range(1, len(parts) + 1):
-
-            string = ".".join(parts[:i])
+def generic_tree_screen(request, tree_type, title):
+    """Show RBAC Tree for RBAC or Admin. Only the top level is loaded, the rest is
+    expanded on demand by tree_nodes_htmx"""
 
-            if i == len(parts):  # end of line
-                child = group.id
-                items_description[group.id] = group.description
+    nodes = rbac_tree_children(tree_type)
 
-            else:  # more left
-                child = parts[i]
-
-            if string in items:
-                if child not in items[string]:
-                    items[string].append(child)
-            else:
-                items[string] = [child]
-
-    # sort the dictionary on keys
-    sorted_items = dict(sorted(items.items()))
+    return render(
+        request,
+        "rbac/tree-screen.html",
+        {
+            "nodes": nodes,
+            "tree_type": tree_type,
+            "html_type": "href",
+            "title": title,
+        },
+    )
 
-    """ generate html - loop through the sorted dictionary and do 3 things:
-     1) if there is more below create a new ul
-     2) if we are the end of the tree (contents is an integer) print the link to the details
-     3) manage the stack so we close the right number of uls
-     """
 
-    html_tree = ""
-    depth = []
-    for key, value in sorted_items.items():
-        this_level = ".".join(key.split(".")[:-1])  # eg we are a.b.c level=a.b
+@login_required
+def tree_nodes_htmx(request):
+    """Return the children of one node of the tree as html for the tree viewers and
+    the tree picker
 
-        # are we at the top?
-        if not depth:
-            depth.append(this_level)
+    Takes tree_type ("rbac" or "admin"), path (dotted path of the parent node) and
+    html_type ("href" for links to the group, "button" for the picker)
+    """
 
-        elif this_level == depth[-1]:
-            pass
+    tree_type = request.GET.get("tree_type", "rbac")
+    if tree_type not in RBAC_TREE_MODELS:
+        return HttpResponse("Invalid tree type")
 
-        elif this_level.find(depth[-1]) == 0:
-            depth.append(this_level)
+    nodes = rbac_tree_children(tree_type, request.GET.get("path", ""))
 
-        else:
-            while depth:
-                if depth[-1] == this_level:
-                    break
-                depth = depth[:-1]
-                html_tree += "</ul>\n"
-
-        # Make tree display more readable for generated branches
-        # Change key from "something.generated.<state>.<number>" to "something.generated.<state>.<club name>"
-        match = re.findall("generated\\.(\\w+)\\.(\\d+)", key)
-        if match:
-            this_state = match[0][0]
-            this_org = int(match[0][1])
-            key = key.replace(
-                f"generated.{this_state}.{this_org}",
-                f"generated.{this_state}.{all_orgs_dict[this_org]}",
-            )
+    return render(
+        request,
+        "rbac/tree_nodes_htmx.html",
+        {
+            "nodes": nodes,
+            "tree_type": tree_type,
+            "html_type": request.GET.get("html_type", "href"),
+        },
+    )
 
-        # now process line
-        last_part = key.split(".")[-1]
-        if isinstance(value[0], int):
-            # This is the end of the line
-            if html_type == "button":
-                html_tree += (
-                    "<li>%s (%s) <button value='%s' class='tree-btn cobalt-rbac-tree btn btn-sm btn-primary'>Use</button></li>\n"
-                    % (last_part, items_description[value[0]], key)
-                )
-            elif html_type == "href":
-                html_tree += (
-                    "<li><a href='%s%s/' target='_blank'>%s (%s)</a></li>\n"
-                    % (
-                        detail_link,
-                        value[0],
-                        last_part,
-                        items_description[value[0]],
-                    )
-                )
-        else:
-            html_tree += (
-                "<li><span class='caret'>%s</span><ul class='nested'>\n" % last_part
-            )
 
-    return html_tree
+@login_required
+def tree_nodes_json(request):
+    """Return the children of one node of the tree as JSON
 
+    Takes tree_type ("rbac" or "admin") and path (dotted path of the parent node)
+    """
 
-def generic_tree_screen(request, groups, detail_link, title):
-    """Show full RBAC Tree for RBAC or Admin"""
+    tree_type = request.GET.get("tree_type", "rbac")
+    if tree_type not in RBAC_TREE_MODELS:
+        return JsonResponse({"error": "Invalid tree type"}, status=400)
 
-    html_tree = generic_tree_builder(groups, detail_link)
+    path = request.GET.get("path", "")
 
-    return render(
-        request, "rbac/tree-screen.html", {"html_tree": html_tree, "title": title}
+    return JsonResponse(
+        {
+            "tree_type": tree_type,
+            "version": rbac_tree_version(tree_type),
+            "path": path,
+            "nodes": rbac_tree_children(tree_type, path),
+        }
     )
 
 
 @login_required
 def tree_screen(request):
     """Show full RBAC Tree"""
-    # Get groups
-    groups = RBACGroup.objects.all().order_by("name_qualifier")
-
-    return generic_tree_screen(request, groups, "/rbac/group/view/", "Tree Viewer")
+    return generic_tree_screen(request, "rbac", "Tree Viewer")
 
 
 @login_required
@@ -349,12 +277,7 @@ def list_members_screen(request):
 @login_required
 def admin_tree_screen(request):
     """Show full RBAC Admin Tree"""
-    # Get groups
-    groups = RBACAdminGroup.objects.all().order_by("name_qualifier")
-
-    return generic_tree_screen(
-        request, groups, "/rbac/admin/group/view/", "Admin Tree Viewer"
-    )
+    return generic_tree_screen(request, "admin", "Admin Tree Viewer")
 
 
 @login_required
@@ -766,11 +689,8 @@ def rbac_tests(request):
             if not ans:
                 ans = "Nothing found."
 
-    # Get trees
-    groups = RBACGroup.objects.all().order_by("name_qualifier")
-    tree = generic_tree_builder(groups, html_type="button")
-    admin_groups = RBACAdminGroup.objects.all().order_by("name_qualifier")
-    admin_tree = generic_tree_builder(admin_groups, html_type="button")
+    # Get top of the tree, the rest is loaded when the user expands it
+    tree = rbac_tree_children("rbac")
 
     # get models
     models = RBACModelDefault.objects.all().order_by("app", "model")
@@ -794,7 +714,6 @@ def rbac_tests(request):
             "member_id": userid,
             "text": text,
             "tree": tree,
-            "admin_tree": admin_tree,
             "models": models,
             "roles": roles,
             "group": group,
@@ -38,7 +38,8 @@ def boards_from_usebio(results_file: ResultsFile) -> list:
 def create_player_records_from_usebio_format_pairs(
     results_file: ResultsFile, xml: dict
 ):
-    """take in a xml usebio structure and generate the PlayerSummaryResult records for pairs event"""
+    """take in a xml usebio structure and generate the PlayerSummaryResult records for pairs event.
+    Returns the number of records created"""
 
     xml = xml.get("EVENT")
 
@@ -54,6 +55,8 @@ def create_player_records_from_usebio_format_pairs(
         except ValueError:
             event_date = datetime.today()
 
+    player_records = []
+
     for detail in xml["PARTICIPANTS"]["PAIR"]:
         percentage = detail["PERCENTAGE"]
         position = detail["PLACE"]
@@ -73,13 +76,19 @@ def create_player_records_from_usebio_format_pairs(
 
             # We create records even for unregistered players, so they have a history when they eventually register
             if player_system_number:
-                PlayerSummaryResult(
-                    player_system_number=player_system_number,
-                    results_file=results_file,
-                    result_date=event_date,
-                    position=position,
-                    partner_or_team_name=this_partner_name,
-                    percentage=percentage,
-                    result_string=f"{place} in {event_name} at {results_file.organisation}",
-                    event_name=event_name,
-                ).save()
+                player_records.append(
+                    PlayerSummaryResult(
+                        player_system_number=player_system_number,
+                        results_file=results_file,
+                        result_date=event_date,
+                        position=position,
+                        partner_or_team_name=this_partner_name,
+                        percentage=percentage,
+                        result_string=f"{place} in {event_name} at {results_file.organisation}",
+                        event_name=event_name,
+                    )
+                )
+
+    PlayerSummaryResult.objects.bulk_create(player_records)
+
+    return len(player_records)
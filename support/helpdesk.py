@@ -1,10 +1,13 @@
 import copy
 import logging
 from datetime import timedelta
+from urllib.parse import urlencode
 
 import pytz
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Max
 from django.http import JsonResponse, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.template.loader import render_to_string
@@ -40,11 +43,15 @@ from support.forms import (
     NotifyUserByTypeForm,
 )
 from support.models import Incident, IncidentLineItem, Attachment, NotifyUserByType
+from utils.utils import cobalt_keyset_paginator
 
 TZ = pytz.timezone(TIME_ZONE)
 
 logger = logging.getLogger("cobalt")
 
+HELPDESK_LIST_PAGE_SIZE = 50
+""" tickets shown on each page of the ticket list """
+
 
 def _get_user_details_from_ticket(ticket):
     """internal function to get basic user information from the ticket"""
@@ -389,7 +396,9 @@ def create_ticket(request):
 def helpdesk_menu(request):
     """Main Dashboard for the helpdesk"""
 
-    tickets = Incident.objects.exclude(status="Closed")
+    tickets = Incident.objects.exclude(status="Closed").select_related(
+        "reported_by_user", "assigned_to"
+    )
     open_tickets = tickets.count()
     unassigned_tickets = tickets.filter(assigned_to=None)
     assigned_to_you = tickets.filter(assigned_to=request.user)
@@ -423,12 +432,10 @@ def helpdesk_list(request):
     days = int(form_days) if form_days else 7
 
     if days == -1:  # no filter
-        tickets = Incident.objects.all().order_by("-created_date")
+        tickets = Incident.objects.all()
     else:
         ref_date = timezone.now() - timedelta(days=days)
-        tickets = Incident.objects.filter(created_date__gte=ref_date).order_by(
-            "-created_date"
-        )
+        tickets = Incident.objects.filter(created_date__gte=ref_date)
 
     if form_severity not in ["All", None]:
         tickets = tickets.filter(severity=form_severity)
@@ -451,27 +458,45 @@ def helpdesk_list(request):
     incident_types = tickets.values("incident_type").distinct().order_by()
     severities = tickets.values("severity").distinct().order_by()
     statuses = tickets.values("status").distinct().order_by()
+    unique_users = User.objects.filter(
+        pk__in=tickets.exclude(reported_by_user=None).values("reported_by_user")
+    ).order_by("first_name")
+    assigned_tos = User.objects.filter(
+        pk__in=tickets.exclude(assigned_to=None).values("assigned_to")
+    ).order_by("first_name")
+
+    # Keep the filters when moving between pages
+    searchparams = urlencode(
+        {
+            key: request.GET[key]
+            for key in [
+                "days",
+                "severity",
+                "status",
+                "user",
+                "assigned_to",
+                "incident_type",
+            ]
+            if key in request.GET
+        }
+    )
+    if searchparams:
+        searchparams += "&"
 
-    # Should be able to do this with querysets but it seems to always return ids not User objects
-    unique_users = []
-    assigned_tos = []
-    for ticket in tickets:
-        this_user = ticket.reported_by_user
-        if this_user not in unique_users and this_user:
-            unique_users.append(this_user)
-        this_staff = ticket.assigned_to
-        if this_staff not in assigned_tos and this_staff:
-            assigned_tos.append(this_staff)
-
-    # sort lists alphabetically
-    unique_users.sort(key=lambda x: x.first_name)
-    assigned_tos.sort(key=lambda x: x.first_name)
+    # Newest first, by position (keyset) rather than page number
+    things = cobalt_keyset_paginator(
+        request,
+        tickets.select_related("reported_by_user", "assigned_to").order_by(
+            "-created_date", "-id"
+        ),
+        HELPDESK_LIST_PAGE_SIZE,
+    )
 
     return render(
         request,
         "support/helpdesk/list_tickets.html",
         {
-            "things": tickets,
+            "things": things,
             "severities": severities,
             "statuses": statuses,
             "users": unique_users,
@@ -483,6 +508,7 @@ def helpdesk_list(request):
             "form_incident_type": form_incident_type,
             "assigned_tos": assigned_tos,
             "incident_types": incident_types,
+            "searchparams": searchparams,
         },
     )
 
@@ -1004,25 +1030,34 @@ def close_old_tickets():
     ref_date = timezone.now() - timedelta(days=30)
 
     # Get tickets which are in progress or waiting for user feedback which haven't have any action for 30 days or more
-    inactive_tickets = Incident.objects.filter(
-        incidentlineitem__created_date__lt=ref_date
-    ).filter(status__in=["In Progress", "Pending User Feedback"])
+    # Grouping by ticket gives one row per ticket however many line items it has
+    inactive_ticket_ids = list(
+        Incident.objects.filter(status__in=["In Progress", "Pending User Feedback"])
+        .annotate(last_activity=Max("incidentlineitem__created_date"))
+        .filter(last_activity__lt=ref_date)
+        .values_list("id", flat=True)
+    )
 
-    if not inactive_tickets:
+    if not inactive_ticket_ids:
         logger.info("No tickets are old enough to close")
         return
 
-    system_account = User.objects.get(pk=ABF_USER)
+    with transaction.atomic():
+        IncidentLineItem.objects.bulk_create(
+            [
+                IncidentLineItem(
+                    incident_id=inactive_ticket_id,
+                    staff_id=ABF_USER,
+                    description="Ticket automatically closed after 30 days of inactivity",
+                )
+                for inactive_ticket_id in inactive_ticket_ids
+            ]
+        )
+        Incident.objects.filter(id__in=inactive_ticket_ids).update(status="Closed")
 
-    for inactive_ticket in inactive_tickets:
-        logger.info(f"Closing ticket {inactive_ticket}")
-        IncidentLineItem(
-            incident=inactive_ticket,
-            staff=system_account,
-            description="Ticket automatically closed after 30 days of inactivity",
-        ).save()
-        inactive_ticket.status = "Closed"
-        inactive_ticket.save()
+    logger.info(
+        f"Closed {len(inactive_ticket_ids)} inactive tickets: {inactive_ticket_ids}"
+    )
 
 
 def get_support_statistics():
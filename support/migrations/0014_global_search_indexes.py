@@ -0,0 +1,47 @@
+from django.db import migrations
+
+# Indexes for the global search (see support/search.py). Django turns icontains into
+# UPPER("title"::text) LIKE UPPER('%...%'), so the trigram indexes are on the same UPPER()
+# expression, otherwise Postgres can't use them. The full text index expression must
+# match what SearchVector("title", config="english") generates or it won't be used.
+#
+# People are searched on the User name indexes from accounts migration 0073.
+#
+# These are big tables on a live site, so the indexes are built CONCURRENTLY, which
+# can't be done inside a transaction.
+
+TRIGRAM_INDEXES = [
+    ("search_forum_title_upper_trgm", "forums_forum", "title"),
+    ("search_post_title_upper_trgm", "forums_post", "title"),
+    ("search_congress_name_upper_trgm", "events_congress", "name"),
+    ("search_organisation_name_upper_trgm", "organisations_organisation", "name"),
+]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("support", "0013_auto_20210806_0957"),
+        ("accounts", "0071_remove_user_share_with_clubs"),
+        ("forums", "0018_auto_20200801_1337"),
+        ("events", "0119_alter_event_entry_fee"),
+        ("organisations", "0087_add_memberclubdetails_indexes"),
+        # enables pg_trgm
+        ("notifications", "0053_add_email_to_index"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin (UPPER("{column}"::text) gin_trgm_ops);',
+            reverse_sql=f"DROP INDEX CONCURRENTLY IF EXISTS {name};",
+        )
+        for name, table, column in TRIGRAM_INDEXES
+    ] + [
+        migrations.RunSQL(
+            sql="CREATE INDEX CONCURRENTLY IF NOT EXISTS search_post_title_fts ON forums_post "
+            "USING gin (to_tsvector('english'::regconfig, COALESCE(\"title\", '')));",
+            reverse_sql="DROP INDEX CONCURRENTLY IF EXISTS search_post_title_fts;",
+        ),
+    ]
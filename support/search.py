@@ -0,0 +1,188 @@
+""" Global search
+
+    The search bar on every page looks for people, forums, post titles, congresses,
+    the user's own payments and clubs. Each type is searched with one ranked query
+    with a LIMIT, so a broad term like a common surname never loads more than a page of
+    results, and each type is paged on its own.
+
+    Names and titles are matched with icontains and ranked by trigram similarity.
+    Django turns icontains into UPPER(col) LIKE UPPER('%term%'), which Postgres answers
+    from the trigram (pg_trgm) indexes on UPPER(col) added by support migration 0014
+    (accounts migration 0073 for people).
+
+    Post titles are also matched with full text search so other forms of a word match
+    ("congresses" finds "Congress"). The two are ORed, and as each side has its own
+    index (the full text one is also in 0014) Postgres combines the two index scans
+    rather than reading every post.
+
+    Counts are exact up to SEARCH_COUNT_LIMIT, after that we only say there are more.
+"""
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    TrigramSimilarity,
+)
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+from accounts.models import User
+from events.models import Congress
+from forums.models import Post, Forum
+from organisations.models import Organisation
+from payments.models import MemberTransaction
+
+SEARCH_PAGE_SIZE = 10
+""" results shown for each type """
+
+SEARCH_COUNT_LIMIT = 500
+""" stop counting after this many matches """
+
+
+def _search_people(query, user):
+    if query.isdigit():
+        return User.objects.filter(system_number=int(query)).annotate(
+            rank=F("system_number")
+        )
+
+    if query.find(" ") >= 0:
+        first_name = query.split(" ")[0]
+        last_name = " ".join(query.split(" ")[1:])
+        return User.objects.filter(
+            Q(first_name__icontains=first_name) & Q(last_name__icontains=last_name)
+        ).annotate(
+            rank=TrigramSimilarity("first_name", first_name)
+            + TrigramSimilarity("last_name", last_name)
+        )
+
+    return User.objects.filter(
+        Q(first_name__icontains=query) | Q(last_name__icontains=query)
+    ).annotate(
+        rank=Greatest(
+            TrigramSimilarity("first_name", query),
+            TrigramSimilarity("last_name", query),
+        )
+    )
+
+
+def _search_posts(query, user):
+    search_query = SearchQuery(query, config="english")
+
+    return (
+        Post.objects.annotate(search=SearchVector("title", config="english"))
+        .filter(Q(search=search_query) | Q(title__icontains=query))
+        .annotate(
+            rank=SearchRank(F("search"), search_query)
+            + TrigramSimilarity("title", query)
+        )
+        .select_related("forum", "author")
+    )
+
+
+def _search_forums(query, user):
+    return Forum.objects.filter(title__icontains=query).annotate(
+        rank=TrigramSimilarity("title", query)
+    )
+
+
+def _search_events(query, user):
+    return Congress.objects.filter(name__icontains=query).annotate(
+        rank=TrigramSimilarity("name", query)
+    )
+
+
+def _search_payments(query, user):
+    # only ever the user's own statement, most recent first
+    return MemberTransaction.objects.filter(
+        member=user, description__icontains=query
+    ).annotate(rank=F("created_date"))
+
+
+def _search_orgs(query, user):
+    return Organisation.objects.filter(name__icontains=query).annotate(
+        rank=TrigramSimilarity("name", query)
+    )
+
+
+SEARCH_TYPES = {
+    "people": ("People", _search_people),
+    "forums": ("Forums", _search_forums),
+    "orgs": ("Clubs", _search_orgs),
+    "posts": ("Post Titles", _search_posts),
+    "events": ("Events", _search_events),
+    "payments": ("Payments", _search_payments),
+}
+""" search type -> (heading, function returning a queryset annotated with rank) """
+
+
+class SearchResults:
+    """One page of results for one search type"""
+
+    def __init__(self, search_type, query, user, page=1):
+        self.search_type = search_type
+        self.heading, search_function = SEARCH_TYPES[search_type]
+        self.page = max(1, page)
+
+        queryset = search_function(query, user).order_by("-rank", "pk")
+
+        # get one extra so we know if there is another page
+        offset = (self.page - 1) * SEARCH_PAGE_SIZE
+        results = list(queryset[offset : offset + SEARCH_PAGE_SIZE + 1])
+
+        self.has_next = len(results) > SEARCH_PAGE_SIZE
+        self.has_previous = self.page > 1
+        self.results = results[:SEARCH_PAGE_SIZE]
+
+        if not self.has_next and not self.has_previous:
+            # everything is on this page, no need to count
+            self.count = len(self.results)
+        else:
+            self.count = (
+                queryset.order_by().values("pk")[: SEARCH_COUNT_LIMIT + 1].count()
+            )
+
+        self.more_than_limit = self.count > SEARCH_COUNT_LIMIT
+        if self.more_than_limit:
+            self.count = SEARCH_COUNT_LIMIT
+
+    @property
+    def previous_page_number(self):
+        return self.page - 1
+
+    @property
+    def next_page_number(self):
+        return self.page + 1
+
+    @property
+    def first_result_number(self):
+        return (self.page - 1) * SEARCH_PAGE_SIZE + 1
+
+    @property
+    def last_result_number(self):
+        return (self.page - 1) * SEARCH_PAGE_SIZE + len(self.results)
+
+
+def global_search_results(query, user, search_types, pages):
+    """Search for query in each of the search_types
+
+    Args:
+        query (str): what to search for
+        user (User): who is searching (only their payments are searched)
+        search_types (list): keys of SEARCH_TYPES to search
+        pages (dict): search type to page number, defaults to 1
+
+    Returns:
+        list: SearchResults, one for each type with results
+    """
+
+    query = query.strip()
+
+    sections = []
+
+    for search_type in SEARCH_TYPES:
+        if search_type in search_types:
+            section = SearchResults(search_type, query, user, pages.get(search_type, 1))
+            if section.results:
+                sections.append(section)
+
+    return sections
@@ -1,11 +1,10 @@
 import json
-from itertools import chain
+from urllib.parse import quote
 
 import requests
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import SuspiciousOperation
-from django.db.models import Q
 from django.http import HttpResponse
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import csrf_exempt
@@ -16,17 +15,13 @@ from cobalt.settings import (
     RECAPTCHA_SITE_KEY,
     RECAPTCHA_SECRET_KEY,
 )
-from events.models import Congress
-from forums.models import Post, Forum
-from organisations.models import Organisation
-from payments.models import MemberTransaction
 from rbac.core import rbac_user_has_role
-from utils.utils import cobalt_paginator
 from .forms import (
     HelpdeskLoggedInContactForm,
     HelpdeskLoggedOutContactForm,
 )
 from .helpdesk import notify_user_new_ticket_by_form, notify_group_new_ticket
+from .search import SEARCH_TYPES, global_search_results
 
 
 @login_required
@@ -190,96 +185,49 @@ def browser_errors(request):
 @login_required
 def global_search(request):
     """This handles the search bar that appears on every page. Also gets called from the search panel that
-    we show if a search is performed, to allow the user to reduce the range of the search"""
+    we show if a search is performed, to allow the user to reduce the range of the search.
 
-    query = request.POST.get("search_string")
-    include_people = request.POST.get("include_people")
-    include_forums = request.POST.get("include_forums")
-    include_posts = request.POST.get("include_posts")
-    include_events = request.POST.get("include_events")
-    include_payments = request.POST.get("include_payments")
-    include_orgs = request.POST.get("include_orgs")
+    The paging links for each type of result are GETs with the same parameters"""
 
-    searchparams = ""
-
-    if query:  # don't search if no search string
+    data = request.POST if request.method == "POST" else request.GET
 
-        searchparams = f"search_string={query.replace(' ', '%20')}&"
+    query = data.get("search_string")
+    include = {
+        search_type: data.get(f"include_{search_type}") for search_type in SEARCH_TYPES
+    }
 
-        # Users
-        if include_people:
-
-            if query.find(" ") >= 0:
-                first_name = query.split(" ")[0]
-                last_name = " ".join(query.split(" ")[1:])
-                people = User.objects.filter(
-                    Q(first_name__icontains=first_name)
-                    & Q(last_name__icontains=last_name)
-                )
-            else:
-                people = User.objects.filter(
-                    Q(first_name__icontains=query)
-                    | Q(last_name__icontains=query)
-                    | Q(system_number__icontains=query)
-                )
-            searchparams += "include_people=1&"
-        else:
-            people = []
-
-        if include_posts:
-            posts = Post.objects.filter(title__icontains=query)
-            searchparams += "include_posts=1&"
-        else:
-            posts = []
-
-        if include_forums:
-            forums = Forum.objects.filter(title__icontains=query)
-            searchparams += "include_forums=1&"
-        else:
-            forums = []
-
-        if include_events:
-            events = Congress.objects.filter(name__icontains=query)
-            searchparams += "include_events=1&"
-        else:
-            events = []
-
-        if include_payments:
-            payments = MemberTransaction.objects.filter(
-                description__icontains=query, member=request.user
-            )
-            searchparams += "include_payments=1&"
-        else:
-            payments = []
+    searchparams = ""
+    sections = []
 
-        if include_orgs:
-            orgs = Organisation.objects.filter(name__icontains=query)
-            searchparams += "include_orgs=1&"
-        else:
-            orgs = []
+    if query:  # don't search if no search string
 
-        # combine outputs
-        results = list(chain(people, posts, forums, events, payments, orgs))
+        searchparams = f"search_string={quote(query)}&"
 
-        # create paginator
-        things = cobalt_paginator(request, results)
+        search_types = []
+        for search_type, included in include.items():
+            if included:
+                search_types.append(search_type)
+                searchparams += f"include_{search_type}=1&"
 
-    else:  # no search string provided
+        pages = {}
+        for search_type in search_types:
+            try:
+                pages[search_type] = int(data.get(f"{search_type}_page", 1))
+            except ValueError:
+                pages[search_type] = 1
 
-        things = []
+        sections = global_search_results(query, request.user, search_types, pages)
 
     return render(
         request,
         "support/general/search.html",
         {
-            "things": things,
+            "sections": sections,
             "search_string": query,
-            "include_people": include_people,
-            "include_forums": include_forums,
-            "include_posts": include_posts,
-            "include_events": include_events,
-            "include_payments": include_payments,
-            "include_orgs": include_orgs,
+            **{
+                f"include_{search_type}": included
+                for search_type, included in include.items()
+            },
             "searchparams": searchparams,
         },
     )
@@ -0,0 +1,499 @@
+""" Script to create a large synthetic data set for run_benchmarks
+
+    The normal test data is small, so a view that does a query per member or per entry
+    looks fine against it. This builds something closer to production sizes: tens of
+    thousands of users, hundreds of clubs with members, large congresses, long ledgers
+    and big club sessions, plus a few hundred thousand more users for the name search
+    and notifications.
+
+    Everything is written with bulk_create and uses system numbers from
+    BENCHMARK_SYSTEM_NUMBER_START and club numbers starting with BENCHMARK_ORG_ID_PREFIX
+    so run_benchmarks can find it.
+"""
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import SuspiciousOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.models import User, UnregisteredUser
+from club_sessions.models import Session, SessionEntry, SessionType
+from cobalt.settings import COBALT_HOSTNAME
+from events.models import (
+    Congress,
+    CongressMaster,
+    Event,
+    EventEntry,
+    EventEntryPlayer,
+    Session as EventSession,
+)
+from notifications.models import InAppNotification, RealtimeNotification
+from organisations.models import (
+    MemberClubDetails,
+    MemberMembershipType,
+    MembershipType,
+    Organisation,
+)
+from organisations.views.admin import add_club_defaults
+from payments.models import MemberTransaction, OrgPaymentMethod, generate_reference_no
+
+BENCHMARK_SYSTEM_NUMBER_START = 9_000_000
+""" benchmark users have system numbers from here up """
+
+BENCHMARK_ORG_ID_PREFIX = "Z"
+""" benchmark clubs have org_ids Z000 to Z999 """
+
+BENCHMARK_CONGRESS_PREFIX = "Benchmark Congress"
+
+BATCH_SIZE = 2000
+
+# fmt: off
+FIRST_NAMES = [
+    "Alan", "Betty", "Colin", "Dianne", "Edward", "Fiona", "Graham", "Helen",
+    "Ian", "Julie", "Keith", "Linda", "Mark", "Nora", "Owen", "Pauline",
+    "Quentin", "Rose", "Stephen", "Tracey", "Ursula", "Victor", "Wendy", "Yvonne",
+]
+
+LAST_NAMES = [
+    "Anderson", "Brown", "Chen", "Davies", "Evans", "Fraser", "Green", "Harris",
+    "Ivanov", "Jones", "King", "Lee", "Morris", "Nguyen", "O'Brien", "Patel",
+    "Quinn", "Roberts", "Smith", "Taylor", "Underwood", "Varga", "Wilson", "Young",
+]
+
+# added to LAST_NAMES for the name search users, so there are a few hundred surnames
+# rather than 24. The blanks keep the plain names the most common, like Smith.
+LAST_NAME_ENDINGS = [
+    "", "", "", "", "son", "ley", "ton", "ford", "wood", "ski",
+    "ell", "ini", "berg", "field", "er", "ova", "ham", "well",
+]
+# fmt: on
+
+
+class Command(BaseCommand):
+    help = "Create a large synthetic data set for run_benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=30_000)
+        parser.add_argument("--clubs", type=int, default=300)
+        parser.add_argument(
+            "--members", type=int, default=1500, help="Members for the largest club"
+        )
+        parser.add_argument("--congresses", type=int, default=5)
+        parser.add_argument("--events", type=int, default=6, help="Per congress")
+        parser.add_argument("--entries", type=int, default=200, help="Per event")
+        parser.add_argument(
+            "--ledger-users",
+            type=int,
+            default=20,
+            help="Users to give long ledgers to",
+        )
+        parser.add_argument(
+            "--ledger", type=int, default=5_000, help="Transactions per ledger user"
+        )
+        parser.add_argument("--sessions", type=int, default=20, help="For club Z000")
+        parser.add_argument("--session-size", type=int, default=120)
+        parser.add_argument(
+            "--search-users",
+            type=int,
+            default=300_000,
+            help="Extra users with varied names for the name search",
+        )
+        parser.add_argument(
+            "--unregistered",
+            type=int,
+            default=50_000,
+            help="Unregistered users for the name search",
+        )
+        parser.add_argument(
+            "--notifications",
+            type=int,
+            default=500_000,
+            help="In app notifications, spread over users and the last six months",
+        )
+        parser.add_argument(
+            "--realtime-notifications",
+            type=int,
+            default=2_000,
+            help="App messages for the first user",
+        )
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+
+        if COBALT_HOSTNAME in ["myabf.com.au", "www.myabf.com.au"]:
+            raise SuspiciousOperation(
+                "Not for use in production. This cannot be used in a production system."
+            )
+
+        if User.objects.filter(system_number=BENCHMARK_SYSTEM_NUMBER_START).exists():
+            raise CommandError("Benchmark data has already been loaded")
+
+        if not 1 <= options["clubs"] <= 1000:
+            raise CommandError("--clubs must be between 1 and 1000")
+
+        random.seed(options["seed"])
+
+        users = self.add_users(options["users"])
+        clubs = self.add_clubs(users, options["clubs"])
+        self.add_members(users, clubs, options["members"])
+        self.add_ledgers(users[: options["ledger_users"]], clubs[0], options["ledger"])
+        self.add_congresses(
+            users,
+            clubs[0],
+            options["congresses"],
+            options["events"],
+            options["entries"],
+        )
+        self.add_sessions(users, clubs[0], options["sessions"], options["session_size"])
+        self.add_notifications(
+            users, options["notifications"], options["realtime_notifications"]
+        )
+        self.add_search_users(
+            BENCHMARK_SYSTEM_NUMBER_START + options["users"],
+            options["search_users"],
+            options["unregistered"],
+            users[0],
+        )
+
+        self.stdout.write(self.style.SUCCESS("Benchmark data loaded"))
+
+    def add_users(self, count):
+        """Users, all with the same password (hashing is slow)"""
+
+        self.stdout.write(f"Adding {count} users")
+
+        password = make_password("F1shcake")
+
+        User.objects.bulk_create(
+            [
+                User(
+                    username=f"{BENCHMARK_SYSTEM_NUMBER_START + i}",
+                    email="success@simulator.amazonses.com",
+                    password=password,
+                    first_name=random.choice(FIRST_NAMES),
+                    last_name=random.choice(LAST_NAMES),
+                    system_number=BENCHMARK_SYSTEM_NUMBER_START + i,
+                    about="",
+                )
+                for i in range(count)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+        return list(
+            User.objects.filter(
+                system_number__gte=BENCHMARK_SYSTEM_NUMBER_START
+            ).order_by("system_number")
+        )
+
+    def add_notifications(self, users, count, realtime_count):
+        """In app notifications for everyone, about half older than the three months
+        delete_old_in_app_notifications keeps. App messages for the first user."""
+
+        self.stdout.write(
+            f"Adding {count} in app notifications and {realtime_count} app messages"
+        )
+
+        now = timezone.now()
+
+        InAppNotification.objects.bulk_create(
+            [
+                InAppNotification(
+                    member=random.choice(users),
+                    message=f"Benchmark notification {i}",
+                    acknowledged=random.random() < 0.8,
+                    created_date=now
+                    - datetime.timedelta(minutes=random.randint(0, 60 * 24 * 182)),
+                )
+                for i in range(count)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+        RealtimeNotification.objects.bulk_create(
+            [
+                RealtimeNotification(
+                    member=users[0],
+                    admin=users[1],
+                    msg=f"Benchmark message {i}",
+                    status=True,
+                    has_been_read=random.random() < 0.5,
+                )
+                for i in range(realtime_count)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+    def add_search_users(self, start, count, unregistered, added_by):
+        """Lots of users and unregistered users with a spread of names, so the name
+        search is run against a realistic size and mix. Not members of anything."""
+
+        self.stdout.write(
+            f"Adding {count} users and {unregistered} unregistered users for search"
+        )
+
+        password = make_password("F1shcake")
+
+        def _last_name():
+            return f"{random.choice(LAST_NAMES)}{random.choice(LAST_NAME_ENDINGS)}"
+
+        User.objects.bulk_create(
+            [
+                User(
+                    username=f"{start + i}",
+                    email="success@simulator.amazonses.com",
+                    password=password,
+                    first_name=random.choice(FIRST_NAMES),
+                    last_name=_last_name(),
+                    system_number=start + i,
+                    about="",
+                )
+                for i in range(count)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+        UnregisteredUser.objects.bulk_create(
+            [
+                UnregisteredUser(
+                    system_number=start + count + i,
+                    first_name=random.choice(FIRST_NAMES),
+                    last_name=_last_name(),
+                    origin="Manual",
+                    last_updated_by=added_by,
+                )
+                for i in range(unregistered)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+    def add_clubs(self, users, count):
+        """Clubs, set up as if from the UI. Club sizes fall away from the first"""
+
+        self.stdout.write(f"Adding {count} clubs")
+
+        clubs = []
+
+        for i in range(count):
+            club = Organisation(
+                org_id=f"{BENCHMARK_ORG_ID_PREFIX}{i:03d}",
+                name=f"Benchmark Club {i}",
+                secretary=users[i],
+                type="Club",
+                club_email="success@simulator.amazonses.com",
+                address1="1 Benchmark Street",
+                suburb="Suburb",
+                state="ACT",
+                postcode="2600",
+                full_club_admin=True,
+            )
+            club.save()
+            add_club_defaults(club)
+            clubs.append(club)
+
+        return clubs
+
+    def add_members(self, users, clubs, largest):
+        """Members for every club. Mostly current and paid, some due, some lapsed"""
+
+        today = timezone.now().date()
+        start_date = today.replace(month=1, day=1)
+        end_date = today.replace(month=12, day=31)
+
+        for club_no, club in enumerate(clubs):
+
+            size = max(10, largest // (1 + club_no // 10))
+            members = random.sample(users, min(size, len(users)))
+
+            self.stdout.write(f"Adding {len(members)} members to {club}")
+
+            membership_type = MembershipType.objects.get(
+                organisation=club, name="Standard"
+            )
+
+            memberships = []
+            for member in members:
+                state = random.choices(
+                    [
+                        MemberMembershipType.MEMBERSHIP_STATE_CURRENT,
+                        MemberMembershipType.MEMBERSHIP_STATE_DUE,
+                        MemberMembershipType.MEMBERSHIP_STATE_LAPSED,
+                    ],
+                    weights=[80, 15, 5],
+                )[0]
+                is_paid = state == MemberMembershipType.MEMBERSHIP_STATE_CURRENT
+                memberships.append(
+                    MemberMembershipType(
+                        system_number=member.system_number,
+                        membership_type=membership_type,
+                        start_date=start_date,
+                        end_date=end_date,
+                        due_date=today + datetime.timedelta(days=30),
+                        fee=membership_type.annual_fee,
+                        is_paid=is_paid,
+                        paid_date=start_date if is_paid else None,
+                        paid_until_date=end_date if is_paid else None,
+                        membership_state=state,
+                        last_modified_by=club.secretary,
+                    )
+                )
+
+            memberships = MemberMembershipType.objects.bulk_create(
+                memberships, batch_size=BATCH_SIZE
+            )
+
+            MemberClubDetails.objects.bulk_create(
+                [
+                    MemberClubDetails(
+                        club=club,
+                        system_number=membership.system_number,
+                        latest_membership=membership,
+                        membership_status=membership.membership_state,
+                        joined_date=start_date,
+                    )
+                    for membership in memberships
+                ],
+                batch_size=BATCH_SIZE,
+            )
+
+    def add_ledgers(self, users, club, length):
+        """Long statements for a few users"""
+
+        start = timezone.now() - datetime.timedelta(days=length)
+
+        for user in users:
+
+            self.stdout.write(f"Adding {length} transactions for {user}")
+
+            balance = 0
+            transactions = []
+            for i in range(length):
+                amount = 100 if i % 10 == 0 else -10
+                balance += amount
+                transactions.append(
+                    MemberTransaction(
+                        member=user,
+                        organisation=club,
+                        created_date=start + datetime.timedelta(days=i),
+                        amount=amount,
+                        balance=balance,
+                        description="Benchmark transaction",
+                        reference_no=generate_reference_no(),
+                        type="Club Top Up" if amount > 0 else "Club Payment",
+                    )
+                )
+
+            MemberTransaction.objects.bulk_create(transactions, batch_size=BATCH_SIZE)
+
+    def add_congresses(self, users, club, count, events, entries):
+        """Published congresses with lots of pairs entries"""
+
+        today = timezone.now().date()
+        congress_master = CongressMaster.objects.create(
+            name="Benchmark Congress Master", org=club
+        )
+
+        for congress_no in range(count):
+
+            self.stdout.write(
+                f"Adding congress {congress_no} with {events} events of {entries} entries"
+            )
+
+            start_date = today + datetime.timedelta(days=30 + congress_no * 7)
+            congress = Congress.objects.create(
+                name=f"{BENCHMARK_CONGRESS_PREFIX} {congress_no}",
+                congress_master=congress_master,
+                start_date=start_date,
+                end_date=start_date + datetime.timedelta(days=2),
+                year=start_date.year,
+                status="Published",
+                author=club.secretary,
+                last_updated_by=club.secretary,
+                entry_open_date=today,
+                entry_close_date=start_date,
+            )
+
+            for event_no in range(events):
+                event = Event.objects.create(
+                    congress=congress,
+                    event_name=f"Pairs Event {event_no}",
+                    event_type="Open",
+                    player_format="Pairs",
+                    entry_fee=50,
+                    entry_open_date=today,
+                    entry_close_date=start_date,
+                )
+                EventSession.objects.create(
+                    event=event,
+                    session_date=start_date + datetime.timedelta(days=event_no % 3),
+                    session_start=datetime.time(10, 0),
+                )
+
+                entrants = random.sample(users, min(entries * 2, len(users)))
+                event_entries = EventEntry.objects.bulk_create(
+                    [
+                        EventEntry(
+                            event=event,
+                            primary_entrant=entrants[i * 2],
+                            entry_status=EventEntry.EntryStatus.COMPLETE,
+                        )
+                        for i in range(len(entrants) // 2)
+                    ]
+                )
+
+                EventEntryPlayer.objects.bulk_create(
+                    [
+                        EventEntryPlayer(
+                            event_entry=event_entry,
+                            player=entrants[i * 2 + seat],
+                            entry_fee=25,
+                            payment_received=25,
+                            payment_status="Paid",
+                            payment_type="my-system-dollars",
+                        )
+                        for i, event_entry in enumerate(event_entries)
+                        for seat in range(2)
+                    ],
+                    batch_size=BATCH_SIZE,
+                )
+
+    def add_sessions(self, users, club, count, size):
+        """Club sessions with a full room of players"""
+
+        session_type = SessionType.objects.filter(organisation=club).first()
+        payment_method = OrgPaymentMethod.objects.filter(
+            organisation=club, payment_method="Bridge Credits"
+        ).first()
+
+        for session_no in range(count):
+
+            self.stdout.write(f"Adding session {session_no} with {size} players")
+
+            session = Session.objects.create(
+                director=club.secretary,
+                session_type=session_type,
+                session_date=timezone.now().date()
+                - datetime.timedelta(days=session_no),
+                description=f"Benchmark Session {session_no}",
+            )
+
+            players = random.sample(users, min(size, len(users)))
+
+            SessionEntry.objects.bulk_create(
+                [
+                    SessionEntry(
+                        session=session,
+                        system_number=player.system_number,
+                        pair_team_number=i // 4 + 1,
+                        seat="NSEW"[i % 4],
+                        seat_number_internal=i % 4,
+                        payment_method=payment_method,
+                        fee=10,
+                        player_name_from_file=player.full_name,
+                    )
+                    for i, player in enumerate(players)
+                ],
+                batch_size=BATCH_SIZE,
+            )
@@ -0,0 +1,354 @@
+""" Query count and timing benchmarks for key views and functions
+
+    Run add_benchmark_data first to load a large data set (with the default sizes), then:
+
+        ./manage.py run_benchmarks --save-baselines     # record timings on this machine
+        ./manage.py run_benchmarks                      # check against the budgets and timings
+
+    The command fails (non-zero exit) if any benchmark uses more queries than its budget
+    in QUERY_BUDGETS or takes more than --time-factor times as long as its saved timing.
+    A benchmark with no budget or no saved timing is also a failure.
+
+    Query counts are the thing to watch, a view going from 5 queries to 500 is a
+    regression whatever the machine, so the budgets are kept here and changed in code
+    review. Timings depend on the machine, so they are saved locally in
+    BENCHMARK_BASELINES and compared loosely. Use --skip-timings where there are none.
+"""
+import datetime
+import json
+import os
+import time
+
+from dateutil.relativedelta import relativedelta
+from django import forms
+from django.core.exceptions import SuspiciousOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Subquery
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User, UnregisteredUser
+from accounts.search import search_by_name
+from club_sessions.models import Session
+from cobalt.settings import COBALT_HOSTNAME
+from events.models import Congress
+from notifications.apis import _notifications_api_common_messages_for_user_v1
+from notifications.management.commands.delete_old_in_app_notifications import (
+    delete_in_app_notifications_before,
+)
+from notifications.models import RealtimeNotification
+from organisations.club_admin_core import get_club_members, get_outstanding_memberships
+from organisations.models import Organisation
+from payments.views.core import statement_common
+from rbac.core import rbac_user_has_role
+from tests.management.commands.add_benchmark_data import (
+    BENCHMARK_CONGRESS_PREFIX,
+    BENCHMARK_ORG_ID_PREFIX,
+    BENCHMARK_SYSTEM_NUMBER_START,
+)
+from utils.templatetags.cobalt_tags import cobalt_bs4_field
+
+BENCHMARK_BASELINES = "tests/benchmarks/baselines.json"
+""" timings saved by --save-baselines, for this machine only """
+
+
+class BenchmarkData:
+    """The objects the benchmarks run against, from add_benchmark_data"""
+
+    def __init__(self):
+        self.club = Organisation.objects.filter(
+            org_id=f"{BENCHMARK_ORG_ID_PREFIX}000"
+        ).first()
+
+        if not self.club:
+            raise CommandError("No benchmark data, run add_benchmark_data first")
+
+        # first user has a long ledger and is the club secretary
+        self.user = User.objects.get(system_number=BENCHMARK_SYSTEM_NUMBER_START)
+        self.other_user = User.objects.filter(
+            system_number__gte=BENCHMARK_SYSTEM_NUMBER_START
+        ).last()
+        self.congress = Congress.objects.filter(
+            name__startswith=BENCHMARK_CONGRESS_PREFIX
+        ).first()
+        self.session = Session.objects.filter(
+            session_type__organisation=self.club
+        ).first()
+
+        self.client = Client()
+        self.client.force_login(self.user)
+
+
+def _check_response(response):
+    if response.status_code != 200:
+        raise CommandError(f"Got status {response.status_code} from {response}")
+
+
+def benchmark_get_club_members(data):
+    get_club_members(data.club)
+
+
+def benchmark_get_outstanding_memberships(data):
+    # first page, as view_unpaid_htmx shows it
+    memberships, _ = get_outstanding_memberships(data.club)
+    list(memberships[:30])
+
+
+def benchmark_statement_common(data):
+    statement_common(data.user)
+
+
+def benchmark_view_congress(data):
+    _check_response(
+        data.client.get(
+            reverse("events:view_congress", kwargs={"congress_id": data.congress.id})
+        )
+    )
+
+
+def benchmark_tab_session_htmx(data):
+    _check_response(
+        data.client.post(
+            reverse("club_sessions:tab_session_htmx"),
+            {"club_id": data.club.id, "session_id": data.session.id},
+        )
+    )
+
+
+def benchmark_rbac_user_has_role(data):
+    rbac_user_has_role(data.user, f"club_sessions.sessions.{data.club.id}.edit")
+
+
+def benchmark_rbac_user_has_role_no_access(data):
+    rbac_user_has_role(data.other_user, f"club_sessions.sessions.{data.club.id}.edit")
+
+
+def benchmark_search_by_name_common(data):
+    # start of a common surname, lots of matches to rank
+    search_by_name(User.objects.all(), last_name="Smi")
+
+
+def benchmark_search_by_name_full_name(data):
+    search_by_name(User.objects.all(), first_name="Hel", last_name="Harr")
+
+
+def benchmark_search_by_name_unregistered(data):
+    search_by_name(UnregisteredUser.objects.all(), last_name="Ngu")
+
+
+def benchmark_member_search_ajax(data):
+    _check_response(
+        data.client.get(reverse("accounts:member_search_M2M_ajax"), {"lastname": "Wil"})
+    )
+
+
+def benchmark_system_number_search_htmx(data):
+    _check_response(
+        data.client.post(
+            reverse("accounts:system_number_search_htmx"),
+            {"system_number": data.other_user.system_number},
+        )
+    )
+
+
+def benchmark_latest_messages_for_user(data):
+    # make the 50 most recent unread, then get them, which marks them as read
+    latest = RealtimeNotification.objects.filter(member=data.user).order_by("-pk")
+    RealtimeNotification.objects.filter(
+        pk__in=Subquery(latest.values("pk")[:50])
+    ).update(has_been_read=False)
+    _notifications_api_common_messages_for_user_v1(latest[:50])
+
+
+def benchmark_delete_old_in_app_notifications(data):
+    # roll back so every run has the same amount to delete
+    with transaction.atomic():
+        delete_in_app_notifications_before(timezone.now() - relativedelta(months=3))
+        transaction.set_rollback(True)
+
+
+class _BenchmarkFieldsForm(forms.Form):
+    """One of each of the usual field types"""
+
+    name = forms.CharField()
+    amount = forms.DecimalField()
+    payment_method = forms.ChoiceField(
+        choices=[("Bridge Credits", "Bridge Credits"), ("Cash", "Cash")]
+    )
+    paid = forms.BooleanField(required=False)
+    start_date = forms.DateField(
+        widget=forms.DateInput(attrs={"type": "date"}),
+        initial=datetime.date(2024, 1, 1),
+    )
+
+
+_BenchmarkFieldsFormSet = forms.formset_factory(_BenchmarkFieldsForm, extra=100)
+
+
+def benchmark_render_500_fields(data):
+    # formset of 100 forms with 5 fields, like a big session payment table
+    formset = _BenchmarkFieldsFormSet()
+    for form in formset:
+        for field in form:
+            cobalt_bs4_field(field)
+
+
+BENCHMARKS = [
+    benchmark_get_club_members,
+    benchmark_get_outstanding_memberships,
+    benchmark_statement_common,
+    benchmark_view_congress,
+    benchmark_tab_session_htmx,
+    benchmark_rbac_user_has_role,
+    benchmark_rbac_user_has_role_no_access,
+    benchmark_search_by_name_common,
+    benchmark_search_by_name_full_name,
+    benchmark_search_by_name_unregistered,
+    benchmark_member_search_ajax,
+    benchmark_system_number_search_htmx,
+    benchmark_render_500_fields,
+    benchmark_latest_messages_for_user,
+    benchmark_delete_old_in_app_notifications,
+]
+
+
+QUERY_BUDGETS = {
+    "get_club_members": 10,
+    "get_outstanding_memberships": 5,
+    "statement_common": 10,
+    "view_congress": 40,
+    "tab_session_htmx": 60,
+    "rbac_user_has_role": 3,
+    "rbac_user_has_role_no_access": 3,
+    "search_by_name_common": 1,
+    "search_by_name_full_name": 1,
+    "search_by_name_unregistered": 1,
+    "member_search_ajax": 15,
+    "system_number_search_htmx": 15,
+    "render_500_fields": 0,
+    "latest_messages_for_user": 5,
+    # about 50 chunks of 5000 with the default data, two queries each
+    "delete_old_in_app_notifications": 110,
+}
+""" most queries each benchmark may use (after caches are warm) """
+
+
+def run_benchmark(benchmark, data, repeat):
+    """Run a benchmark repeat times. Returns the query count from the last run
+    (after any caches are warm) and the fastest time"""
+
+    queries = 0
+    best_time = None
+
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start_time = time.perf_counter()
+            benchmark(data)
+            elapsed = time.perf_counter() - start_time
+
+        queries = len(context.captured_queries)
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+
+    return queries, best_time
+
+
+class Command(BaseCommand):
+    help = "Run the query count and timing benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--save-baselines",
+            action="store_true",
+            help=f"Save the timings as the new baselines in {BENCHMARK_BASELINES}",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--time-factor",
+            type=float,
+            default=2.0,
+            help="Allowed multiple of the baseline time (default 2)",
+        )
+        parser.add_argument(
+            "--skip-timings",
+            action="store_true",
+            help="Only check query counts, e.g. on a machine with no saved timings",
+        )
+        parser.add_argument("--only", help="Only run benchmarks containing this")
+
+    def handle(self, *args, **options):
+
+        if COBALT_HOSTNAME in ["myabf.com.au", "www.myabf.com.au"]:
+            raise SuspiciousOperation(
+                "Not for use in production. This cannot be used in a production system."
+            )
+
+        unbudgeted = [
+            benchmark.__name__
+            for benchmark in BENCHMARKS
+            if benchmark.__name__.replace("benchmark_", "") not in QUERY_BUDGETS
+        ]
+        if unbudgeted:
+            raise CommandError(
+                f"No query budget in QUERY_BUDGETS for {', '.join(unbudgeted)}"
+            )
+
+        check_timings = not options["save_baselines"] and not options["skip_timings"]
+
+        baselines = {}
+        if os.path.exists(BENCHMARK_BASELINES):
+            with open(BENCHMARK_BASELINES) as baseline_file:
+                baselines = json.load(baseline_file)
+        elif check_timings:
+            raise CommandError(
+                f"No timings found in {BENCHMARK_BASELINES}, run with --save-baselines or --skip-timings"
+            )
+
+        data = BenchmarkData()
+
+        results = {}
+        regressions = []
+
+        for benchmark in BENCHMARKS:
+
+            name = benchmark.__name__.replace("benchmark_", "")
+            if options["only"] and options["only"] not in name:
+                continue
+
+            queries, seconds = run_benchmark(benchmark, data, options["repeat"])
+            results[name] = {"seconds": round(seconds, 4)}
+
+            budget = QUERY_BUDGETS[name]
+            line = f"{name:40} {queries:6} queries (budget {budget}) {seconds:8.3f}s"
+
+            if queries > budget:
+                regressions.append(f"{name}: {queries} queries, budget {budget}")
+
+            if check_timings:
+                baseline = baselines.get(name)
+                if not baseline:
+                    regressions.append(f"{name}: no saved timing")
+                else:
+                    line += f"   (baseline {baseline['seconds']:.3f}s)"
+                    if seconds > baseline["seconds"] * options["time_factor"]:
+                        regressions.append(
+                            f"{name}: {seconds:.3f}s, baseline {baseline['seconds']:.3f}s"
+                        )
+
+            self.stdout.write(line)
+
+        if options["save_baselines"]:
+            os.makedirs(os.path.dirname(BENCHMARK_BASELINES), exist_ok=True)
+            with open(BENCHMARK_BASELINES, "w") as baseline_file:
+                json.dump({**baselines, **results}, baseline_file, indent=4)
+            self.stdout.write(self.style.SUCCESS(f"Saved {BENCHMARK_BASELINES}"))
+
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            raise CommandError(f"{len(regressions)} benchmarks have regressed")
+
+        self.stdout.write(self.style.SUCCESS("No regressions"))
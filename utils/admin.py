@@ -1,8 +1,28 @@
 """ Generated by utils/cgit/cgit_util_generate_admin_file on 2022-01-24 14:40:23.466006 """
 
 from django.contrib import admin
-from .models import Batch, Lock, Slug
+from .models import Batch, Job, Lock, Slug, StatisticsSnapshot, ViewProfile
+
+
+class JobAdmin(admin.ModelAdmin):
+    """Admin class for model Job"""
+
+    list_display = ("function", "status", "priority", "attempts", "created_time")
+    list_filter = ("status", "function")
+    search_fields = ("function",)
+
+
+class ViewProfileAdmin(admin.ModelAdmin):
+    """Admin class for model ViewProfile"""
+
+    list_display = ("view_name", "date", "requests", "queries")
+    list_filter = ("date",)
+    search_fields = ("view_name",)
+
 
 admin.site.register(Batch)
+admin.site.register(Job, JobAdmin)
 admin.site.register(Lock)
 admin.site.register(Slug)
+admin.site.register(StatisticsSnapshot)
+admin.site.register(ViewProfile, ViewProfileAdmin)
@@ -0,0 +1,135 @@
+"""
+Run jobs from the database job queue (see utils/views/cobalt_jobs.py)
+
+Designed to be started by cron every minute with a --max-time a little under a minute,
+so there is always a pool of workers running on each node. Workers poll the queue and
+exit once they have been running for --max-time seconds.
+
+A node runs at most --workers workers however many cron runs overlap. Each worker takes
+one of --workers slot locks and exits straight away if they are all taken. A worker only
+checks the time between jobs, so a long job keeps its slot past --max-time, but the
+other slots are free for the next cron run to use.
+"""
+
+from multiprocessing import get_context
+import fcntl
+import logging
+import os
+import tempfile
+import time
+
+from django import db
+from django.core.management.base import BaseCommand
+
+from utils.views.cobalt_buffer import flush_all_buffers
+from utils.views.cobalt_jobs import claim_job, run_job, requeue_stale_jobs
+
+logger = logging.getLogger("cobalt")
+
+WORKER_LOCK_FILE = os.path.join(tempfile.gettempdir(), "run_cobalt_jobs.{slot}.lock")
+
+
+def get_worker_lock(slots):
+    """Lock the first free one of slots WORKER_LOCK_FILEs, so no more than slots workers
+    run on this node at once.
+
+    The OS drops the lock however the worker exits. Returns the open file, or None if
+    every slot is taken.
+    """
+
+    for slot in range(slots):
+        lock_file = open(WORKER_LOCK_FILE.format(slot=slot), "w")
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+
+        return lock_file
+
+    return None
+
+
+def worker_loop(max_time, poll_interval, slots):
+    """Run jobs until we have used up our time. Returns number of jobs run"""
+
+    worker_lock = get_worker_lock(slots)
+    if not worker_lock:
+        return 0
+
+    # Each worker needs its own database connection
+    db.connections.close_all()
+
+    end_time = time.monotonic() + max_time
+    jobs_run = 0
+
+    while time.monotonic() < end_time:
+
+        job = claim_job()
+
+        if not job:
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"Job {job.pk} {job.function} starting attempt {job.attempts}")
+        start_time = time.perf_counter()
+
+        run_job(job)
+        jobs_run += 1
+
+        # pool workers don't run atexit handlers
+        flush_all_buffers()
+
+        logger.info(
+            f"Job {job.pk} {job.function} {job.get_status_display()} in "
+            f"{time.perf_counter() - start_time:.2f}s"
+        )
+
+    db.connections.close_all()
+    worker_lock.close()
+
+    return jobs_run
+
+
+class Command(BaseCommand):
+    help = "Run jobs from the database job queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="Number of worker processes (default 2)",
+        )
+        parser.add_argument(
+            "--max-time",
+            type=int,
+            default=55,
+            help="Seconds to run for before exiting (default 55)",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when the queue is empty (default 1)",
+        )
+
+    def handle(self, *args, **options):
+
+        stale = requeue_stale_jobs()
+        if stale:
+            logger.warning(f"Requeued {stale} stale jobs")
+
+        workers = max(1, options["workers"])
+        worker_args = (options["max_time"], options["poll_interval"], workers)
+
+        if workers == 1:
+            jobs_run = worker_loop(*worker_args)
+        else:
+            db.connections.close_all()
+            with get_context("fork").Pool(processes=workers) as pool:
+                jobs_run = sum(pool.starmap(worker_loop, [worker_args] * workers))
+
+        if jobs_run:
+            logger.info(f"run_cobalt_jobs ran {jobs_run} jobs with {workers} workers")
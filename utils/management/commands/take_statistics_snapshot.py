@@ -0,0 +1,32 @@
+"""
+Calculate the system statistics and save them for the statistics page
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from utils.views.cobalt_lock import CobaltLock
+from utils.views.monitoring import take_statistics_snapshot
+
+logger = logging.getLogger("cobalt")
+
+
+class Command(BaseCommand):
+    help = "Calculate the system statistics and save them for the statistics page"
+
+    def handle(self, *args, **options):
+
+        # Only one node needs to do this
+        statistics_lock = CobaltLock("statistics_snapshot", expiry=10)
+        if not statistics_lock.get_lock():
+            logger.info("Statistics snapshot already running (locked), exiting")
+            return
+
+        snapshot = take_statistics_snapshot()
+
+        statistics_lock.free_lock()
+
+        logger.info(
+            f"Statistics snapshot {snapshot.id} took {snapshot.elapsed_seconds:.1f}s"
+        )
@@ -1,12 +1,20 @@
-from accounts.models import User
+import random
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
 from django.utils import timezone
 
+from accounts.models import User
+from cobalt.settings import SQL_PROFILING_SAMPLE_RATE
+from utils.views.sql_profiling import QueryRecorder, record_request
+
 
 class CobaltMiddleware(object):
-    """ custom middleware to add last activity time to user object.
+    """custom middleware to add last activity time to user object.
 
-        If you are here to switch this off to improve performance then
-        I apologise. It seemed like a good idea at the time!
+    If you are here to switch this off to improve performance then
+    I apologise. It seemed like a good idea at the time!
 
     """
 
@@ -21,3 +29,41 @@ class CobaltMiddleware(object):
             request.user.last_activity = timezone.now()
             request.user.save()
         return None
+
+
+class SqlProfilingMiddleware:
+    """Sampled per-view profiling of query counts and timings.
+
+    Off unless SQL_PROFILING_SAMPLE_RATE is set, e.g. 0.05 to measure 5% of requests.
+    Should be first in MIDDLEWARE so the timings include the other middleware.
+    See utils/views/sql_profiling.py for where the results go.
+    """
+
+    def __init__(self, get_response):
+        if not SQL_PROFILING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        if random.random() >= SQL_PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start_time = time.perf_counter()
+
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        total_seconds = time.perf_counter() - start_time
+
+        # no resolver_match for 404s
+        if request.resolver_match:
+            record_request(
+                request.resolver_match.view_name or request.resolver_match._func_path,
+                recorder,
+                total_seconds,
+            )
+
+        return response
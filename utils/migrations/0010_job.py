@@ -0,0 +1,99 @@
+# Generated by Django 3.2.15 on 2026-10-19 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("utils", "0009_slug_owner"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("function", models.CharField(max_length=200, verbose_name="Function")),
+                (
+                    "kwargs",
+                    models.JSONField(
+                        blank=True, default=dict, verbose_name="Arguments"
+                    ),
+                ),
+                ("priority", models.IntegerField(default=5, verbose_name="Priority")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("QUE", "Queued"),
+                            ("RUN", "Running"),
+                            ("SUC", "Success"),
+                            ("FAI", "Failed"),
+                        ],
+                        default="QUE",
+                        max_length=3,
+                        verbose_name="Status",
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0, verbose_name="Attempts")),
+                (
+                    "max_attempts",
+                    models.IntegerField(default=3, verbose_name="Maximum Attempts"),
+                ),
+                (
+                    "created_time",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Created Time"
+                    ),
+                ),
+                (
+                    "run_after",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Run After"
+                    ),
+                ),
+                (
+                    "start_time",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Start Time"
+                    ),
+                ),
+                (
+                    "end_time",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="End Time"
+                    ),
+                ),
+                (
+                    "node",
+                    models.CharField(
+                        blank=True,
+                        max_length=50,
+                        null=True,
+                        verbose_name="Node running job",
+                    ),
+                ),
+                (
+                    "last_error",
+                    models.TextField(blank=True, null=True, verbose_name="Last Error"),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="job",
+            index=models.Index(
+                fields=["status", "-priority", "run_after"],
+                name="utils_job_claim_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.15 on 2026-10-19 10:05
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("utils", "0010_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatisticsSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_time",
+                    models.DateTimeField(
+                        db_index=True,
+                        default=django.utils.timezone.now,
+                        verbose_name="Created Time",
+                    ),
+                ),
+                (
+                    "elapsed_seconds",
+                    models.FloatField(default=0, verbose_name="Time Taken"),
+                ),
+                (
+                    "statistics",
+                    models.JSONField(
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        verbose_name="Statistics",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.15 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("utils", "0011_statisticssnapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="progress",
+            field=models.CharField(
+                blank=True, max_length=200, null=True, verbose_name="Progress"
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.15 on 2026-10-19 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("utils", "0012_job_progress"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ViewProfile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("view_name", models.CharField(max_length=200, verbose_name="View")),
+                ("date", models.DateField(verbose_name="Date")),
+                ("requests", models.IntegerField(default=0, verbose_name="Requests")),
+                ("queries", models.IntegerField(default=0, verbose_name="Queries")),
+                (
+                    "max_queries",
+                    models.IntegerField(default=0, verbose_name="Most Queries"),
+                ),
+                (
+                    "duplicate_queries",
+                    models.IntegerField(default=0, verbose_name="Duplicate Queries"),
+                ),
+                ("sql_seconds", models.FloatField(default=0, verbose_name="SQL Time")),
+                (
+                    "total_seconds",
+                    models.FloatField(default=0, verbose_name="Total Time"),
+                ),
+                ("max_seconds", models.FloatField(default=0, verbose_name="Slowest")),
+                (
+                    "latency_histogram",
+                    models.JSONField(default=list, verbose_name="Latency Histogram"),
+                ),
+            ],
+            options={
+                "unique_together": {("view_name", "date")},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("utils", "0013_viewprofile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="heartbeat_time",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Heartbeat"),
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    """Create the table for the database cache (see CACHES in settings). Does nothing
+    if it is already there"""
+
+    call_command("createcachetable")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("utils", "0014_job_heartbeat_time"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
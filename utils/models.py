@@ -7,6 +7,7 @@ import re
 from datetime import timedelta
 
 import pytz
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 from cobalt.settings import HOSTNAME, TIME_ZONE
@@ -57,6 +58,127 @@ class Lock(models.Model):
         return f"Locked - {self.topic} - Expires {local_dt:%d/%m/%Y %H:%M %Z}"
 
 
+class Job(models.Model):
+    """Background job waiting for, or run by, a worker. See utils/views/cobalt_jobs.py"""
+
+    STATUS_QUEUED = "QUE"
+    STATUS_RUNNING = "RUN"
+    STATUS_SUCCESS = "SUC"
+    STATUS_FAILED = "FAI"
+    STATUSES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCESS, "Success"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    PRIORITY_LOW = 0
+    PRIORITY_NORMAL = 5
+    PRIORITY_HIGH = 10
+
+    function = models.CharField("Function", max_length=200)
+    """ dotted path of a function decorated with @cobalt_job """
+    kwargs = models.JSONField("Arguments", default=dict, blank=True)
+    priority = models.IntegerField("Priority", default=PRIORITY_NORMAL)
+    """ higher numbers run first """
+    status = models.CharField(
+        "Status", choices=STATUSES, max_length=3, default=STATUS_QUEUED
+    )
+    attempts = models.IntegerField("Attempts", default=0)
+    max_attempts = models.IntegerField("Maximum Attempts", default=3)
+    created_time = models.DateTimeField("Created Time", default=timezone.now)
+    run_after = models.DateTimeField("Run After", default=timezone.now)
+    start_time = models.DateTimeField("Start Time", null=True, blank=True)
+    end_time = models.DateTimeField("End Time", null=True, blank=True)
+    node = models.CharField("Node running job", max_length=50, null=True, blank=True)
+    last_error = models.TextField("Last Error", null=True, blank=True)
+    progress = models.CharField("Progress", max_length=200, null=True, blank=True)
+    """ set by the running job through job_progress() """
+    heartbeat_time = models.DateTimeField("Heartbeat", null=True, blank=True)
+    """ updated by the worker every JOB_HEARTBEAT_SECONDS while the job is running """
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "-priority", "run_after"],
+                name="utils_job_claim_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.function} - {self.get_status_display()} - {self.created_time}"
+
+
+class StatisticsSnapshot(models.Model):
+    """System statistics as at a point in time. Written by the take_statistics_snapshot
+    command so the statistics page doesn't have to count the big tables itself"""
+
+    created_time = models.DateTimeField(
+        "Created Time", default=timezone.now, db_index=True
+    )
+    elapsed_seconds = models.FloatField("Time Taken", default=0)
+    statistics = models.JSONField("Statistics", encoder=DjangoJSONEncoder)
+    """ section name (e.g. "user_statistics") -> the dictionary from its get_*_statistics function """
+
+    def __str__(self):
+        return f"Statistics - {self.created_time}"
+
+
+class ViewProfile(models.Model):
+    """Daily totals for one view, from the requests sampled by SqlProfilingMiddleware.
+    One row per view per day, old days are removed (see utils/views/sql_profiling.py)"""
+
+    LATENCY_BUCKETS_MS = [25, 50, 100, 200, 400, 800, 1600, 3200, 6400]
+    """ upper limits of the latency histogram buckets, plus one for anything slower """
+
+    view_name = models.CharField("View", max_length=200)
+    date = models.DateField("Date")
+    requests = models.IntegerField("Requests", default=0)
+    queries = models.IntegerField("Queries", default=0)
+    max_queries = models.IntegerField("Most Queries", default=0)
+    duplicate_queries = models.IntegerField("Duplicate Queries", default=0)
+    """ queries whose SQL had already been run in the same request """
+    sql_seconds = models.FloatField("SQL Time", default=0)
+    total_seconds = models.FloatField("Total Time", default=0)
+    max_seconds = models.FloatField("Slowest", default=0)
+    latency_histogram = models.JSONField("Latency Histogram", default=list)
+    """ request counts for each of LATENCY_BUCKETS_MS and one more for slower """
+
+    class Meta:
+        unique_together = ("view_name", "date")
+
+    def __str__(self):
+        return f"{self.view_name} - {self.date}"
+
+    @property
+    def p95_ms(self):
+        """95th percentile latency, as the upper limit of its bucket (None if slower)"""
+
+        target = self.requests * 0.95
+        running = 0
+        for bucket, count in zip(self.LATENCY_BUCKETS_MS, self.latency_histogram):
+            running += count
+            if running >= target:
+                return bucket
+        return None
+
+    @property
+    def queries_per_request(self):
+        return self.queries / self.requests if self.requests else 0
+
+    @property
+    def duplicates_per_request(self):
+        return self.duplicate_queries / self.requests if self.requests else 0
+
+    @property
+    def average_ms(self):
+        return 1000 * self.total_seconds / self.requests if self.requests else 0
+
+    @property
+    def sql_percent(self):
+        return 100 * self.sql_seconds / self.total_seconds if self.total_seconds else 0
+
+
 class Seat(models.TextChoices):
     NORTH = "N", "North"
     SOUTH = "S", "South"
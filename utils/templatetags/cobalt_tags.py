@@ -1,3 +1,4 @@
+import functools
 import logging
 import pprint
 import random
@@ -250,6 +251,29 @@ def cobalt_dict_int_key(my_dict, my_keyname):
         return ""
 
 
+BS4_NO_LABEL_WIDGET_TYPES = ["summernoteinplace", "select"]
+""" widget types that cobalt_bs4_field doesn't show a label for """
+
+
+@functools.lru_cache(maxsize=None)
+def _bs4_field_template():
+    """The template for cobalt_bs4_field, loaded and compiled once per process"""
+
+    return get_template("utils/cobalt_bs4_field/bs4_field.html")
+
+
+def _bs4_widget_classes(widget, widget_type):
+    """The widget's own classes plus the Bootstrap one for its type"""
+
+    class_to_add = "form-check-input" if widget_type == "checkbox" else "form-control"
+    classes = widget.attrs.get("class", "").split()
+
+    if class_to_add not in classes:
+        classes.append(class_to_add)
+
+    return " ".join(classes)
+
+
 @register.simple_tag
 def cobalt_bs4_field(field, no_label=False):
     """Format a field for a standard Bootstrap 4 form element.
@@ -281,29 +305,17 @@ def cobalt_bs4_field(field, no_label=False):
             """
         )
 
-    # class to add depends on type of field
-    if field.widget_type == "checkbox":
-        class_to_add = " form-check-input"
-    else:
-        class_to_add = " form-control"
-
-    # Add our bootstrap class
-    field_classes = field.field.widget.attrs.get("class", "")
-    field_classes += class_to_add
-    field.field.widget.attrs["class"] = field_classes
+    widget_type = field.widget_type
 
     # See if we want a label
-    no_label_types = ["summernoteinplace", "select"]
-
     show_label = bool(
-        not no_label and field.label and field.widget_type not in no_label_types
+        not no_label and field.label and widget_type not in BS4_NO_LABEL_WIDGET_TYPES
     )
 
-    field_template = get_template("utils/cobalt_bs4_field/bs4_field.html")
-
     # Special handling for dates
     formatted_date = None
-    if field.widget_type == "date":
+    widget_html = None
+    if widget_type == "date":
 
         value = field.value()
         initial = field.initial
@@ -316,12 +328,22 @@ def cobalt_bs4_field(field, no_label=False):
             # no value so use initial
             formatted_date = initial.strftime("%Y-%m-%d")
 
-    return field_template.render(
+    else:
+        # Add our bootstrap class for this render only. Changing the widget's attrs
+        # would add it again every time the form is rendered
+        widget_html = field.as_widget(
+            attrs={"class": _bs4_widget_classes(field.field.widget, widget_type)}
+        )
+        if field.field.show_hidden_initial:
+            widget_html += field.as_hidden(only_initial=True)
+
+    return _bs4_field_template().render(
         {
             "field": field,
             "show_label": show_label,
-            "widget_type": field.widget_type,
+            "widget_type": widget_type,
             "formatted_date": formatted_date,
+            "widget_html": widget_html,
         }
     )
 
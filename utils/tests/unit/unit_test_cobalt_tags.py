@@ -0,0 +1,43 @@
+from django import forms
+
+from tests.test_manager import CobaltTestManagerUnit
+from utils.templatetags.cobalt_tags import cobalt_bs4_field
+
+
+class _FieldsForm(forms.Form):
+    name = forms.CharField(widget=forms.TextInput(attrs={"class": "name-field"}))
+    paid = forms.BooleanField(required=False)
+
+
+class CobaltTagsTests:
+    """Unit tests for the cobalt template tags"""
+
+    def __init__(self, manager: CobaltTestManagerUnit):
+        self.manager = manager
+
+    def cobalt_bs4_field(self):
+        """Rendering a field more than once should give the same html and not change the widget"""
+
+        form = _FieldsForm()
+
+        first = cobalt_bs4_field(form["name"])
+        second = cobalt_bs4_field(form["name"])
+
+        self.manager.save_results(
+            status=first == second
+            and 'class="name-field form-control"' in first
+            and form.fields["name"].widget.attrs["class"] == "name-field",
+            test_name="cobalt_bs4_field - render twice",
+            test_description="Render a text field twice. Should keep its own class, add form-control once and leave the widget alone",
+            output=f"First: {first}. Second: {second}. Widget attrs: {form.fields['name'].widget.attrs}",
+        )
+
+        checkbox = cobalt_bs4_field(form["paid"])
+
+        self.manager.save_results(
+            status='class="form-check-input"' in checkbox
+            and "form-control" not in checkbox,
+            test_name="cobalt_bs4_field - checkbox",
+            test_description="A checkbox should get form-check-input rather than form-control",
+            output=f"Got: {checkbox}",
+        )
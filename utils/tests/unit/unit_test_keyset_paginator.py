@@ -0,0 +1,72 @@
+from django.test import RequestFactory
+
+from accounts.models import User
+from tests.test_manager import CobaltTestManagerUnit
+from utils.utils import cobalt_keyset_paginator
+
+PAGE_SIZE = 3
+
+
+class KeysetPaginatorTests:
+    """Unit tests for cobalt_keyset_paginator"""
+
+    def __init__(self, manager: CobaltTestManagerUnit):
+        self.manager = manager
+
+    def keyset_paginator(self):
+        """Walk forwards then backwards through users, should see every user once in order"""
+
+        # last name isn't unique, so this also checks ties are handled by the pk
+        queryset = User.objects.order_by("-last_name")
+        expected = list(queryset.order_by("-last_name", "-pk"))
+
+        factory = RequestFactory()
+
+        # Forwards
+        forwards = []
+        page = cobalt_keyset_paginator(factory.get("/"), queryset, PAGE_SIZE)
+        forwards.extend(page)
+        while page.has_next:
+            page = cobalt_keyset_paginator(
+                factory.get("/", {"after": page.next_cursor}), queryset, PAGE_SIZE
+            )
+            forwards.extend(page)
+
+        self.manager.save_results(
+            status=forwards == expected,
+            test_name="Keyset paginator - forwards",
+            test_description=f"Page forwards through {len(expected)} users {PAGE_SIZE} at a time",
+            output=f"Expected {len(expected)} users in order, got {len(forwards)}. Match={forwards == expected}",
+        )
+
+        # Backwards from the last page
+        page = cobalt_keyset_paginator(
+            factory.get("/", {"last": 1}), queryset, PAGE_SIZE
+        )
+        backwards = list(page)
+        while page.has_previous:
+            page = cobalt_keyset_paginator(
+                factory.get("/", {"before": page.previous_cursor}),
+                queryset,
+                PAGE_SIZE,
+            )
+            backwards = list(page) + backwards
+
+        self.manager.save_results(
+            status=backwards == expected,
+            test_name="Keyset paginator - backwards",
+            test_description=f"Page backwards from the last page through {len(expected)} users",
+            output=f"Expected {len(expected)} users in order, got {len(backwards)}. Match={backwards == expected}",
+        )
+
+        # Bad cursor goes to the first page
+        page = cobalt_keyset_paginator(
+            factory.get("/", {"after": "rubbish"}), queryset, PAGE_SIZE
+        )
+
+        self.manager.save_results(
+            status=list(page) == expected[:PAGE_SIZE] and not page.has_previous,
+            test_name="Keyset paginator - bad cursor",
+            test_description="A cursor that has been tampered with should show the first page",
+            output=f"Got {list(page)}",
+        )
@@ -0,0 +1,48 @@
+from django.core.signals import request_finished
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from logs.models import Log
+from tests.test_manager import CobaltTestManagerUnit
+from utils.views.cobalt_buffer import CobaltWriteBuffer
+
+BUFFER_SIZE = 5
+SUB_SOURCE = "Write buffer test"
+
+
+class WriteBufferTests:
+    """Unit tests for CobaltWriteBuffer"""
+
+    def __init__(self, manager: CobaltTestManagerUnit):
+        self.manager = manager
+
+    def write_buffer(self):
+        """Rows from several requests are written together once the buffer is full"""
+
+        buffer = CobaltWriteBuffer(Log, max_size=BUFFER_SIZE, max_seconds=60)
+
+        with CaptureQueriesContext(connection) as context:
+
+            # One row per request, the end of a request shouldn't write anything
+            for count in range(BUFFER_SIZE - 1):
+                buffer.add(Log(source="Test", sub_source=SUB_SOURCE, message=count))
+                request_finished.send(sender=self.__class__)
+
+            written_early = Log.objects.filter(sub_source=SUB_SOURCE).count()
+
+            buffer.add(Log(source="Test", sub_source=SUB_SOURCE, message="last"))
+
+        inserts = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith('INSERT INTO "logs_log"')
+        ]
+        written = Log.objects.filter(sub_source=SUB_SOURCE).count()
+
+        self.manager.save_results(
+            status=written_early == 0 and written == BUFFER_SIZE and len(inserts) == 1,
+            test_name="Write buffer - one insert",
+            test_description=f"Add {BUFFER_SIZE} log rows over {BUFFER_SIZE - 1} requests with a buffer of {BUFFER_SIZE}",
+            output=f"Rows written before the buffer was full: {written_early}. "
+            f"Rows written after: {written}. Inserts: {len(inserts)}",
+        )
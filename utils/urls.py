@@ -1,8 +1,10 @@
 from django.urls import path
 
 import utils.views.cobalt_batch
+import utils.views.cobalt_jobs
 import utils.views.general
 import utils.views.monitoring
+import utils.views.sql_profiling
 import utils.views.slugs
 
 app_name = "utils"  # pylint: disable=invalid-name
@@ -14,6 +16,12 @@ urlpatterns = [
         name="geo_location",
     ),
     path("batch", utils.views.cobalt_batch.batch, name="batch"),
+    path("jobs", utils.views.cobalt_jobs.jobs, name="jobs"),
+    path(
+        "jobs/retry/<int:job_id>",
+        utils.views.cobalt_jobs.job_retry,
+        name="job_retry",
+    ),
     path("user-activity", utils.views.monitoring.user_activity, name="user_activity"),
     path("status", utils.views.monitoring.system_status, name="status"),
     path("statistics", utils.views.monitoring.system_statistics, name="statistics"),
@@ -59,6 +67,11 @@ urlpatterns = [
         utils.views.monitoring.admin_system_settings,
         name="admin_system_settings",
     ),
+    path(
+        "view-profiles",
+        utils.views.sql_profiling.view_profiles,
+        name="view_profiles",
+    ),
     path(
         "get-aws-environment-status",
         utils.views.monitoring.get_aws_environment_status_htmx,
@@ -69,6 +82,11 @@ urlpatterns = [
         utils.views.general.api_log_viewer,
         name="api_log_viewer",
     ),
+    path(
+        "api-rate-viewer",
+        utils.views.general.api_rate_viewer,
+        name="api_rate_viewer",
+    ),
     path(
         "admin-manage-slugs",
         utils.views.slugs.admin_manage_slugs,
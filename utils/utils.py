@@ -1,6 +1,12 @@
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+import datetime
 import decimal
+import json
 
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
 from django.http import HttpRequest
 
 from cobalt.settings import GLOBAL_CURRENCY_SYMBOL
@@ -35,6 +41,259 @@ def cobalt_paginator(
     return events
 
 
+KEYSET_EXACT_COUNT_BELOW = 10_000
+""" if the planner thinks there are fewer rows than this, count them properly """
+
+_KEYSET_CURSOR_SALT = "utils.cobalt_keyset_paginator"
+
+
+class _KeysetCursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder cuts datetimes to milliseconds, we need all of it or rows
+    a few microseconds apart get skipped"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class _KeysetCursorSerializer:
+    """JSON for signing.dumps that can handle dates and decimals"""
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=_KeysetCursorEncoder, separators=(",", ":")).encode(
+            "latin-1"
+        )
+
+    def loads(self, data):
+        return json.loads(data.decode("latin-1"))
+
+
+class KeysetPage:
+    """One page from cobalt_keyset_paginator. Iterates like a Django Page but there are no
+    page numbers, you move with next_cursor and previous_cursor.
+
+    count is None unless estimate_count was asked for. If count_is_estimate is True
+    it is the planner's guess, not an exact count."""
+
+    def __init__(
+        self,
+        object_list,
+        has_next,
+        has_previous,
+        next_cursor,
+        previous_cursor,
+        count=None,
+        count_is_estimate=False,
+    ):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+        self.count_is_estimate = count_is_estimate
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def _keyset_ordering(queryset):
+    """Get the ordering for a queryset as a list of (field, descending), ending in pk
+    so every row has a different position"""
+
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+
+    if not ordering:
+        raise ValueError("cobalt_keyset_paginator needs an ordered queryset")
+
+    keys = []
+    for field in ordering:
+        if not isinstance(field, str) or field.startswith("?"):
+            raise ValueError(f"cobalt_keyset_paginator can't order by {field}")
+        keys.append((field.lstrip("-"), field.startswith("-")))
+
+    if keys[-1][0] not in ["pk", "id"]:
+        keys.append(("pk", keys[-1][1]))
+
+    return keys
+
+
+def _keyset_value(obj, field):
+    for attribute in field.split("__"):
+        obj = getattr(obj, attribute)
+    return obj
+
+
+def _keyset_cursor(obj, keys):
+    ordering = [f"{'-' if descending else ''}{field}" for field, descending in keys]
+    values = [_keyset_value(obj, field) for field, _ in keys]
+
+    return signing.dumps(
+        {"o": ordering, "v": values},
+        salt=_KEYSET_CURSOR_SALT,
+        serializer=_KeysetCursorSerializer,
+        compress=True,
+    )
+
+
+def _keyset_cursor_values(cursor, keys):
+    """Decode a cursor, returns None if it is bad or for a different ordering"""
+
+    try:
+        data = signing.loads(
+            cursor, salt=_KEYSET_CURSOR_SALT, serializer=_KeysetCursorSerializer
+        )
+    except signing.BadSignature:
+        return None
+
+    ordering = [f"{'-' if descending else ''}{field}" for field, descending in keys]
+
+    if data.get("o") != ordering or len(data.get("v", [])) != len(keys):
+        return None
+
+    return data["v"]
+
+
+def _keyset_filter(keys, values, forwards):
+    """Build the filter for rows after (forwards) or before the row with these values.
+
+    For ordering a, b this is a > x OR (a = x AND b > y), with the directions flipped
+    for descending fields or going backwards. We also add a >= x on its own as Postgres
+    can use that to start the index scan in the right place."""
+
+    def _lookup(descending):
+        return "lt" if descending == forwards else "gt"
+
+    condition = Q()
+    equal_so_far = Q()
+
+    for (field, descending), value in zip(keys, values):
+        condition |= equal_so_far & Q(**{f"{field}__{_lookup(descending)}": value})
+        equal_so_far &= Q(**{field: value})
+
+    first_field, first_descending = keys[0]
+    bound = Q(**{f"{first_field}__{_lookup(first_descending)}e": values[0]})
+
+    return bound & condition
+
+
+def _keyset_estimated_count(queryset):
+    """Get the number of rows the planner expects the queryset to return. Much quicker
+    than counting for big tables, but only an estimate"""
+
+    sql, params = queryset.order_by().values("pk").query.sql_with_params()
+
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def cobalt_keyset_paginator(
+    request: HttpRequest,
+    queryset,
+    items_per_page: int = 30,
+    estimate_count: bool = False,
+) -> KeysetPage:
+    """Pagination for big querysets, using keyset (seek) pagination.
+
+    cobalt_paginator counts the whole list and uses OFFSET, so deep pages of a big table get
+    slower and slower. This instead remembers where the page ended (the cursor) and asks for
+    rows after that, which is the same speed on any page as long as there is an index
+    matching the ordering. There are no page numbers, only first, previous, next and last.
+
+    The queryset must be ordered by fields that are never null. pk is added to the end
+    of the ordering if it isn't there. Cursors are signed so they can't be tampered with.
+
+    The request can have after=<cursor>, before=<cursor> or last=1. Use
+    utils/pagination_keyset_footer.html or utils/pagination_keyset_footer_htmx.html
+    to show the links.
+
+    Args:
+        request(HTTPRequest): standard request object
+        queryset(QuerySet): ordered queryset to paginate
+        items_per_page(int): number of items on a page
+        estimate_count(bool): get an estimate of the total from the database planner
+            (exact if it is under KEYSET_EXACT_COUNT_BELOW)
+
+    Returns: KeysetPage
+    """
+
+    keys = _keyset_ordering(queryset)
+    order_by = [f"{'-' if descending else ''}{field}" for field, descending in keys]
+    reversed_order_by = [
+        f"{'' if descending else '-'}{field}" for field, descending in keys
+    ]
+
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    last = request.GET.get("last")
+
+    after_values = _keyset_cursor_values(after, keys) if after else None
+    before_values = _keyset_cursor_values(before, keys) if before else None
+
+    if after_values:
+        rows = list(
+            queryset.filter(_keyset_filter(keys, after_values, True)).order_by(
+                *order_by
+            )[: items_per_page + 1]
+        )
+        has_next = len(rows) > items_per_page
+        rows = rows[:items_per_page]
+        has_previous = True
+
+    elif before_values or last:
+        reversed_queryset = queryset.order_by(*reversed_order_by)
+        if before_values:
+            reversed_queryset = reversed_queryset.filter(
+                _keyset_filter(keys, before_values, False)
+            )
+        rows = list(reversed_queryset[: items_per_page + 1])
+        has_previous = len(rows) > items_per_page
+        rows = list(reversed(rows[:items_per_page]))
+        has_next = bool(before_values)
+
+    else:
+        rows = list(queryset.order_by(*order_by)[: items_per_page + 1])
+        has_next = len(rows) > items_per_page
+        rows = rows[:items_per_page]
+        has_previous = False
+
+    count = None
+    count_is_estimate = False
+    if estimate_count:
+        count = _keyset_estimated_count(queryset)
+        count_is_estimate = count >= KEYSET_EXACT_COUNT_BELOW
+        if not count_is_estimate:
+            count = queryset.count()
+
+    return KeysetPage(
+        rows,
+        has_next=has_next,
+        has_previous=has_previous,
+        next_cursor=_keyset_cursor(rows[-1], keys) if rows and has_next else None,
+        previous_cursor=_keyset_cursor(rows[0], keys)
+        if rows and has_previous
+        else None,
+        count=count,
+        count_is_estimate=count_is_estimate,
+    )
+
+
 def cobalt_round(number):
     """round up to 2 decimal places
 
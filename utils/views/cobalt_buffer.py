@@ -0,0 +1,160 @@
+""" Buffered bulk writes for high volume, low value rows such as logs
+
+    Rather than saving each row on the request path, rows are added to an in-process
+    buffer and written with one bulk_create when the buffer is big enough or old enough.
+    A background thread checks the age every BUFFER_CHECK_SECONDS so a quiet process
+    doesn't hold rows for long, and all buffers are written when the process exits.
+
+    Worker processes started by multiprocessing don't run atexit handlers, so anything
+    using a Pool should call flush_all_buffers() before the worker finishes.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.db import connection
+
+logger = logging.getLogger("cobalt")
+
+BUFFER_CHECK_SECONDS = 1
+""" how often the background thread looks for buffers that are old enough to write """
+
+_buffers = []
+""" every CobaltWriteBuffer in this process """
+
+_flusher_pid = None
+""" process the background thread was started in, it doesn't survive a fork """
+_flusher_lock = threading.Lock()
+
+
+def _flusher_loop():
+    """Background thread, writes any buffer that has waited long enough"""
+
+    while True:
+        time.sleep(BUFFER_CHECK_SECONDS)
+
+        flushed = False
+        for buffer in _buffers:
+            flushed = buffer.flush_if_due() or flushed
+
+        # this thread has its own database connection, don't hold it open when idle
+        if flushed:
+            connection.close()
+
+
+def _start_flusher():
+    """Start the background thread for this process if it isn't running"""
+
+    global _flusher_pid
+
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+
+    threading.Thread(
+        target=_flusher_loop, name="cobalt_buffer_flush", daemon=True
+    ).start()
+
+
+class CobaltWriteBuffer:
+    """Collect unsaved model instances and write them in bulk"""
+
+    def __init__(self, model, max_size=50, max_seconds=5):
+        """
+        Args:
+            model: the Django model to write
+            max_size: flush when this many rows are waiting
+            max_seconds: flush when the oldest row has been waiting this long
+        """
+
+        self.model = model
+        self.max_size = max_size
+        self.max_seconds = max_seconds
+        self._rows = []
+        self._started = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+        _buffers.append(self)
+
+    def _check_pid(self):
+        """A forked worker inherits a copy of the buffer, the parent will write those"""
+
+        if self._pid != os.getpid():
+            self._rows = []
+            self._started = None
+            self._pid = os.getpid()
+
+    def add(self, row):
+        """Add an unsaved instance, flushing if required"""
+
+        _start_flusher()
+
+        with self._lock:
+            self._check_pid()
+
+            if not self._rows:
+                self._started = time.monotonic()
+
+            self._rows.append(row)
+
+            flush_now = (
+                len(self._rows) >= self.max_size
+                or time.monotonic() - self._started >= self.max_seconds
+            )
+
+        if flush_now:
+            self.flush()
+
+    def flush_if_due(self):
+        """Write anything waiting if the oldest row has waited max_seconds. Returns True
+        if we wrote anything"""
+
+        with self._lock:
+            self._check_pid()
+            due = self._rows and time.monotonic() - self._started >= self.max_seconds
+
+        if due:
+            self.flush()
+
+        return bool(due)
+
+    def flush(self):
+        """Write anything waiting. Never raises, we don't want this to cause an outage"""
+
+        with self._lock:
+            self._check_pid()
+            rows = self._rows
+            self._rows = []
+            self._started = None
+
+        if not rows:
+            return
+
+        try:
+            self.model.objects.bulk_create(rows)
+        except Exception as exc:  # noqa
+            logger.error(
+                f"Unable to write {len(rows)} {self.model.__name__} rows in bulk: {exc}"
+            )
+
+            # Save what we can
+            for row in rows:
+                try:
+                    row.pk = None
+                    row.save()
+                except Exception as exc:  # noqa
+                    logger.error(f"Unable to write {self.model.__name__} {row}: {exc}")
+
+
+def flush_all_buffers():
+    """Flush every buffer"""
+
+    for buffer in _buffers:
+        buffer.flush()
+
+
+atexit.register(flush_all_buffers)
@@ -0,0 +1,67 @@
+""" Values shared by every process on every node
+
+    The default cache is in memory, per process, so it costs nothing to read but
+    deleting from it only affects this process. The few values every process must agree
+    on live in the "shared" cache (see CACHES in settings), which is a database table.
+
+    Mostly these are version numbers that are part of the keys in the default cache.
+    Bumping the version makes every process stop using its old entries. Reading the
+    shared cache is a query, so each process keeps a version for
+    SHARED_VERSION_LOCAL_SECONDS before reading it again, which is how long a change can
+    take to be seen by the other processes.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+
+SHARED_CACHE = "shared"
+""" alias in CACHES for values shared across nodes """
+
+SHARED_VERSION_LOCAL_SECONDS = 5
+""" how long a process uses a version before checking the shared cache again """
+
+_versions = {}
+""" name -> (time read, version) for versions read by this process """
+_versions_lock = threading.Lock()
+
+
+def shared_cache():
+    """Return the cache shared by every process"""
+
+    return caches[SHARED_CACHE]
+
+
+def _version_key(name):
+    return f"shared_version:{name}"
+
+
+def shared_version(name):
+    """Return the current version number for name, 0 if it has never been bumped"""
+
+    now = time.monotonic()
+
+    with _versions_lock:
+        read_at, version = _versions.get(name, (None, None))
+        if read_at is not None and now - read_at < SHARED_VERSION_LOCAL_SECONDS:
+            return version
+
+    version = shared_cache().get(_version_key(name), 0)
+
+    with _versions_lock:
+        _versions[name] = (now, version)
+
+    return version
+
+
+def shared_version_bump(name):
+    """Change the version number for name. This process sees it straight away, the
+    others within SHARED_VERSION_LOCAL_SECONDS"""
+
+    try:
+        shared_cache().incr(_version_key(name))
+    except ValueError:
+        shared_cache().set(_version_key(name), 1, None)
+
+    with _versions_lock:
+        _versions.pop(name, None)
@@ -0,0 +1,280 @@
+""" Database backed job queue
+
+    Replaces starting daemon threads from views. Threads had no retry and were lost
+    if the web worker was recycled, a Job row survives until a worker has run it.
+
+    To make a function runnable as a job decorate it with @cobalt_job. Its arguments
+    must be JSON serialisable, so pass ids rather than model instances:
+
+        @cobalt_job
+        def send_something(batch_id, addresses):
+            ...
+
+        queue_job(send_something, batch_id=batch.id, addresses=addresses)
+
+    Jobs are run by the run_cobalt_jobs management command (see utils/cron). Workers
+    claim jobs with SELECT ... FOR UPDATE SKIP LOCKED so any number of workers on any
+    number of nodes can run at once without taking the same job. Failed jobs are
+    retried with an increasing delay up to max_attempts.
+
+    While a job runs its worker updates heartbeat_time every JOB_HEARTBEAT_SECONDS. A
+    running job whose heartbeat stops is put back on the queue, however long the job
+    itself takes.
+
+    Long running jobs can call job_progress("...") to show how far they have got.
+"""
+import datetime
+import importlib
+import logging
+import threading
+import traceback
+
+from django.contrib.auth.decorators import user_passes_test
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.shortcuts import render, get_object_or_404, redirect
+from django.utils import timezone
+
+from cobalt.settings import HOSTNAME
+from utils.models import Job
+from utils.utils import cobalt_paginator
+
+logger = logging.getLogger("cobalt")
+
+JOB_RETRY_BASE_SECONDS = 30
+""" delay before the first retry, doubles with each attempt """
+
+JOB_HEARTBEAT_SECONDS = 30
+""" how often a worker records that it is still running a job """
+
+JOB_STALE_MINUTES = 5
+""" a running job with no heartbeat for this long is assumed to belong to a dead worker """
+
+JOB_REGISTRY = {}
+""" function path -> function for everything decorated with @cobalt_job """
+
+_running = threading.local()
+""" the job this thread is running, for job_progress() """
+
+
+def _function_path(function):
+    return f"{function.__module__}.{function.__name__}"
+
+
+def cobalt_job(function):
+    """Decorator to allow a function to be run by the job queue"""
+
+    JOB_REGISTRY[_function_path(function)] = function
+    return function
+
+
+def queue_job(
+    function,
+    priority=Job.PRIORITY_NORMAL,
+    max_attempts=3,
+    delay=None,
+    **kwargs,
+):
+    """Add a job to the queue
+
+    Args:
+        function: a function decorated with @cobalt_job
+        priority (int): higher numbers run first, see Job.PRIORITY_*
+        max_attempts (int): how many times to try before giving up
+        delay (timedelta): optional, don't run before now + delay
+        kwargs: arguments for the function, must be JSON serialisable
+
+    Returns:
+        Job: the queued job
+    """
+
+    function_path = _function_path(function)
+    if function_path not in JOB_REGISTRY:
+        raise ValueError(f"{function_path} is not decorated with @cobalt_job")
+
+    run_after = timezone.now() + delay if delay else timezone.now()
+
+    return Job.objects.create(
+        function=function_path,
+        kwargs=kwargs,
+        priority=priority,
+        max_attempts=max_attempts,
+        run_after=run_after,
+    )
+
+
+def _get_job_function(function_path):
+    """Import the module for a job and return the registered function"""
+
+    module_name, _, _ = function_path.rpartition(".")
+    importlib.import_module(module_name)
+
+    if function_path not in JOB_REGISTRY:
+        raise ValueError(f"{function_path} is not decorated with @cobalt_job")
+
+    return JOB_REGISTRY[function_path]
+
+
+def job_progress(message):
+    """Record progress for the job that is running. Does nothing if we are not
+    running as a job, so functions can also be called directly"""
+
+    job = getattr(_running, "job", None)
+    if not job:
+        return
+
+    job.progress = message[:200]
+    Job.objects.filter(pk=job.pk).update(
+        progress=job.progress, heartbeat_time=timezone.now()
+    )
+
+
+def claim_job():
+    """Take the next job off the queue and mark it as running. Returns None if
+    there is nothing to do. Jobs locked by other workers are skipped, not waited for.
+    """
+
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.STATUS_QUEUED, run_after__lte=timezone.now())
+            .order_by("-priority", "run_after", "pk")
+            .first()
+        )
+
+        if not job:
+            return None
+
+        job.status = Job.STATUS_RUNNING
+        job.attempts += 1
+        job.start_time = timezone.now()
+        job.end_time = None
+        job.progress = None
+        job.node = HOSTNAME
+        job.heartbeat_time = job.start_time
+        job.save()
+
+    return job
+
+
+def _start_heartbeat(job):
+    """Update heartbeat_time on a running job from a background thread until the
+    returned event is set"""
+
+    stop = threading.Event()
+
+    def _beat():
+        try:
+            while not stop.wait(JOB_HEARTBEAT_SECONDS):
+                Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING).update(
+                    heartbeat_time=timezone.now()
+                )
+        finally:
+            # this thread has its own database connection
+            connection.close()
+
+    threading.Thread(target=_beat, daemon=True).start()
+
+    return stop
+
+
+def run_job(job):
+    """Run a claimed job and record the outcome. Returns True if it succeeded"""
+
+    _running.job = job
+    heartbeat = _start_heartbeat(job)
+
+    try:
+        function = _get_job_function(job.function)
+        function(**job.kwargs)
+
+    except Exception as exc:  # noqa
+        job.last_error = traceback.format_exc()
+        job.end_time = timezone.now()
+
+        if job.attempts < job.max_attempts:
+            job.status = Job.STATUS_QUEUED
+            job.run_after = timezone.now() + datetime.timedelta(
+                seconds=JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1)
+            )
+            logger.warning(
+                f"Job {job.pk} {job.function} failed attempt {job.attempts}, will retry: {exc}"
+            )
+        else:
+            job.status = Job.STATUS_FAILED
+            logger.error(
+                f"Job {job.pk} {job.function} failed after {job.attempts} attempts: {exc}"
+            )
+
+        job.save()
+        return False
+
+    finally:
+        heartbeat.set()
+        _running.job = None
+
+    job.status = Job.STATUS_SUCCESS
+    job.end_time = timezone.now()
+    job.save()
+
+    return True
+
+
+def requeue_stale_jobs():
+    """Put back jobs whose worker died while running them, or fail them if they
+    have no attempts left. Returns the number requeued"""
+
+    stale_time = timezone.now() - datetime.timedelta(minutes=JOB_STALE_MINUTES)
+
+    # jobs started before heartbeats were added don't have one
+    stale_jobs = Job.objects.filter(status=Job.STATUS_RUNNING).filter(
+        Q(heartbeat_time__lt=stale_time)
+        | Q(heartbeat_time__isnull=True, start_time__lt=stale_time)
+    )
+
+    stale_jobs.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.STATUS_FAILED,
+        end_time=timezone.now(),
+        last_error="Worker stopped while running job",
+    )
+
+    return stale_jobs.update(status=Job.STATUS_QUEUED, run_after=timezone.now())
+
+
+@user_passes_test(lambda u: u.is_superuser)
+def jobs(request):
+    """Show the job queue, optionally filtered by status"""
+
+    status = request.GET.get("status")
+
+    job_list = Job.objects.all().order_by("-created_time")
+    if status:
+        job_list = job_list.filter(status=status)
+
+    things = cobalt_paginator(request, job_list)
+
+    return render(
+        request,
+        "utils/jobs.html",
+        {
+            "things": things,
+            "status": status,
+            "statuses": Job.STATUSES,
+            "searchparams": f"status={status}&" if status else "",
+        },
+    )
+
+
+@user_passes_test(lambda u: u.is_superuser)
+def job_retry(request, job_id):
+    """Put a failed job back on the queue"""
+
+    job = get_object_or_404(Job, pk=job_id)
+
+    if request.method == "POST" and job.status == Job.STATUS_FAILED:
+        job.status = Job.STATUS_QUEUED
+        job.attempts = 0
+        job.run_after = timezone.now()
+        job.save()
+
+    return redirect("utils:jobs")
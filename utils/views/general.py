@@ -11,9 +11,11 @@ from django.shortcuts import render
 from django.utils import timezone
 from geopy import Nominatim
 
+from accounts.models import APIToken
+from api.core import api_rate_summary, API_RATE_MINUTES, API_RATE_FLUSH_SECONDS
 from api.models import ApiLog
 from rbac.decorators import rbac_check_role
-from utils.utils import cobalt_paginator
+from utils.utils import cobalt_keyset_paginator
 
 
 @login_required()
@@ -85,7 +87,7 @@ def api_log_viewer(request):
 
     # Get all records
     api_logs = ApiLog.objects.order_by("-pk")
-    things = cobalt_paginator(request, api_logs)
+    things = cobalt_keyset_paginator(request, api_logs, estimate_count=True)
 
     # Get summary
     three_months_ago = timezone.now() - relativedelta(months=3)
@@ -102,6 +104,25 @@ def api_log_viewer(request):
     )
 
 
+@rbac_check_role("system.admin.edit")
+def api_rate_viewer(request):
+    """Show recent API call rates for each token. Counts are held in ApiRateCount,
+    see api.core.api_rate_count"""
+
+    api_tokens = APIToken.objects.select_related("user")
+    summary = api_rate_summary(api_tokens)
+
+    return render(
+        request,
+        "utils/api_rate_viewer.html",
+        {
+            "summary": summary,
+            "rate_minutes": API_RATE_MINUTES,
+            "flush_seconds": API_RATE_FLUSH_SECONDS,
+        },
+    )
+
+
 def timeout(request):
     """simulate a timeout for testing purposes"""
 
@@ -1,13 +1,16 @@
 import datetime
+import logging
 import os
 import re
 import subprocess
+import time
 
 import boto3
 import pytz
 from django.apps import apps
 from django.contrib.auth.decorators import login_required
 from django.db import connection, ProgrammingError
+from django.db.models.functions import TruncDate
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.urls import reverse
@@ -36,12 +39,15 @@ from rbac.views import get_rbac_statistics
 from results.views.core import get_results_statistics
 from support.helpdesk import get_support_statistics
 from utils.forms import SystemSettingsForm
+from utils.models import StatisticsSnapshot
 from utils.utils import cobalt_paginator
 
 from importlib import import_module
 
 # from importlib import import_module
 
+logger = logging.getLogger("cobalt")
+
 
 def _get_aws_environment():
     """Get the environment object if we can. There is no way to have AWS credentials with access only
@@ -598,39 +604,87 @@ def admin_system_settings(request):
     )
 
 
+STATISTICS_PRODUCERS = {
+    "user_statistics": get_user_statistics,
+    "event_statistics": get_event_statistics,
+    "payments_statistics": get_payments_statistics,
+    "notifications_statistics": get_notifications_statistics,
+    "forum_statistics": get_forum_statistics,
+    "org_statistics": get_org_statistics,
+    "rbac_statistics": get_rbac_statistics,
+    "support_statistics": get_support_statistics,
+    "logs_statistics": get_logs_statistics,
+    "results_statistics": get_results_statistics,
+    "session_statistics": get_session_statistics,
+    "active_club_statistics": get_active_club_statistics,
+}
+""" section of the statistics page -> function to calculate it """
+
+INCREMENTAL_STATISTICS = ["payments_statistics"]
+""" producers which accept their previous result and only calculate what has changed """
+
+STATISTICS_HISTORY_DAYS = 30
+
+
+def take_statistics_snapshot():
+    """Calculate all of the system statistics and save them as a StatisticsSnapshot.
+    Called by the take_statistics_snapshot command. A failing section is logged and
+    carried forward from the previous snapshot rather than losing the others."""
+
+    start_time = time.perf_counter()
+
+    previous_snapshot = StatisticsSnapshot.objects.order_by("-created_time").first()
+    previous = previous_snapshot.statistics if previous_snapshot else {}
+
+    statistics = {}
+
+    for section, producer in STATISTICS_PRODUCERS.items():
+        try:
+            if section in INCREMENTAL_STATISTICS:
+                statistics[section] = producer(previous=previous.get(section))
+            else:
+                statistics[section] = producer()
+        except Exception as exc:  # noqa
+            logger.error(f"Unable to calculate {section}: {exc}")
+            statistics[section] = previous.get(section, {})
+
+    return StatisticsSnapshot.objects.create(
+        statistics=statistics,
+        elapsed_seconds=time.perf_counter() - start_time,
+    )
+
+
 @login_required()
 def system_statistics(request):
-    """Basic statistics"""
-
-    user_statistics = get_user_statistics()
-    event_statistics = get_event_statistics()
-    payments_statistics = get_payments_statistics()
-    notifications_statistics = get_notifications_statistics()
-    forum_statistics = get_forum_statistics()
-    org_statistics = get_org_statistics()
-    rbac_statistics = get_rbac_statistics()
-    support_statistics = get_support_statistics()
-    logs_statistics = get_logs_statistics()
-    results_statistics = get_results_statistics()
-    session_statistics = get_session_statistics()
-    active_club_statistics = get_active_club_statistics()
+    """Basic statistics. These are read from the latest snapshot, see take_statistics_snapshot"""
+
+    snapshot = StatisticsSnapshot.objects.order_by("-created_time").first()
+
+    # first time through
+    if not snapshot:
+        snapshot = take_statistics_snapshot()
+
+    # one snapshot per day for the history
+    history = (
+        StatisticsSnapshot.objects.filter(
+            created_time__gte=timezone.now()
+            - datetime.timedelta(days=STATISTICS_HISTORY_DAYS)
+        )
+        .annotate(date=TruncDate("created_time"))
+        .order_by("-date", "-created_time")
+        .distinct("date")
+    )
 
     return render(
         request,
         "utils/monitoring/system_statistics.html",
         {
-            "user_statistics": user_statistics,
-            "event_statistics": event_statistics,
-            "payments_statistics": payments_statistics,
-            "notifications_statistics": notifications_statistics,
-            "forum_statistics": forum_statistics,
-            "org_statistics": org_statistics,
-            "rbac_statistics": rbac_statistics,
-            "support_statistics": support_statistics,
-            "logs_statistics": logs_statistics,
-            "results_statistics": results_statistics,
-            "session_statistics": session_statistics,
-            "active_club_statistics": active_club_statistics,
+            "snapshot": snapshot,
+            "history": history,
+            **{
+                section: snapshot.statistics.get(section, {})
+                for section in STATISTICS_PRODUCERS
+            },
         },
     )
 
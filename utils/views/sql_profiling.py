@@ -0,0 +1,257 @@
+""" Sampled per-view SQL profiling
+
+    SqlProfilingMiddleware (utils/middleware.py) measures a sample of requests and
+    calls record_request() with the view name, query counts and timings. Totals are
+    kept in memory and added to the ViewProfile row for each view and day at most once
+    a minute, so profiling costs a few queries a minute per process rather than a
+    write per request.
+
+    The table is bounded to one row per view per day for VIEW_PROFILE_DAYS days.
+
+    Profiling is off unless SQL_PROFILING_SAMPLE_RATE is set (e.g. 0.05 for 5%).
+"""
+import atexit
+import datetime
+import json
+import logging
+import threading
+import time
+
+from django.db import connection
+from django.shortcuts import render
+from django.utils import timezone
+
+from cobalt.settings import SQL_PROFILING_SAMPLE_RATE
+from rbac.decorators import rbac_check_role
+from utils.models import ViewProfile
+
+logger = logging.getLogger("cobalt")
+
+VIEW_PROFILE_DAYS = 14
+""" days of profiles to keep """
+
+VIEW_PROFILE_DAY_CHOICES = ["1", "7", "14"]
+""" periods the view profile page can show """
+
+VIEW_PROFILE_FLUSH_SECONDS = 60
+""" how often each process adds its totals to the database """
+
+_pending = {}
+""" view name -> unsaved ViewProfile holding totals since the last flush """
+
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_last_purge_date = None
+
+
+class QueryRecorder:
+    """Database execute wrapper (see connection.execute_wrapper) that counts queries,
+    repeated queries and time spent in the database"""
+
+    def __init__(self):
+        self.queries = 0
+        self.duplicates = 0
+        self.sql_seconds = 0
+        self._seen = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if sql in self._seen:
+            self.duplicates += 1
+        else:
+            self._seen.add(sql)
+
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - start_time
+
+
+def _latency_bucket(seconds):
+    """index into ViewProfile.latency_histogram for this request"""
+
+    milliseconds = seconds * 1000
+    for index, limit in enumerate(ViewProfile.LATENCY_BUCKETS_MS):
+        if milliseconds <= limit:
+            return index
+    return len(ViewProfile.LATENCY_BUCKETS_MS)
+
+
+def _empty_profile(view_name, date):
+    return ViewProfile(
+        view_name=view_name,
+        date=date,
+        latency_histogram=[0] * (len(ViewProfile.LATENCY_BUCKETS_MS) + 1),
+    )
+
+
+def _add_totals(profile, other):
+    """Add the totals from other into profile"""
+
+    profile.requests += other.requests
+    profile.queries += other.queries
+    profile.max_queries = max(profile.max_queries, other.max_queries)
+    profile.duplicate_queries += other.duplicate_queries
+    profile.sql_seconds += other.sql_seconds
+    profile.total_seconds += other.total_seconds
+    profile.max_seconds = max(profile.max_seconds, other.max_seconds)
+
+    # bucket list may be short if the buckets have changed
+    histogram = list(profile.latency_histogram) + [0] * (
+        len(other.latency_histogram) - len(profile.latency_histogram)
+    )
+    for index, count in enumerate(other.latency_histogram):
+        histogram[index] += count
+    profile.latency_histogram = histogram
+
+
+def record_request(view_name, recorder, total_seconds):
+    """Add one sampled request to the totals, flushing if it is time to"""
+
+    request_totals = _empty_profile(view_name, None)
+    request_totals.requests = 1
+    request_totals.queries = recorder.queries
+    request_totals.max_queries = recorder.queries
+    request_totals.duplicate_queries = recorder.duplicates
+    request_totals.sql_seconds = recorder.sql_seconds
+    request_totals.total_seconds = total_seconds
+    request_totals.max_seconds = total_seconds
+    request_totals.latency_histogram[_latency_bucket(total_seconds)] = 1
+
+    with _lock:
+        if view_name not in _pending:
+            _pending[view_name] = _empty_profile(view_name, None)
+        _add_totals(_pending[view_name], request_totals)
+
+        flush_now = time.monotonic() - _last_flush >= VIEW_PROFILE_FLUSH_SECONDS
+
+    if flush_now:
+        flush_view_profiles()
+
+
+def flush_view_profiles():
+    """Add the totals collected by this process to today's rows. Never raises"""
+
+    global _pending, _last_flush, _last_purge_date
+
+    with _lock:
+        pending = _pending
+        _pending = {}
+        _last_flush = time.monotonic()
+
+    if not pending:
+        return
+
+    today = timezone.localdate()
+    table = ViewProfile._meta.db_table
+
+    rows = [
+        (
+            view_name,
+            today,
+            totals.requests,
+            totals.queries,
+            totals.max_queries,
+            totals.duplicate_queries,
+            totals.sql_seconds,
+            totals.total_seconds,
+            totals.max_seconds,
+            json.dumps(totals.latency_histogram),
+        )
+        for view_name, totals in pending.items()
+    ]
+
+    try:
+        # Add to the totals from other processes in one statement. The histograms are
+        # added bucket by bucket and can be different lengths if the buckets change.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} AS profile (
+                    view_name, date, requests, queries, max_queries, duplicate_queries,
+                    sql_seconds, total_seconds, max_seconds, latency_histogram
+                )
+                VALUES {", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb)"] * len(rows))}
+                ON CONFLICT (view_name, date) DO UPDATE SET
+                    requests = profile.requests + EXCLUDED.requests,
+                    queries = profile.queries + EXCLUDED.queries,
+                    max_queries = GREATEST(profile.max_queries, EXCLUDED.max_queries),
+                    duplicate_queries = profile.duplicate_queries + EXCLUDED.duplicate_queries,
+                    sql_seconds = profile.sql_seconds + EXCLUDED.sql_seconds,
+                    total_seconds = profile.total_seconds + EXCLUDED.total_seconds,
+                    max_seconds = GREATEST(profile.max_seconds, EXCLUDED.max_seconds),
+                    latency_histogram = (
+                        SELECT jsonb_agg(
+                            COALESCE(saved.requests::int, 0) + COALESCE(added.requests::int, 0)
+                            ORDER BY bucket
+                        )
+                        FROM jsonb_array_elements_text(profile.latency_histogram)
+                            WITH ORDINALITY AS saved(requests, bucket)
+                        FULL JOIN jsonb_array_elements_text(EXCLUDED.latency_histogram)
+                            WITH ORDINALITY AS added(requests, bucket) USING (bucket)
+                    )
+                """,
+                [value for row in rows for value in row],
+            )
+
+        if _last_purge_date != today:
+            ViewProfile.objects.filter(
+                date__lt=today - datetime.timedelta(days=VIEW_PROFILE_DAYS)
+            ).delete()
+            _last_purge_date = today
+
+    except Exception as exc:  # noqa
+        logger.error(f"Unable to save view profiles: {exc}")
+
+
+atexit.register(flush_view_profiles)
+
+
+@rbac_check_role("system.admin.edit")
+def view_profiles(request):
+    """Rank views by p95 latency or queries per request over recent days"""
+
+    days = request.GET.get("days", "1")
+    days = int(days) if days in VIEW_PROFILE_DAY_CHOICES else 1
+    sort = request.GET.get("sort", "p95")
+
+    # Show what we have so far from this process too
+    flush_view_profiles()
+
+    profiles = {}
+    for profile in ViewProfile.objects.filter(
+        date__gt=timezone.localdate() - datetime.timedelta(days=days)
+    ):
+        if profile.view_name not in profiles:
+            profiles[profile.view_name] = _empty_profile(profile.view_name, None)
+        _add_totals(profiles[profile.view_name], profile)
+
+    profile_list = list(profiles.values())
+
+    if sort == "queries":
+        profile_list.sort(key=lambda profile: -profile.queries_per_request)
+    elif sort == "duplicates":
+        profile_list.sort(key=lambda profile: -profile.duplicates_per_request)
+    elif sort == "requests":
+        profile_list.sort(key=lambda profile: -profile.requests)
+    else:
+        # None (slower than the last bucket) sorts first
+        profile_list.sort(
+            key=lambda profile: (
+                -(profile.p95_ms or 10 ** 9),
+                -profile.average_ms,
+            )
+        )
+
+    return render(
+        request,
+        "utils/monitoring/view_profiles.html",
+        {
+            "profiles": profile_list[:100],
+            "days": days,
+            "sort": sort,
+            "sample_rate": SQL_PROFILING_SAMPLE_RATE,
+            "slowest_bucket": ViewProfile.LATENCY_BUCKETS_MS[-1],
+        },
+    )
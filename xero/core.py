@@ -1,32 +1,125 @@
+"""Xero API client
+
+    One XeroApi can be created per request or job, they are cheap. The expensive things are
+    shared by everything in the process:
+
+    - The HTTP session, so connections to Xero are kept open and reused (pooled).
+    - The access token. It is loaded from XeroCredentials once and held in memory until
+      TOKEN_EXPIRY_MARGIN seconds before it expires.
+
+    Refreshing the token is done by one caller at a time. Threads wait on a lock and processes
+    wait on a row lock on XeroCredentials. Whoever gets the lock second finds a fresh token and
+    uses it. This matters as Xero rotates the refresh token, so two refreshes at once would
+    leave one of them with a dead refresh token.
+
+    Contacts and invoices can be posted in Xero's batch form (many in one request), see
+    xero_api_post_batch.
+
+    The urls come from XERO_API_URL and XERO_IDENTITY_URL so this can be pointed at a local
+    stub server for testing.
+"""
 import json
 import logging
+import threading
+import time
 from datetime import timedelta
 
 import requests
 import base64
 
+from django.db import transaction
 from django.utils.timezone import now
-
-from cobalt.settings import XERO_CLIENT_ID, XERO_CLIENT_SECRET, XERO_TENANT_NAME
+from requests.adapters import HTTPAdapter
+
+from cobalt.settings import (
+    XERO_CLIENT_ID,
+    XERO_CLIENT_SECRET,
+    XERO_TENANT_NAME,
+    XERO_API_URL,
+    XERO_IDENTITY_URL,
+)
 from xero.models import XeroCredentials
 
 logger = logging.getLogger("etime")
 
+TOKEN_EXPIRY_MARGIN = 60
+""" treat the access token as expired this many seconds early """
+
+XERO_BATCH_SIZE = 50
+""" most items to send to Xero in one request, Xero recommends no more than 50 """
+
+MAX_RATE_LIMIT_WAIT = 60
+""" longest we will wait if Xero tells us to slow down (HTTP 429) """
+
+_session = None
+_session_lock = threading.Lock()
+
+_token = {}
+""" process wide copy of the credentials - access_token, refresh_token, tenant_id, expires """
+_token_lock = threading.Lock()
+
+
+def _get_session():
+    """Return the shared HTTP session, creating it if needed"""
+
+    global _session
+
+    with _session_lock:
+        if not _session:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+
+    return _session
+
+
+def _cache_credentials(credentials):
+    """Update the in memory copy of the credentials"""
+
+    _token.update(
+        {
+            "access_token": credentials.access_token,
+            "refresh_token": credentials.refresh_token,
+            "tenant_id": credentials.tenant_id,
+            "expires": credentials.expires,
+        }
+    )
+
+
+def _token_is_valid():
+    return bool(
+        _token.get("expires")
+        and _token["expires"] > now() + timedelta(seconds=TOKEN_EXPIRY_MARGIN)
+    )
+
+
+def clear_xero_token_cache():
+    """Forget the in memory credentials, they will be loaded again from the database"""
+
+    with _token_lock:
+        _token.clear()
+
 
 class XeroApi:
-    def __init__(self):
+    def __init__(self, api_url=None, identity_url=None):
 
-        # load credentials
-        credentials, _ = XeroCredentials.objects.get_or_create()
-        self.access_token = credentials.access_token
-        self.refresh_token = credentials.refresh_token
-        self.tenant_id = credentials.tenant_id
+        self.api_url = api_url or XERO_API_URL
+        self.identity_url = identity_url or XERO_IDENTITY_URL
+        self.session = _get_session()
+
+        # load credentials, only the first time in this process
+        if not _token:
+            with _token_lock:
+                if not _token:
+                    credentials, _ = XeroCredentials.objects.get_or_create()
+                    _cache_credentials(credentials)
 
         # Static data
         self.redirect_url = "http://localhost:8000/xero/callback"
-        self.token_refresh_url = "https://identity.xero.com/connect/token"
-        self.exchange_code_url = "https://identity.xero.com/connect/token"
-        self.connections_url = "https://api.xero.com/connections"
+        self.token_refresh_url = f"{self.identity_url}/connect/token"
+        self.exchange_code_url = f"{self.identity_url}/connect/token"
+        self.connections_url = f"{self.api_url}/connections"
         self.authorisation_url = "https://login.xero.com/identity/connect/authorize"
         self.scope = "offline_access accounting.transactions accounting.contacts payroll.employees payroll.payruns payroll.payslip payroll.timesheets payroll.settings"
         self.b64_id_secret = base64.b64encode(
@@ -34,6 +127,18 @@ class XeroApi:
         ).decode("utf-8")
         self.xero_auth_url = f"{self.authorisation_url}?response_type=code&client_id={XERO_CLIENT_ID}&redirect_uri={self.redirect_url}&scope={self.scope}&state=123"
 
+    @property
+    def access_token(self):
+        return _token.get("access_token", "")
+
+    @property
+    def refresh_token(self):
+        return _token.get("refresh_token", "")
+
+    @property
+    def tenant_id(self):
+        return _token.get("tenant_id", "")
+
     def headers(self):
         """return API headers"""
 
@@ -47,7 +152,7 @@ class XeroApi:
         """pass Xero an authorisation code and get an access token back"""
 
         # Now we need to exchange the code for a token
-        response = requests.post(
+        response = self.session.post(
             self.exchange_code_url,
             headers={"Authorization": f"Basic {self.b64_id_secret}"},
             data={
@@ -59,55 +164,86 @@ class XeroApi:
 
         json_response = response.json()
 
-        print(json_response)
-
-        access_token = json_response["access_token"]
-        refresh_token = json_response["refresh_token"]
-
-        credentials, _ = XeroCredentials.objects.get_or_create()
-        credentials.authorisation_code = authorisation_code
-        credentials.access_token = access_token
-        credentials.refresh_token = refresh_token
-        credentials.expires = now() + timedelta(seconds=json_response["expires_in"] - 2)
-        credentials.save()
-
-        self.access_token = access_token
-        self.refresh_token = refresh_token
+        with _token_lock, transaction.atomic():
+            credentials = self._locked_credentials()
+            credentials.authorisation_code = authorisation_code
+            credentials.access_token = json_response["access_token"]
+            credentials.refresh_token = json_response["refresh_token"]
+            credentials.expires = now() + timedelta(
+                seconds=json_response["expires_in"] - 2
+            )
+            credentials.save()
+            _cache_credentials(credentials)
 
         logger.info("Updated access token using authorisation code")
 
-    def refresh_xero_tokens(self):
-        """the access token expires quickly but can be reset using the refresh token"""
+    @staticmethod
+    def _locked_credentials():
+        """Get the credentials with a row lock, so only one process refreshes at a time.
+        Must be called inside a transaction."""
 
-        # See if still valid
-        credentials, _ = XeroCredentials.objects.get_or_create()
-        if credentials.expires and credentials.expires > now():
-            logger.info("Access token is still valid. Not refreshing.")
-            return {"message": "Access token is still valid. Not refreshing."}
+        XeroCredentials.objects.get_or_create()
+        return XeroCredentials.objects.select_for_update().first()
 
-        logger.info("Refreshing access token")
+    def refresh_xero_tokens(self, force=False):
+        """the access token expires quickly but can be reset using the refresh token
 
-        # Update access token using refresh token
-        response = requests.post(
-            self.token_refresh_url,
-            headers={
-                "Authorization": f"Basic {self.b64_id_secret}",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            data={"grant_type": "refresh_token", "refresh_token": self.refresh_token},
-        )
+        Args:
+            force (bool): refresh even if we think the token is still valid (e.g. Xero rejected it)
+        """
 
-        json_response = response.json()
-        if "access_token" not in json_response:
-            return json_response
+        message = {"message": "Access token is still valid. Not refreshing."}
 
-        credentials.access_token = json_response["access_token"]
-        credentials.expires = now() + timedelta(seconds=json_response["expires_in"] - 2)
-        credentials.refresh_token = json_response["refresh_token"]
-        credentials.save()
+        # See if still valid
+        if not force and _token_is_valid():
+            return message
+
+        with _token_lock:
+
+            # Someone else may have refreshed it while we waited for the lock
+            if not force and _token_is_valid():
+                return message
+
+            with transaction.atomic():
+                credentials = self._locked_credentials()
+
+                # Another process may have refreshed it, if so use theirs
+                if credentials.access_token != _token.get("access_token"):
+                    _cache_credentials(credentials)
+                    if _token_is_valid():
+                        logger.info("Access token refreshed by another process")
+                        return message
+
+                logger.info("Refreshing access token")
+
+                # Update access token using refresh token
+                response = self.session.post(
+                    self.token_refresh_url,
+                    headers={
+                        "Authorization": f"Basic {self.b64_id_secret}",
+                        "Content-Type": "application/x-www-form-urlencoded",
+                    },
+                    data={
+                        "grant_type": "refresh_token",
+                        "refresh_token": credentials.refresh_token,
+                    },
+                )
+
+                json_response = response.json()
+                if "access_token" not in json_response:
+                    logger.error(
+                        f"Unable to refresh Xero access token: {json_response}"
+                    )
+                    return json_response
+
+                credentials.access_token = json_response["access_token"]
+                credentials.expires = now() + timedelta(
+                    seconds=json_response["expires_in"] - 2
+                )
+                credentials.refresh_token = json_response["refresh_token"]
+                credentials.save()
 
-        self.access_token = credentials.access_token
-        self.refresh_token = credentials.refresh_token
+                _cache_credentials(credentials)
 
         return json_response
 
@@ -116,7 +252,7 @@ class XeroApi:
 
         logger.info("Getting tenants")
 
-        response = requests.get(
+        response = self.session.get(
             self.connections_url,
             headers={
                 "Authorization": f"Bearer {self.access_token}",
@@ -129,31 +265,141 @@ class XeroApi:
         for tenant in json_response:
 
             if tenant["tenantName"] == XERO_TENANT_NAME:
-                self.tenant_id = tenant["tenantId"]
-                credentials, _ = XeroCredentials.objects.get_or_create()
-                credentials.tenant_id = self.tenant_id
-                credentials.save()
+                with _token_lock:
+                    credentials, _ = XeroCredentials.objects.get_or_create()
+                    credentials.tenant_id = tenant["tenantId"]
+                    credentials.save()
+                    _cache_credentials(credentials)
                 logger.info(f"Updated tenant id for {XERO_TENANT_NAME}")
 
                 return
 
         logger.error(f"No tenants found matching {XERO_TENANT_NAME}")
 
+    def _url(self, url):
+        """urls can be full urls or paths on the api, e.g. /api.xro/2.0/Contacts"""
+
+        return url if url.startswith("http") else f"{self.api_url}{url}"
+
+    def _request(self, method, url, **kwargs):
+        """Make a call to the api. Retries once if the token has been rejected or
+        we have hit the rate limit. Returns the response."""
+
+        self.refresh_xero_tokens()
+        logger.info(f"{method} {url}")
+
+        response = self.session.request(
+            method, self._url(url), headers=self.headers(), **kwargs
+        )
+
+        if response.status_code == 401:
+            # Token may have been revoked early
+            self.refresh_xero_tokens(force=True)
+            response = self.session.request(
+                method, self._url(url), headers=self.headers(), **kwargs
+            )
+
+        elif response.status_code == 429:
+            wait = min(int(response.headers.get("Retry-After", 1)), MAX_RATE_LIMIT_WAIT)
+            logger.warning(f"Xero rate limit hit, waiting {wait} seconds")
+            time.sleep(wait)
+            response = self.session.request(
+                method, self._url(url), headers=self.headers(), **kwargs
+            )
+
+        return response
+
     def xero_api_get(self, url):
         """generic api call for GET"""
-        self.refresh_xero_tokens()
-        logger.info(url)
-        return requests.get(url, headers=self.headers()).json()
+
+        return self._request("GET", url).json()
 
     def xero_api_post(self, url, json_data):
         """generic api call for POST"""
 
-        self.refresh_xero_tokens()
-        print(json_data)
-        print(json.dumps(json_data))
+        logger.debug(json.dumps(json_data))
+
+        return self._request("POST", url, data=json.dumps(json_data)).json()
+
+    def xero_api_post_batch(self, url, key, items, batch_size=XERO_BATCH_SIZE):
+        """Post a list of items (e.g. Invoices) to Xero in its batch form, {key: [items]},
+        batch_size at a time.
+
+        We ask Xero not to summarise errors, so one bad item doesn't fail the others and
+        we get told which items failed.
+
+        Args:
+            url (str): url or api path e.g. /api.xro/2.0/Invoices
+            key (str): name of the list in the request and response e.g. Invoices
+            items (list): dicts in Xero's format
+            batch_size (int): items per request
+
+        Returns:
+            created (list): items as returned by Xero (with their new ids), in the same order as items
+            errors (list): one dict for each item that failed - index (in items), item and messages (list of str)
+        """
+
+        created = []
+        errors = []
+
+        for start in range(0, len(items), batch_size):
+            chunk = items[start : start + batch_size]
+
+            response = self._request(
+                "POST",
+                url,
+                params={"summarizeErrors": "false"},
+                data=json.dumps({key: chunk}),
+            )
+
+            try:
+                results = response.json().get(key)
+            except ValueError:
+                results = None
+
+            # Whole request failed, report it against every item in the chunk
+            if response.status_code != 200 or not results:
+                message = f"Xero returned {response.status_code}: {response.text[:200]}"
+                logger.error(f"Batch post to {url} failed. {message}")
+                errors.extend(
+                    {"index": start + offset, "item": item, "messages": [message]}
+                    for offset, item in enumerate(chunk)
+                )
+                continue
+
+            for offset, (item, result) in enumerate(zip(chunk, results)):
+                if result.get("StatusAttributeString") == "ERROR":
+                    errors.append(
+                        {
+                            "index": start + offset,
+                            "item": item,
+                            "messages": [
+                                validation_error.get("Message", "")
+                                for validation_error in result.get(
+                                    "ValidationErrors", []
+                                )
+                            ],
+                        }
+                    )
+                else:
+                    created.append(result)
+
+        logger.info(
+            f"Posted {len(items)} {key} to Xero. {len(created)} created, {len(errors)} errors"
+        )
 
-        logger.info(url)
+        return created, errors
 
-        return requests.post(
-            url, headers=self.headers(), data=json.dumps(json_data)
-        ).json()
+    def create_contacts(self, contacts, batch_size=XERO_BATCH_SIZE):
+        """Create or update contacts in batches, see xero_api_post_batch"""
+
+        return self.xero_api_post_batch(
+            "/api.xro/2.0/Contacts", "Contacts", contacts, batch_size
+        )
+
+    def create_invoices(self, invoices, batch_size=XERO_BATCH_SIZE):
+        """Create or update invoices in batches, see xero_api_post_batch"""
+
+        return self.xero_api_post_batch(
+            "/api.xro/2.0/Invoices", "Invoices", invoices, batch_size
+        )
@@ -0,0 +1,136 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from django.utils.timezone import now
+
+from tests.test_manager import CobaltTestManagerIntegration
+from xero.core import XeroApi, clear_xero_token_cache
+from xero.models import XeroCredentials
+
+
+class _StubXeroHandler(BaseHTTPRequestHandler):
+    """Pretends to be Xero. Hands out tokens and accepts batches of invoices,
+    rejecting any with a Reference of "bad". Counts the calls it gets."""
+
+    calls = {"token": 0, "invoices": 0}
+
+    def log_message(self, *args):
+        """Don't write to stderr"""
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlparse(self.path).path
+
+        if path == "/connect/token":
+            self.calls["token"] += 1
+            self._reply(
+                200,
+                {
+                    "access_token": f"access-{self.calls['token']}",
+                    "refresh_token": f"refresh-{self.calls['token']}",
+                    "expires_in": 1800,
+                },
+            )
+            return
+
+        if path == "/api.xro/2.0/Invoices":
+            self.calls["invoices"] += 1
+            results = []
+            for invoice in json.loads(body)["Invoices"]:
+                if invoice["Reference"] == "bad":
+                    invoice["StatusAttributeString"] = "ERROR"
+                    invoice["ValidationErrors"] = [{"Message": "Bad invoice"}]
+                else:
+                    invoice["StatusAttributeString"] = "OK"
+                    invoice["InvoiceID"] = f"id-{invoice['Reference']}"
+                results.append(invoice)
+            self._reply(200, {"Invoices": results})
+            return
+
+        self._reply(404, {})
+
+
+class XeroClientTests:
+    """Unit tests for the Xero client, run against a local stub server"""
+
+    def __init__(self, manager: CobaltTestManagerIntegration):
+        self.manager = manager
+
+    def xero_client(self):
+        """Tokens are only refreshed when needed and invoices go in batches"""
+
+        server = ThreadingHTTPServer(("localhost", 0), _StubXeroHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stub_url = f"http://localhost:{server.server_address[1]}"
+
+        try:
+            self._xero_client_tests(stub_url)
+        finally:
+            server.shutdown()
+            clear_xero_token_cache()
+
+    def _xero_client_tests(self, stub_url):
+
+        # Start with an expired token
+        credentials, _ = XeroCredentials.objects.get_or_create()
+        credentials.access_token = "expired"
+        credentials.refresh_token = "refresh-0"
+        credentials.expires = now() - timedelta(minutes=5)
+        credentials.save()
+        clear_xero_token_cache()
+
+        _StubXeroHandler.calls.update({"token": 0, "invoices": 0})
+
+        # 120 invoices, two of them bad
+        invoices = [{"Type": "ACCPAY", "Reference": f"{index}"} for index in range(120)]
+        invoices[7]["Reference"] = "bad"
+        invoices[99]["Reference"] = "bad"
+
+        xero = XeroApi(api_url=stub_url, identity_url=stub_url)
+        created, errors = xero.create_invoices(invoices)
+
+        # A second client in the same process should use the token we already have
+        XeroApi(api_url=stub_url, identity_url=stub_url).create_invoices(invoices[:1])
+
+        self.manager.save_results(
+            status=_StubXeroHandler.calls["token"] == 1,
+            test_name="Xero token refreshed once",
+            test_description="Two clients post invoices starting with an expired token. Token should only be refreshed once.",
+            output=f"Expected 1 token refresh, got {_StubXeroHandler.calls['token']}",
+        )
+
+        self.manager.save_results(
+            status=XeroCredentials.objects.first().access_token == "access-1",
+            test_name="Xero token saved",
+            test_description="The refreshed token should be saved for other processes",
+            output=f"Expected access-1, got {XeroCredentials.objects.first().access_token}",
+        )
+
+        self.manager.save_results(
+            status=_StubXeroHandler.calls["invoices"] == 4,
+            test_name="Xero invoices batched",
+            test_description="120 invoices in batches of 50 should take 3 requests, plus one for the second client",
+            output=f"Expected 4 requests, got {_StubXeroHandler.calls['invoices']}",
+        )
+
+        error_indexes = [error["index"] for error in errors]
+
+        self.manager.save_results(
+            status=len(created) == 118
+            and error_indexes == [7, 99]
+            and errors[0]["messages"] == ["Bad invoice"],
+            test_name="Xero invoice errors reported per item",
+            test_description="Two bad invoices should be reported with their positions and messages, the rest created",
+            output=f"Created {len(created)}, errors at {error_indexes}: {errors[:1]}",
+        )
@@ -71,7 +71,7 @@ def run_xero_api_htmx(request):
     json_data = {}
 
     if cmd == "list_clubs":
-        json_data = xero.xero_api_get("https://api.xero.com/api.xro/2.0/Contacts")
+        json_data = xero.xero_api_get("/api.xro/2.0/Contacts")
 
     if cmd == "create_club":
 
@@ -87,9 +87,7 @@ def run_xero_api_htmx(request):
             ]
         }
 
-        json_data = xero.xero_api_post(
-            "https://api.xero.com/api.xro/2.0/Contacts", json_data=json_data
-        )
+        json_data = xero.xero_api_post("/api.xro/2.0/Contacts", json_data=json_data)
 
         print(json_data)
 
@@ -128,9 +126,7 @@ def run_xero_api_htmx(request):
                 }
             ]
         }
-        json_data = xero.xero_api_post(
-            "https://api.xero.com/api.xro/2.0/Invoices", json_data=json_data
-        )
+        json_data = xero.xero_api_post("/api.xro/2.0/Invoices", json_data=json_data)
 
     response = render(request, "xero/json_data.html", {"json_data": json_data})
 